@@ -42,6 +42,7 @@ from route.get_dataset_id import bp as get_dataset_id_bp
 from route.get_datasets import bp as get_datasets_bp
 from route.upload_images import upload_bp
 from route.get_image_by_id import get_image_by_id_bp
+from route.inference_stats import bp as inference_stats_bp
 
 app.register_blueprint(index_bp)
 app.register_blueprint(build_index_bp)
@@ -52,6 +53,7 @@ app.register_blueprint(get_dataset_id_bp)
 app.register_blueprint(get_datasets_bp)
 app.register_blueprint(upload_bp)
 app.register_blueprint(get_image_by_id_bp)
+app.register_blueprint(inference_stats_bp)
 
 if __name__ == '__main__':
     # 创建必要目录
@@ -61,6 +63,10 @@ if __name__ == '__main__':
     
     # 确保数据库表已创建
     create_tables()
+
+    # 应用 app 角色的 CPU 预算（检索线程数 / CPU 核绑定）
+    from model_module.cpu_budget import apply_process_budget
+    apply_process_budget("app")
     
     app.run(debug=True, port=19198)
     # 运行 Flask 应用
@@ -6,10 +6,14 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from database_module.database import Database
 
+_COMPARE_OPS = ("=", "!=", "<", "<=", ">", ">=")
+
 def _build_where_clause(where):
     """
     构建 WHERE 子句和参数列表
-    :param where: 字典形式的查询条件，如 {'id': 1, 'name': 'John'}
+    :param where: 字典形式的查询条件，如 {'id': 1, 'name': 'John'}；
+                  值为 (运算符, 值) 元组时使用比较运算，如 {'id': ('>=', 100)}；
+                  运算符为 'IN' 时值为序列，如 {'id': ('IN', [1, 2, 3])}
     :return: (where_clause, params) 元组
     """
     if not where:
@@ -18,7 +22,21 @@ def _build_where_clause(where):
     clauses = []
     params = []
     for key, value in where.items():
-        clauses.append(f"{key} = ?")
+        if isinstance(value, tuple):
+            op, value = value
+            if op == "IN":
+                values = list(value)
+                if not values:
+                    clauses.append("0")  # 空集合不匹配任何记录
+                    continue
+                clauses.append(f"{key} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+                continue
+            if op not in _COMPARE_OPS:
+                raise ValueError(f"不支持的比较运算符: {op}")
+            clauses.append(f"{key} {op} ?")
+        else:
+            clauses.append(f"{key} = ?")
         params.append(value)
     where_clause = "WHERE " + " AND ".join(clauses)
     return where_clause, params
@@ -62,7 +80,28 @@ def query_multi(table, columns='*', where=None, order_by=None, limit=None):
     except Exception as e:
         print(f"查询失败: {str(e)}")
         return []
-        
+
+def iter_query(table, columns='*', where=None, order_by=None, chunk_size=1000):
+    """
+    分块查询多条记录，逐块产出，避免一次性读入全部结果
+    :param table: 表名
+    :param columns: 查询字段（默认为 '*'）
+    :param where: 查询条件（字典形式）
+    :param order_by: 排序字段（如 'id ASC'）
+    :param chunk_size: 每块记录数
+    :return: 生成器，每次产出 list of tuples
+    """
+    db = Database()
+    where_clause, params = _build_where_clause(where)
+    order_by_clause = f"ORDER BY {order_by}" if order_by else ""
+    query = f"SELECT {columns} FROM {table} {where_clause} {order_by_clause}"
+    cursor = db.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
 if __name__ == "__main__":
     # 查询单条记录
     user = query_one("users", where={"id": 1})
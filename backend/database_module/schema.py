@@ -39,10 +39,27 @@ def create_tables():
         )
     '''
     
+    # 重复检测结果表：每个数据集一条，记录已覆盖到的最大图片ID（水位线），供增量检测合并
+    duplicate_results_sql = '''
+        CREATE TABLE IF NOT EXISTS duplicate_results (
+        dataset_id INTEGER PRIMARY KEY,
+        threshold REAL NOT NULL,
+        min_group_similarity REAL,
+        metric TEXT NOT NULL,
+        watermark INTEGER NOT NULL,
+        image_count INTEGER NOT NULL DEFAULT 0,
+        edges BLOB,
+        groups_json TEXT,
+        updated_at DATETIME NOT NULL,
+        FOREIGN KEY (dataset_id) REFERENCES datasets(id) ON DELETE CASCADE
+        )
+    '''
+    
     try:
         # 执行建表语句
         db.execute(datasets_sql)
         db.execute(images_sql)
+        db.execute(duplicate_results_sql)
         db.commit()
         # print("数据库表已创建或已存在。")
     except Exception as e:
@@ -0,0 +1,206 @@
+"""
+autotune.py
+索引参数自动调优。
+对数据集特征抽样若干查询，用精确的 Flat 暴力检索计算真实近邻（ground truth），
+再遍历 IVF 聚类数 nlist、向量编码方式（SQ8/SQ4/Flat）与查询时的 nprobe
+（启用 config.INDEX_REDUCE 时候选结构都带相同的降维阶段，真实近邻仍按原始维度计算；
+度量与 config.INDEX_METRIC 一致，余弦度量时特征先归一化、候选索引使用内积），
+测量每种组合的 recall@k 与单查询延迟，选出满足目标召回率的最快配置，
+写入索引元数据文件的 "tuned" 字段：FaissIndexer 下一次构建索引时使用其索引结构，
+若当前索引结构与调优结果一致，则立即更新查询使用的 nprobe。
+"""
+import os
+import sys
+import time
+import math
+import faiss
+import numpy as np
+
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+from faiss_module.indexer import (load_index_meta, save_index_meta, reduction_prefix, index_metric,
+                                  faiss_metric, normalize_vectors)
+
+
+def _recall_at_k(result_ids, gt_ids, k):
+    """每个查询的前 k 个结果中命中真实近邻的比例，取平均"""
+    hits = 0
+    for found, truth in zip(result_ids, gt_ids):
+        hits += len(set(found[:k].tolist()) & set(truth[:k].tolist()))
+    return hits / float(len(gt_ids) * k)
+
+
+def _time_queries(index, queries, k, params=None):
+    """逐条查询（与在线检索一致）测量平均单查询延迟，返回 (labels, avg_ms)"""
+    labels = np.empty((queries.shape[0], k), dtype='int64')
+    start_time = time.perf_counter()
+    for i in range(queries.shape[0]):
+        if params is not None:
+            _, labels[i:i + 1] = index.search(queries[i:i + 1], k, params=params)
+        else:
+            _, labels[i:i + 1] = index.search(queries[i:i + 1], k)
+    avg_ms = (time.perf_counter() - start_time) * 1000.0 / queries.shape[0]
+    return labels, avg_ms
+
+
+def exact_ground_truth(features, queries, k, metric="L2"):
+    """
+    外部接口：Flat 暴力检索得到真实近邻（按 features 中的行号），同时作为延迟基线
+    :param metric: "L2" 或 "cosine"（features 与 queries 需已归一化）
+    :return: (gt_ids, avg_ms)
+    """
+    flat = faiss.IndexFlat(features.shape[1], faiss_metric(metric))
+    flat.add(features)
+    return _time_queries(flat, queries, k)
+
+
+def train_index(factory, train, features, metric="L2"):
+    """
+    外部接口：按 factory 字符串创建、训练索引并加入全部特征（标签为行号）
+    :param metric: "L2" 或 "cosine"（features 与 train 需已归一化）
+    :return: (index, build_seconds)
+    """
+    start_time = time.perf_counter()
+    index = faiss.index_factory(features.shape[1], factory, faiss_metric(metric))
+    if not index.is_trained:
+        index.train(train)
+    index.add(features)
+    return index, time.perf_counter() - start_time
+
+
+def evaluate_search(index, queries, gt_ids, k, nprobe=None):
+    """
+    外部接口：测量索引的 recall@k 与平均单查询延迟
+    :param nprobe: IVF 索引的探查聚类数，None 表示使用索引当前设置
+    :return: (recall, avg_ms)
+    """
+    params = faiss.SearchParametersIVF(nprobe=nprobe) if nprobe else None
+    labels, avg_ms = _time_queries(index, queries, k, params=params)
+    return _recall_at_k(labels, gt_ids, k), avg_ms
+
+
+def _nlist_candidates(num_data):
+    """以 √N 为中心的 nlist 候选值，每个聚类至少保留 39 个训练样本（FAISS 的建议下限）"""
+    base = math.sqrt(num_data)
+    upper = max(1, num_data // 39)
+    return sorted({max(1, min(upper, int(base * f))) for f in (0.25, 0.5, 1, 2, 4)})
+
+
+def _nprobe_candidates(nlist):
+    """1, 2, 4, ... 直到 nlist"""
+    values, nprobe = [], 1
+    while nprobe < nlist:
+        values.append(nprobe)
+        nprobe *= 2
+    values.append(nlist)
+    return values
+
+
+def autotune(features, target_recall=None, k=None, num_queries=None, encodings=None, train_size=None, seed=0,
+             metric=None):
+    """
+    在给定特征上搜索满足目标召回率的最快索引配置。
+    参数:
+        features (np.ndarray): shape=(N, dim) 的全部特征向量
+        target_recall (float): 目标 recall@k，默认 config.AUTOTUNE_TARGET_RECALL
+        k (int): 评估的近邻数，默认 config.AUTOTUNE_K
+        num_queries (int): 抽样查询数，默认 config.AUTOTUNE_QUERIES
+        encodings (List[str]): 候选向量编码，默认 config.AUTOTUNE_ENCODINGS
+        train_size (int): 训练样本数上限，默认 config.INDEX_TRAIN_SAMPLE_SIZE
+        metric (str): "L2" 或 "cosine"，默认与 config.INDEX_METRIC 一致
+    返回:
+        dict: best（最佳配置，含 factory/nlist/nprobe/recall/latency_ms/met_target/metric）与 trials（全部测量结果）
+    """
+    target_recall = target_recall or getattr(config, "AUTOTUNE_TARGET_RECALL", 0.95)
+    k = k or getattr(config, "AUTOTUNE_K", 10)
+    num_queries = num_queries or getattr(config, "AUTOTUNE_QUERIES", 200)
+    encodings = encodings or getattr(config, "AUTOTUNE_ENCODINGS", ["SQ8", "SQ4", "Flat"])
+    train_size = train_size or getattr(config, "INDEX_TRAIN_SAMPLE_SIZE", 50000)
+    metric = metric or index_metric()
+
+    if metric == "cosine":
+        features = normalize_vectors(features)
+    else:
+        features = np.ascontiguousarray(features, dtype='float32')
+    num_data, dim = features.shape
+    if num_data == 0:
+        raise ValueError("没有特征可用于调优")
+    k = min(k, num_data)
+    rng = np.random.default_rng(seed)
+    queries = features[rng.choice(num_data, size=min(num_queries, num_data), replace=False)]
+    train = features[rng.choice(num_data, size=min(train_size, num_data), replace=False)]
+
+    # 精确检索的结果作为真实近邻，同时作为延迟基线
+    gt_ids, flat_ms = exact_ground_truth(features, queries, k, metric)
+    trials = [{"factory": "Flat", "nlist": None, "nprobe": None, "recall": 1.0, "latency_ms": flat_ms}]
+    print(f"[√] 精确检索基线: {flat_ms:.3f} ms/查询（N={num_data}, k={k}, 查询数={queries.shape[0]}）")
+
+    prefix, _ = reduction_prefix(dim, num_data)
+    if prefix:
+        # 降维后的 Flat：只有降维带来的召回损失
+        index, _ = train_index(f"{prefix}Flat", train, features, metric)
+        recall, avg_ms = evaluate_search(index, queries, gt_ids, k)
+        trials.append({"factory": f"{prefix}Flat", "nlist": None, "nprobe": None, "recall": recall, "latency_ms": avg_ms})
+        print(f"  {prefix}Flat{'':<8} recall@{k}={recall:.4f} 延迟={avg_ms:.3f} ms")
+        del index
+
+    for encoding in encodings:
+        for nlist in _nlist_candidates(num_data):
+            factory = f"{prefix}IVF{nlist},{encoding}"
+            index, _ = train_index(factory, train, features, metric)
+            for nprobe in _nprobe_candidates(nlist):
+                recall, avg_ms = evaluate_search(index, queries, gt_ids, k, nprobe=nprobe)
+                trials.append({"factory": factory, "nlist": nlist, "nprobe": nprobe,
+                               "recall": recall, "latency_ms": avg_ms})
+                print(f"  {factory:<16} nprobe={nprobe:<5} recall@{k}={recall:.4f} 延迟={avg_ms:.3f} ms")
+                if recall >= target_recall:
+                    break  # 更大的 nprobe 只会更慢
+            del index
+
+    qualified = [t for t in trials if t["recall"] >= target_recall]
+    if qualified:
+        best = dict(min(qualified, key=lambda t: t["latency_ms"]), met_target=True)
+    else:
+        best = dict(max(trials, key=lambda t: (t["recall"], -t["latency_ms"])), met_target=False)
+    best.update({"k": k, "target_recall": target_recall, "metric": metric, "num_vectors": int(num_data),
+                 "num_queries": int(queries.shape[0]), "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+    return {"best": best, "trials": trials}
+
+
+def record_tuning(index_path, best):
+    """
+    把调优结果写入索引元数据。当前索引结构与调优结果一致时同时更新查询参数，
+    索引缓存检测到元数据变化后会重新加载，无需重建即可生效；否则在下一次构建时生效。
+    返回:
+        bool: 是否已对当前索引立即生效
+    """
+    meta = load_index_meta(index_path)
+    meta["tuned"] = best
+    applied = meta.get("factory") == f"IDMap,{best['factory']}" and \
+        meta.get("metric", "L2") == best.get("metric", "L2")
+    if applied and best.get("nprobe"):
+        meta["search_params"] = dict(meta.get("search_params") or {}, nprobe=best["nprobe"])
+    save_index_meta(index_path, meta)
+    return applied
+
+
+def tune_dataset_index(dataset_id, apply=True, **kwargs):
+    """
+    外部接口：对指定数据集调优并（可选）写入其索引元数据
+    :param dataset_id: 数据集ID
+    :param apply: 是否写入元数据
+    :param kwargs: 透传给 autotune 的参数
+    :return: autotune 的结果字典，附带 applied（当前索引是否已立即生效）
+    """
+    from index_manage_module.api import get_dataset_image_features
+    id_vector_pairs = get_dataset_image_features(dataset_id)
+    if not id_vector_pairs:
+        raise ValueError(f"数据集 {dataset_id} 没有图片特征")
+    features = np.stack([vec for _, vec in id_vector_pairs]).astype('float32')
+    result = autotune(features, **kwargs)
+    result["applied"] = False
+    if apply:
+        index_path = os.path.join(config.INDEX_FOLDER, f"{dataset_id}.index")
+        result["applied"] = record_tuning(index_path, result["best"])
+    return result
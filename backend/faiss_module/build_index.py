@@ -31,4 +31,25 @@ def build_index(features: np.ndarray, ids: np.ndarray, name: str):
 
     # 4. 保存索引test
     indexer.save_index()
-    print(f"索引已保存至 {index_path}")
\ No newline at end of file
+    print(f"索引已保存至 {index_path}")
+    return indexer.meta
+
+def build_index_from_chunks(chunk_source, name: str):
+    """
+    分块构建索引，特征无需一次性读入内存。
+    :param chunk_source: 每次调用返回一个新的 (ids, features) 块迭代器（会被调用两次）
+    :param name: 索引文件名
+    :return: 索引元数据（索引结构、向量数、查询参数等），没有数据时返回空字典
+    """
+    os.makedirs(config.INDEX_FOLDER, exist_ok=True)
+    index_path = os.path.join(config.INDEX_FOLDER, name)
+
+    indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=index_path, use_IVF=True)
+    num_data = indexer.build_index_from_chunks(chunk_source)
+    if num_data == 0:
+        print("没有有效图片可用于构建索引。")
+        return {}
+
+    indexer.save_index()
+    print(f"索引已保存至 {index_path}（共 {num_data} 条向量，{indexer.meta['factory']}）")
+    return indexer.meta
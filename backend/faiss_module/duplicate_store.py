@@ -0,0 +1,75 @@
+"""
+duplicate_store.py
+重复检测结果的持久化：每个数据集保存一份最近一次检测的重复边、分组与水位线（已覆盖的最大图片ID），
+增量检测时只需检索水位线之后新增的图片，再与保存的重复边合并重新聚类。
+"""
+import os
+import sys
+import json
+import datetime
+import numpy as np
+
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from database_module.database import Database
+from database_module.query import query_one
+
+
+def load_duplicate_result(dataset_id):
+    """
+    外部接口：读取数据集保存的重复检测结果
+    :return: dict（threshold / min_group_similarity / metric / watermark / image_count /
+             src / dst / components / groups / updated_at），没有保存时返回 None
+    """
+    row = query_one(
+        "duplicate_results",
+        columns="threshold, min_group_similarity, metric, watermark, image_count, edges, groups_json, updated_at",
+        where={"dataset_id": dataset_id}
+    )
+    if row is None:
+        return None
+    threshold, min_group_similarity, metric, watermark, image_count, edges, groups_json, updated_at = row
+    try:
+        groups = json.loads(groups_json) if groups_json else {}
+    except ValueError as e:
+        print(f"[!] 数据集 {dataset_id} 的重复检测结果损坏，忽略: {e}")
+        return None
+    edges = np.frombuffer(edges, dtype=np.int64).reshape(-1, 2) if edges else np.empty((0, 2), dtype=np.int64)
+    return {
+        "threshold": threshold,
+        "min_group_similarity": min_group_similarity,
+        "metric": metric,
+        "watermark": int(watermark),
+        "image_count": int(image_count),
+        "src": edges[:, 0].copy(),
+        "dst": edges[:, 1].copy(),
+        "components": groups.get("components", []),
+        "groups": groups.get("groups", []),
+        "updated_at": updated_at,
+    }
+
+
+def save_duplicate_result(dataset_id, threshold, min_group_similarity, metric, watermark, image_count,
+                          src, dst, components, groups):
+    """
+    外部接口：保存（覆盖）数据集的重复检测结果
+    :param watermark: 本次结果覆盖到的最大图片ID（不超过索引中的最大ID）
+    :param image_count: ID 不超过水位线的图片数，下次增量检测据此统计删除数
+    :param src, dst: 重复边（图片ID，src < dst）
+    :param components: 连通分量（直径约束拆分前）
+    :param groups: 最终返回的重复组
+    """
+    edges = np.stack([np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)], axis=1)
+    groups_json = json.dumps({"components": components, "groups": groups})
+    db = Database()
+    try:
+        db.execute(
+            "INSERT OR REPLACE INTO duplicate_results (dataset_id, threshold, min_group_similarity, metric, "
+            "watermark, image_count, edges, groups_json, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (dataset_id, float(threshold), min_group_similarity, metric, int(watermark), int(image_count),
+             edges.tobytes(), groups_json, datetime.datetime.now())
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
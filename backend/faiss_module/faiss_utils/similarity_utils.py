@@ -12,4 +12,59 @@ def distance_to_similarity_percent(distance_squared) -> float:
     if np.any(distance_squared < 0):
         raise ValueError("欧氏平方距离不能为负")
     similarity = np.exp(-distance_squared / (2 * sigma ** 2))
-    return similarity * 100
\ No newline at end of file
+    return similarity * 100
+
+
+def similarity_percent_to_distance(threshold) -> float:
+    """
+    distance_to_similarity_percent 的反函数：相似度阈值（百分制）-> 平方距离上限，
+    相似度 >= threshold 等价于平方距离 <= -2σ²·ln(threshold / 100)。
+    """
+    threshold = float(threshold)
+    if not 0 < threshold <= 100:
+        raise ValueError("相似度阈值必须在 (0, 100] 之间")
+    return -2 * SIMILARITY_SIGMA ** 2 * math.log(threshold / 100)
+
+
+def cosine_to_similarity_percent(cosine) -> float:
+    """
+    将余弦相似度（归一化特征上的内积）直接换算为百分比相似度 [0, 100]，不需要 sigma。
+    负相关视为 0。
+    """
+    cosine = np.asarray(cosine, dtype=np.float32)
+    return np.clip(cosine, 0.0, 1.0) * 100
+
+
+def higher_is_better(metric) -> bool:
+    """索引度量的分数是否越大越相似（cosine 为内积分数，L2 为距离）"""
+    return metric == "cosine"
+
+
+def score_to_similarity_percent(scores, metric="L2") -> float:
+    """
+    按索引元数据中记录的度量把 faiss 返回的分数换算为百分比相似度。
+    参数:
+        scores: faiss 返回的距离（L2）或内积（cosine）
+        metric (str): "L2" 或 "cosine"
+    """
+    if metric == "cosine":
+        return cosine_to_similarity_percent(scores)
+    if metric == "L2":
+        return distance_to_similarity_percent(scores)
+    raise ValueError(f"不支持的索引度量: {metric}")
+
+
+def similarity_threshold_to_radius(threshold, metric="L2") -> float:
+    """
+    相似度阈值（百分制）-> faiss range_search 的半径：
+    L2 为平方距离上限（结果距离小于半径），cosine 为内积下限（结果内积大于半径）。
+    半径向外放宽一个浮点精度，使恰好等于阈值的结果也被包含。
+    """
+    if metric == "cosine":
+        threshold = float(threshold)
+        if not 0 < threshold <= 100:
+            raise ValueError("相似度阈值必须在 (0, 100] 之间")
+        return float(np.nextafter(np.float32(threshold / 100), np.float32(-np.inf)))
+    if metric == "L2":
+        return float(np.nextafter(np.float32(similarity_percent_to_distance(threshold)), np.float32(np.inf)))
+    raise ValueError(f"不支持的索引度量: {metric}")
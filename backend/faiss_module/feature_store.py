@@ -0,0 +1,242 @@
+"""
+feature_store.py
+全精度特征存储，用于检索结果的精确重排序。
+IVF-SQ8 / PQ 等压缩索引返回的距离是量化后的近似值，相似度在阈值附近会有波动。
+每个索引版本旁保存一份加入索引时的 float32 特征（余弦度量为归一化后的特征）（{版本文件}.vectors.npy）及其图像 ID（{版本文件}.ids.npy），
+检索时先从压缩索引多取 k' 个候选，再以只读内存映射读取候选的原始向量计算精确距离（余弦度量为内积）重新排序，
+只有被访问的页进入内存，多个进程共享页缓存。
+增量更新不复制整份特征：新版本硬链接上一版本的基础段，只写出增量段（{版本文件}.delta.vectors.npy / .delta.ids.npy），
+增量段中的 ID 优先于基础段；增量段与基础段中的失效行累计超过基础段的一定比例时再整体压缩重写。
+"""
+import os
+import shutil
+import threading
+import numpy as np
+
+VECTORS_SUFFIX = ".vectors.npy"
+IDS_SUFFIX = ".ids.npy"
+DELTA_VECTORS_SUFFIX = ".delta.vectors.npy"
+DELTA_IDS_SUFFIX = ".delta.ids.npy"
+
+
+class FeatureStoreWriter:
+    """
+    分块写入特征存储：向量写入预分配的 .npy 内存映射文件，不在内存中累积全部特征。
+    先写到临时文件，commit 时随索引版本一起改名发布。
+    link_base 为上一版本的文件路径时，本写入器只写增量段，commit 时硬链接 link_base 的基础段。
+    """
+    def __init__(self, index_path, num, dim, link_base=None):
+        self.num = int(num)
+        self.dim = int(dim)
+        self.pos = 0
+        self.link_base = link_base
+        self._suffixes = (DELTA_VECTORS_SUFFIX, DELTA_IDS_SUFFIX) if link_base else (VECTORS_SUFFIX, IDS_SUFFIX)
+        # 同一进程内多个线程可能同时保存同一索引，临时文件名带上线程 ID
+        self._tmp_prefix = f"{index_path}.{os.getpid()}.{threading.get_ident()}.store.tmp"
+        self.vectors = None
+        if self.num:
+            self.vectors = np.lib.format.open_memmap(self._tmp_prefix + self._suffixes[0], mode="w+",
+                                                     dtype="float32", shape=(self.num, self.dim))
+        self.ids = np.empty(self.num, dtype="int64")
+
+    def add(self, ids, vectors):
+        """追加一块 (ids, vectors)"""
+        ids = np.asarray(ids, dtype="int64")
+        end = self.pos + ids.shape[0]
+        if end > self.num:
+            raise ValueError(f"特征存储写入超出预分配的 {self.num} 条")
+        if end > self.pos:
+            self.vectors[self.pos:end] = np.asarray(vectors, dtype="float32")
+            self.ids[self.pos:end] = ids
+        self.pos = end
+
+    def commit(self, version_file):
+        """把临时文件发布为 version_file 的特征存储（在切换清单之前调用）"""
+        if self.pos != self.num:
+            raise ValueError(f"特征存储只写入了 {self.pos}/{self.num} 条")
+        if self.link_base:
+            for suffix in (VECTORS_SUFFIX, IDS_SUFFIX):
+                _link_or_copy(self.link_base + suffix, version_file + suffix)
+        if not self.num:
+            return  # 没有增量，只发布基础段
+        self.vectors.flush()
+        self.vectors = None
+        np.save(self._tmp_prefix + self._suffixes[1], self.ids)
+        for suffix in self._suffixes:
+            with open(self._tmp_prefix + suffix, "rb+") as f:
+                os.fsync(f.fileno())
+            os.replace(self._tmp_prefix + suffix, version_file + suffix)
+
+    def discard(self):
+        """放弃写入并删除临时文件"""
+        self.vectors = None
+        for suffix in self._suffixes:
+            try:
+                os.remove(self._tmp_prefix + suffix)
+            except OSError:
+                pass
+
+
+def _link_or_copy(src, dst):
+    """硬链接已发布的只读文件（不复制数据）；文件系统不支持硬链接时复制"""
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class FeatureStore:
+    """
+    只读特征存储
+    属性:
+        ids (np.ndarray): 内存映射的图像 ID（基础段）
+        vectors (np.ndarray): 内存映射的 shape=(N, dim) float32 原始特征（基础段）
+        delta (FeatureStore): 增量段，没有时为 None
+        version_file (str): 所属的索引版本文件
+    """
+    def __init__(self, ids, vectors, delta=None, version_file=None):
+        self.ids = ids
+        self.vectors = vectors
+        self.delta = delta  # 增量段（FeatureStore），其中的 ID 优先于本段
+        self.version_file = version_file
+        # 按 ID 二分查找；数据库按 ID 升序写入时已有序，无需额外的排序数组
+        if ids.size > 1 and not np.all(ids[1:] > ids[:-1]):
+            self._order = np.argsort(ids, kind="stable")
+            self._sorted_ids = ids[self._order]
+        else:
+            self._order = None
+            self._sorted_ids = ids
+
+    @classmethod
+    def open(cls, version_file):
+        """打开版本文件旁的特征存储（含增量段），不存在或损坏时返回 None"""
+        base = cls._open_segment(version_file + VECTORS_SUFFIX, version_file + IDS_SUFFIX)
+        if base is None:
+            return None
+        if os.path.exists(version_file + DELTA_IDS_SUFFIX):
+            delta = cls._open_segment(version_file + DELTA_VECTORS_SUFFIX, version_file + DELTA_IDS_SUFFIX)
+            if delta is None:
+                return None  # 增量段损坏时基础段中的向量可能已过期，整体不可用
+            base.delta = delta
+        base.version_file = version_file
+        return base
+
+    @classmethod
+    def _open_segment(cls, vectors_path, ids_path):
+        """以只读内存映射打开一个段，不存在或损坏时返回 None"""
+        if not (os.path.exists(vectors_path) and os.path.exists(ids_path)):
+            return None
+        try:
+            ids = np.load(ids_path, mmap_mode="r")
+            vectors = np.load(vectors_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"[!] 读取特征存储 {vectors_path} 失败: {e}")
+            return None
+        if vectors.ndim != 2 or vectors.shape[0] != ids.shape[0]:
+            print(f"[!] 特征存储 {vectors_path} 与 ID 数量不一致，已忽略")
+            return None
+        return cls(ids, vectors)
+
+    def segments(self):
+        """按优先级排列的段：增量段在前，基础段在后"""
+        return ([self.delta] if self.delta is not None else []) + [self]
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    def rows(self, ids):
+        """
+        图像 ID -> 行号
+        :return: (rows, found)，found 为布尔掩码，未找到的位置 rows 无意义
+        """
+        ids = np.asarray(ids, dtype="int64")
+        if len(self) == 0:
+            return np.zeros(ids.shape, dtype="int64"), np.zeros(ids.shape, dtype=bool)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.minimum(pos, len(self) - 1)
+        found = self._sorted_ids[pos] == ids
+        rows = self._order[pos] if self._order is not None else pos
+        return rows, found
+
+    def _live_masks(self, exclude=None, include=None):
+        """每个段中有效行的掩码：被增量段覆盖、在 exclude 中或不在 include 中的行无效（只读取 ID 列）"""
+        exclude = np.asarray(sorted(exclude), dtype="int64") if exclude else np.empty(0, dtype="int64")
+        masks = []
+        for segment in self.segments():
+            ids = np.asarray(segment.ids)
+            mask = ~np.isin(ids, exclude)
+            if include is not None:
+                mask &= np.isin(ids, include)
+            masks.append((segment, mask))
+            exclude = np.union1d(exclude, ids)  # 较早的段中被覆盖的 ID
+        return masks
+
+    def count_live(self, exclude=None, include=None):
+        """iter_chunks 会产出的行数"""
+        return int(sum(mask.sum() for _, mask in self._live_masks(exclude, include)))
+
+    def iter_chunks(self, exclude=None, include=None, chunk_size=65536):
+        """
+        按块遍历有效的 (ids, vectors)：增量段优先，exclude 中的 ID 跳过，include 不为 None 时只保留其中的 ID
+        （增量更新时复制保留的向量）
+        """
+        for segment, mask in self._live_masks(exclude, include):
+            for start in range(0, len(segment), chunk_size):
+                keep = mask[start:start + chunk_size]
+                if keep.any():
+                    ids = np.asarray(segment.ids[start:start + chunk_size])[keep]
+                    yield ids, np.asarray(segment.vectors[start:start + chunk_size][keep], dtype="float32")
+
+
+def rerank_exact(queries, labels, distances, stores, k, metric="L2"):
+    """
+    用全精度特征对候选重新计算精确分数并取前 k 个：L2 度量为平方距离（越小越近），
+    cosine 度量为归一化向量的内积（越大越近），与索引返回的分数含义一致。
+    候选在所有特征存储中都找不到时（如旧索引没有特征存储）保留索引返回的近似距离。
+    参数:
+        queries (np.ndarray): shape=(n, dim) 的查询向量
+        labels (np.ndarray): shape=(n, k') 的候选图像 ID，-1 表示空位
+        distances (np.ndarray): shape=(n, k') 的近似距离
+        stores (List[FeatureStore]): 候选所在的特征存储（多数据集时每个分片一个）
+        k (int): 重排序后保留的结果数
+        metric (str): 索引度量，"L2" 或 "cosine"（queries 与特征存储均已归一化）
+    返回:
+        distances, labels: shape=(n, k)，空位与 FAISS 一致：ID 为 -1、分数为最差值（L2 为 float32 最大值，cosine 为最小值）
+    """
+    n, k_prime = labels.shape
+    similarity = metric == "cosine"
+    exact = np.array(distances, dtype="float32", copy=True)
+    valid = labels >= 0
+    exact[~valid] = np.finfo("float32").min if similarity else np.finfo("float32").max
+    flat_ids = labels.reshape(-1)
+    flat_exact = exact.reshape(-1)
+    query_rows = np.repeat(np.arange(n), k_prime)
+    pending = valid.reshape(-1).copy()
+    # 增量段先于基础段查找，被覆盖的 ID 使用新向量
+    segments = [segment for store in stores if store is not None for segment in store.segments()]
+    for store in segments:
+        if not pending.any():
+            break
+        positions = np.nonzero(pending)[0]
+        rows, found = store.rows(flat_ids[positions])
+        positions, rows = positions[found], rows[found]
+        if positions.size == 0:
+            continue
+        # 按行号排序读取，内存映射上顺序访问更快
+        order = np.argsort(rows, kind="stable")
+        positions, rows = positions[order], rows[order]
+        vectors = np.asarray(store.vectors[rows], dtype="float32")
+        if similarity:
+            flat_exact[positions] = np.einsum("ij,ij->i", vectors, queries[query_rows[positions]])
+        else:
+            diff = vectors - queries[query_rows[positions]]
+            flat_exact[positions] = np.einsum("ij,ij->i", diff, diff)
+        pending[positions] = False
+
+    k = min(k, k_prime)
+    top = np.argsort(-exact if similarity else exact, axis=1, kind="stable")[:, :k]
+    out_distances = np.take_along_axis(exact, top, axis=1)
+    out_labels = np.take_along_axis(labels, top, axis=1)
+    return out_distances, out_labels
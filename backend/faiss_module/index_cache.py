@@ -0,0 +1,205 @@
+"""
+index_cache.py
+进程级 FAISS 索引缓存。
+按索引文件路径缓存已加载的 FaissIndexer，避免每次查询都从磁盘 read_index；
+每次访问解析清单指向的当前版本文件，比对其路径、mtime、大小以及元数据文件的 mtime；
+发布了新版本（重建/增量更新）或调整了查询参数时，在后台线程加载新版本，加载完成前继续用旧版本服务查询，
+加载完成后原子替换（热切换），检索不会因重建而阻塞或失败。
+以索引文件大小估算内存占用，超出预算时按 LRU 淘汰，并统计命中率与加载耗时。
+多数据集联合检索使用的分片组合（ShardedIndex）按数据集组合缓存，任一分片热切换后自动重建组合。
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+from faiss_module.indexer import FaissIndexer
+from faiss_module.index_store import resolve_index_file
+from faiss_module.sharded_index import ShardedIndex
+
+# 缓存的数据集组合数上限（组合只引用已缓存的索引，本身几乎不占内存）
+_MAX_SHARD_SETS = 64
+
+
+class IndexCache:
+    """
+    FAISS 索引 LRU 缓存
+    属性:
+        max_bytes (int): 缓存索引总大小上限（按索引文件大小估算）
+    """
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(getattr(config, "INDEX_CACHE_MAX_MB", 1024) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # index_path -> (version, nbytes, indexer)
+        self._lock = threading.Lock()
+        self._reloading = set()  # 正在后台加载新版本的 index_path
+        self._shard_sets = OrderedDict()  # tuple(index_paths) -> ShardedIndex
+        self._resident_bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "stale_hits": 0, "reload_failures": 0,
+                       "evictions": 0, "loads": 0, "total_load_ms": 0.0,
+                       "shard_hits": 0, "shard_builds": 0}
+
+    @staticmethod
+    def _file_version(index_path):
+        """
+        索引版本：(当前版本文件, mtime_ns, size, 元数据 mtime_ns)，
+        发布新版本、文件被替换或查询参数被调整后会变化
+        """
+        index_file = resolve_index_file(index_path)
+        st = os.stat(index_file)
+        try:
+            meta_mtime = os.stat(index_file + ".meta.json").st_mtime_ns
+        except OSError:
+            meta_mtime = None
+        return (index_file, st.st_mtime_ns, st.st_size, meta_mtime)
+
+    def get(self, index_path, dim=None):
+        """
+        外部接口：获取已加载的索引。未缓存时同步加载；已缓存但有新版本时返回旧版本并在后台加载新版本
+        :param index_path: 逻辑索引路径
+        :param dim: 特征维度，默认 config.VECTOR_DIM
+        :return: FaissIndexer（调用方只应执行只读查询）
+        """
+        version = self._file_version(index_path)
+        with self._lock:
+            entry = self._entries.get(index_path)
+            if entry is not None:
+                self._entries.move_to_end(index_path)
+                if entry[0] == version:
+                    self._stats["hits"] += 1
+                    return entry[2]
+                if getattr(config, "INDEX_HOT_SWAP", True):
+                    # 热切换：旧版本继续服务，新版本在后台加载
+                    self._stats["stale_hits"] += 1
+                    if index_path not in self._reloading:
+                        self._reloading.add(index_path)
+                        threading.Thread(target=self._reload, args=(index_path, dim, version),
+                                         name="index-reload", daemon=True).start()
+                    return entry[2]
+                self._stats["reloads"] += 1
+            self._stats["misses"] += 1
+        return self._load(index_path, dim, version)
+
+    def _load(self, index_path, dim, version):
+        """从磁盘加载指定版本并放入缓存"""
+        start_time = time.time()
+        indexer = FaissIndexer(dim=dim or config.VECTOR_DIM, index_path=index_path, use_IVF=True)
+        indexer.load_index()
+        load_ms = (time.time() - start_time) * 1000.0
+        # 以实际加载的版本文件为准（检查与加载之间可能又发布了新版本）
+        if indexer.index_file != version[0]:
+            version = self._file_version(index_path)
+
+        with self._lock:
+            self._stats["loads"] += 1
+            self._stats["total_load_ms"] += load_ms
+            old = self._entries.pop(index_path, None)
+            if old is not None:
+                self._resident_bytes -= old[1]
+                self._drop_shard_sets_locked(old[2])
+            self._entries[index_path] = (version, version[2], indexer)
+            self._resident_bytes += version[2]
+            self._evict_locked(keep=index_path)
+        return indexer
+
+    def _reload(self, index_path, dim, version):
+        """后台线程：加载新版本后替换缓存条目，失败时保留旧版本继续服务"""
+        try:
+            self._load(index_path, dim, version)
+            with self._lock:
+                self._stats["reloads"] += 1
+        except Exception as e:
+            print(f"[!] 后台加载索引新版本 {version[0]} 失败，继续使用旧版本: {e}")
+            with self._lock:
+                self._stats["reload_failures"] += 1
+        finally:
+            with self._lock:
+                self._reloading.discard(index_path)
+
+    def get_shards(self, index_paths, dim=None):
+        """
+        外部接口：获取多个索引的并行检索组合，按数据集组合缓存
+        :param index_paths: 逻辑索引路径列表（顺序不影响结果）
+        :param dim: 特征维度，默认 config.VECTOR_DIM
+        :return: ShardedIndex
+        """
+        key = tuple(sorted(set(index_paths)))
+        indexers = tuple(self.get(path, dim) for path in key)
+        with self._lock:
+            sharded = self._shard_sets.get(key)
+            # 组合引用的索引对象都还是缓存中的当前版本时直接复用
+            if sharded is not None and all(a is b for a, b in zip(sharded.indexers, indexers)):
+                self._shard_sets.move_to_end(key)
+                self._stats["shard_hits"] += 1
+                return sharded
+        sharded = ShardedIndex(indexers, dim or config.VECTOR_DIM)
+        with self._lock:
+            self._shard_sets[key] = sharded
+            self._shard_sets.move_to_end(key)
+            while len(self._shard_sets) > _MAX_SHARD_SETS:
+                self._shard_sets.popitem(last=False)
+            self._stats["shard_builds"] += 1
+        return sharded
+
+    def invalidate(self, index_path=None):
+        """外部接口：移除指定索引（默认全部）的缓存"""
+        with self._lock:
+            self._shard_sets.clear()
+            if index_path is None:
+                self._entries.clear()
+                self._resident_bytes = 0
+                return
+            entry = self._entries.pop(index_path, None)
+            if entry is not None:
+                self._resident_bytes -= entry[1]
+
+    def _evict_locked(self, keep):
+        """超出内存预算时淘汰最久未使用的索引（刚加载的索引即使超出预算也保留）"""
+        while self._resident_bytes > self.max_bytes and len(self._entries) > 1:
+            path, entry = next(iter(self._entries.items()))
+            if path == keep:
+                self._entries.move_to_end(path)
+                continue
+            self._entries.pop(path)
+            self._resident_bytes -= entry[1]
+            self._drop_shard_sets_locked(entry[2])
+            self._stats["evictions"] += 1
+
+    def _drop_shard_sets_locked(self, indexer):
+        """移除引用了指定索引对象的分片组合，使被淘汰/替换的旧索引能被释放"""
+        for key in [k for k, sharded in self._shard_sets.items() if any(i is indexer for i in sharded.indexers)]:
+            del self._shard_sets[key]
+
+    def get_stats(self):
+        """外部接口：返回命中率、加载耗时与内存占用统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["shard_sets"] = len(self._shard_sets)
+            stats["resident_bytes"] = self._resident_bytes
+        # 热切换期间由旧版本服务的查询也算命中
+        served = stats["hits"] + stats["stale_hits"]
+        lookups = served + stats["misses"]
+        stats["hit_rate"] = served / lookups if lookups else 0.0
+        stats["avg_load_ms"] = stats["total_load_ms"] / stats["loads"] if stats["loads"] else 0.0
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+_index_cache = None
+_index_cache_lock = threading.Lock()
+
+
+def get_index_cache():
+    """外部接口：获取进程内共享的索引缓存"""
+    global _index_cache
+    if _index_cache is None:
+        with _index_cache_lock:
+            if _index_cache is None:
+                _index_cache = IndexCache()
+    return _index_cache
@@ -0,0 +1,186 @@
+"""
+index_store.py
+索引文件的版本化存储。
+逻辑索引路径（如 data/indexes/1.index）不再直接对应一个会被覆盖写的文件：
+- 每次保存写出新的版本文件 1.v{N}.index（及其 .meta.json 和全精度特征存储），先写临时文件、fsync 后原子改名
+- 清单文件 1.index.manifest.json 记录当前版本，同样原子替换，读取方看到的要么是旧版本要么是新版本
+- 旧版本保留 config.INDEX_KEEP_VERSIONS 个，正在使用（含 mmap）旧版本的进程不受影响
+没有清单文件的旧索引（直接存放在 1.index）仍可读取，首次保存新版本后被清理。
+"""
+import os
+import re
+import sys
+import json
+import time
+import glob
+import threading
+
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+
+_VERSION_RE = re.compile(r"\.v(\d+)\.index$")
+# 随版本文件一起发布和清理的附属文件（元数据、全精度特征存储）
+_COMPANION_SUFFIXES = (".meta.json", ".vectors.npy", ".ids.npy", ".delta.vectors.npy", ".delta.ids.npy")
+_manifest_cache = {}  # manifest_path -> (mtime_ns, manifest)
+_manifest_lock = threading.Lock()
+_publish_locks = {}  # index_path -> Lock，同一进程内串行发布同一索引，避免多个线程分配到相同的版本号
+
+
+def manifest_path(index_path):
+    """清单文件路径：{逻辑索引路径}.manifest.json"""
+    return index_path + ".manifest.json"
+
+
+def _version_file(index_path, version):
+    """版本文件路径：1.index -> 1.v{version}.index"""
+    base = index_path[:-len(".index")] if index_path.endswith(".index") else index_path
+    return f"{base}.v{version}.index"
+
+
+def read_manifest(index_path):
+    """读取清单（按 mtime 缓存，检索热路径上只需一次 stat），不存在时返回 None"""
+    path = manifest_path(index_path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _manifest_lock:
+        cached = _manifest_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[!] 读取索引清单 {path} 失败: {e}")
+        return None
+    with _manifest_lock:
+        _manifest_cache[path] = (mtime, manifest)
+    return manifest
+
+
+def resolve_index_file(index_path):
+    """
+    外部接口：逻辑索引路径 -> 当前版本的实际文件路径
+    有清单时返回清单指向的版本文件，否则返回 index_path 本身（旧索引或已是版本文件）
+    """
+    manifest = read_manifest(index_path)
+    if manifest and manifest.get("current"):
+        return os.path.join(os.path.dirname(index_path), manifest["current"])
+    return index_path
+
+
+def index_exists(index_path):
+    """外部接口：逻辑索引当前是否有可读取的版本"""
+    return os.path.exists(resolve_index_file(index_path))
+
+
+def list_indexes(folder=None):
+    """外部接口：列出目录下全部逻辑索引路径（不含各历史版本文件）"""
+    folder = folder or config.INDEX_FOLDER
+    paths = set(p[:-len(".manifest.json")] for p in glob.glob(os.path.join(folder, "*.index.manifest.json")))
+    paths.update(p for p in glob.glob(os.path.join(folder, "*.index")) if not _VERSION_RE.search(p))
+    return sorted(p for p in paths if index_exists(p))
+
+
+def _fsync_file(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(folder):
+    """改名操作持久化需要同步目录（Windows 不支持打开目录，跳过）"""
+    if os.name != "posix":
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _tmp_path(path):
+    """临时文件路径：包含进程 ID 与线程 ID，同一进程的多个线程并发写同一文件时互不覆盖"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_json_atomic(path, data):
+    """外部接口：写临时文件、fsync 后原子替换"""
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _existing_versions(index_path):
+    """目录中该索引已有的版本号（升序）"""
+    folder = os.path.dirname(index_path) or "."
+    prefix = os.path.basename(_version_file(index_path, 0))[:-len("0.index")]  # 如 "1.v"
+    versions = []
+    for name in os.listdir(folder) if os.path.isdir(folder) else []:
+        number = name[len(prefix):-len(".index")]
+        if name.startswith(prefix) and name.endswith(".index") and number.isdigit():
+            versions.append(int(number))
+    return sorted(versions)
+
+
+def publish_index(index_path, write_index, meta, write_extras=None):
+    """
+    外部接口：以新版本发布索引
+    :param index_path: 逻辑索引路径
+    :param write_index: write_index(path) 把索引写到指定路径（如 lambda p: faiss.write_index(index, p)）
+    :param meta: 索引元数据，写入新版本的 .meta.json
+    :param write_extras: 可选，write_extras(version_file) 在切换清单前写出附属文件（如特征存储）
+    :return: 新版本的实际文件路径
+    """
+    with _manifest_lock:
+        lock = _publish_locks.setdefault(os.path.abspath(index_path), threading.Lock())
+    with lock:
+        return _publish_locked(index_path, write_index, meta, write_extras)
+
+
+def _publish_locked(index_path, write_index, meta, write_extras):
+    """publish_index 的实现，调用方需持有该索引的发布锁"""
+    folder = os.path.dirname(index_path) or "."
+    manifest = read_manifest(index_path) or {}
+    version = max([manifest.get("version", 0)] + _existing_versions(index_path)) + 1
+    version_file = _version_file(index_path, version)
+
+    # 1. 写索引与元数据到版本文件（临时文件 + fsync + 改名）
+    tmp_path = _tmp_path(version_file)
+    write_index(tmp_path)
+    _fsync_file(tmp_path)
+    os.replace(tmp_path, version_file)
+    write_json_atomic(version_file + ".meta.json", meta)
+    if write_extras is not None:
+        write_extras(version_file)
+
+    # 2. 原子切换清单指向新版本
+    write_json_atomic(manifest_path(index_path), {
+        "current": os.path.basename(version_file),
+        "version": version,
+        "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    _fsync_dir(folder)
+
+    # 3. 清理旧版本和无清单时代的旧索引文件
+    _prune_versions(index_path, version)
+    return version_file
+
+
+def _prune_versions(index_path, current_version):
+    """保留最近 config.INDEX_KEEP_VERSIONS 个版本；已被其他进程打开/映射的文件在其关闭前仍可用"""
+    keep = max(1, getattr(config, "INDEX_KEEP_VERSIONS", 2))
+    stale = [v for v in _existing_versions(index_path) if v <= current_version - keep]
+    # 旧格式（无版本号）的索引文件也一并清理
+    for path in [_version_file(index_path, v) for v in stale] + [index_path]:
+        for p in (path,) + tuple(path + suffix for suffix in _COMPANION_SUFFIXES):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[!] 清理旧索引文件 {p} 失败: {e}")
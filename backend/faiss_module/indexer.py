@@ -3,28 +3,317 @@ indexer.py
 使用 Faiss 实现图像特征索引构建和查询的模块。
 它支持压缩、PCA降维、倒排索引（IVF）和ID映射（IDMap）等多级结构，适合中大型图像搜索场景。
 主要功能：
-- 建立带ID的Faiss索引（支持训练与压缩）
-- 加载与保存索引
-- 执行向量查询并返回相似项ID
+- 建立带ID的Faiss索引（支持训练与压缩），按数据量与内存预算自动选择 Flat / IVF-SQ8 / IVF-PQ / HNSW
+- 加载与保存索引（版本化文件 + 清单，见 index_store.py），查询参数（nprobe 等）保存在版本文件的 .meta.json 元数据中
+- 执行向量查询并返回相似项ID，支持单次查询覆盖 nprobe
+- 支持 L2 与余弦（归一化特征 + 内积）两种度量，度量记录在元数据中，查询时按索引自身的度量处理
+- 可选保存全精度特征存储（见 feature_store.py），查询时对多取的候选做精确 L2 重排序
 """
 import faiss
 import numpy as np
 import os
+import sys
+import re
+import json
 import math
+
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+from faiss_module.index_store import resolve_index_file, publish_index, write_json_atomic
+from faiss_module.feature_store import FeatureStore, FeatureStoreWriter, rerank_exact
+
+
+def load_index_meta(index_path):
+    """读取索引当前版本的元数据文件 {版本文件}.meta.json，不存在或损坏时返回空字典"""
+    meta_path = resolve_index_file(index_path) + ".meta.json"
+    if not os.path.exists(meta_path):
+        return {}
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[!] 读取索引元数据 {meta_path} 失败: {e}")
+        return {}
+
+
+def save_index_meta(index_path, meta):
+    """改写索引当前版本的元数据文件（原子替换，读取方不会看到写了一半的文件）"""
+    write_json_atomic(resolve_index_file(index_path) + ".meta.json", meta)
+
+
+def index_metric():
+    """配置的索引度量：config.INDEX_METRIC 为 "cosine" 时返回 "cosine"，否则为 "L2" """
+    return "cosine" if str(getattr(config, "INDEX_METRIC", "l2")).lower() == "cosine" else "L2"
+
+
+def faiss_metric(metric):
+    """元数据中的度量名 -> FAISS 度量常量（余弦在归一化向量上用内积计算）"""
+    return faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+
+
+def normalize_vectors(vectors):
+    """返回 L2 归一化后的 float32 副本，不修改输入"""
+    vectors = np.array(vectors, dtype='float32', order='C', copy=True)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+# FAISS k-means 每个聚类至少需要的训练点数，少于该值时聚类质量下降并给出警告
+MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nprobe(nlist):
+    """IVF 默认 nprobe：config.INDEX_NPROBE，未设置时取 nlist 的 10%"""
+    return min(nlist, getattr(config, "INDEX_NPROBE", None) or max(1, math.ceil(nlist * 0.1)))
+
+
+def _pq_subquantizers(dim, max_bytes):
+    """PQ 子量化器个数 m（每个向量 m 字节）：取能整除 dim 且不超过字节预算的最大值，至少为 8"""
+    for m in (128, 64, 32, 16, 8):
+        if dim % m == 0 and m <= max_bytes:
+            return m
+    return 8 if dim % 8 == 0 else 1
+
+
+def reduction_prefix(dim, num_data=None):
+    """
+    降维预处理阶段的 factory 前缀，由 config.INDEX_REDUCE（None / "pca" / "opq"）与 config.INDEX_REDUCED_DIM 决定。
+    降维变换在构建时随索引一起训练并保存在索引内部，查询向量在 search 时自动经过同一变换。
+    参数:
+        dim (int): 原始维度
+        num_data (int): 训练数据量，少于降维后维度时无法训练，不做降维
+    返回:
+        (prefix, reduced_dim): 如 ("PCA256,", 256)；未启用时为 ("", dim)
+    """
+    reduce = (getattr(config, "INDEX_REDUCE", None) or "").lower()
+    if not reduce:
+        return "", dim
+    if reduce not in ("pca", "opq"):
+        raise ValueError(f"未知的降维方式 '{reduce}'，可选: pca, opq")
+    reduced_dim = int(getattr(config, "INDEX_REDUCED_DIM", 256))
+    if not 0 < reduced_dim < dim:
+        print(f"[!] INDEX_REDUCED_DIM={reduced_dim} 不小于原始维度 {dim}，不做降维")
+        return "", dim
+    if num_data is not None and num_data < reduced_dim:
+        print(f"[!] 数据量 {num_data} 少于降维后维度 {reduced_dim}，不做降维")
+        return "", dim
+    if reduce == "pca":
+        return f"PCA{reduced_dim},", reduced_dim
+    m = _pq_subquantizers(reduced_dim, reduced_dim // 4)
+    return f"OPQ{m}_{reduced_dim},", reduced_dim
+
+
+def parse_reduction(factory):
+    """从 factory 字符串解析降维阶段，返回 {"type": "pca"/"opq", "dim": d}，无降维时返回 None"""
+    m = re.search(r"(?:^|,)(PCA|OPQ\d+_)(\d+),", factory)
+    if not m:
+        return None
+    return {"type": "pca" if m.group(1) == "PCA" else "opq", "dim": int(m.group(2))}
+
+
+def choose_index_factory(num_data, dim):
+    """
+    按数据量与内存预算选择索引结构。
+    - 数据量不超过 config.INDEX_FLAT_MAX_VECTORS：Flat 精确检索，无需训练
+    - 中等规模且 SQ8 编码（每维 1 字节）不超过 config.INDEX_MEMORY_BUDGET_MB：IVF√N,SQ8
+    - 大规模（不少于 config.INDEX_LARGE_MIN_VECTORS）或 SQ8 超出预算：
+      config.INDEX_LARGE_TYPE 为 "hnsw" 且预算允许时使用 HNSW{M},SQ8（低延迟、不支持删除），
+      否则使用 OPQ{m},IVF{4√N},PQ{m}，m 按每向量字节预算选取
+    启用 config.INDEX_REDUCE 时在以上结构前加入 PCA/OPQ 降维阶段，内存估算按降维后维度计算。
+    config.INDEX_TYPE 不为 "auto" 时直接使用其中的 factory 字符串（不含 IDMap 前缀）。
+    参数:
+        num_data (int): 向量数量
+        dim (int): 向量维度
+    返回:
+        (factory, nlist, search_params, index_type): factory 字符串、IVF 聚类数（非 IVF 为 None）、
+        默认查询参数、索引类型名（flat / ivf_sq8 / ivf_pq / hnsw / custom）
+    """
+    index_type = getattr(config, "INDEX_TYPE", "auto")
+    if index_type and index_type != "auto":
+        m = re.search(r"IVF(\d+)", index_type)
+        nlist = int(m.group(1)) if m else None
+        params = {"nprobe": default_nprobe(nlist)} if nlist else {}
+        return index_type, nlist, params, "custom"
+
+    budget = getattr(config, "INDEX_MEMORY_BUDGET_MB", 4096) * 1024 * 1024
+    prefix, dim = reduction_prefix(dim, num_data)
+    if num_data <= getattr(config, "INDEX_FLAT_MAX_VECTORS", 10000):
+        return f"{prefix}Flat", None, {}, "flat"
+
+    large = num_data >= getattr(config, "INDEX_LARGE_MIN_VECTORS", 1000000)
+    if not large and num_data * dim <= budget:
+        nlist = max(1, int(math.sqrt(num_data)))
+        return f"{prefix}IVF{nlist},SQ8", nlist, {"nprobe": default_nprobe(nlist)}, "ivf_sq8"
+
+    hnsw_m = getattr(config, "INDEX_HNSW_M", 32)
+    # HNSW 每个向量：SQ8 编码 dim 字节 + 约 2M 个 int32 邻接表
+    if getattr(config, "INDEX_LARGE_TYPE", "ivfpq") == "hnsw" and num_data * (dim + hnsw_m * 2 * 4) <= budget:
+        return (f"{prefix}HNSW{hnsw_m},SQ8", None,
+                {"efSearch": getattr(config, "INDEX_HNSW_EF_SEARCH", 64)}, "hnsw")
+
+    nlist = max(1, min(int(4 * math.sqrt(num_data)), num_data // MIN_POINTS_PER_CENTROID))
+    m = _pq_subquantizers(dim, max(1, budget // num_data))
+    if prefix.startswith("OPQ"):
+        prefix = f"OPQ{m}_{dim},"  # OPQ 旋转与 PQ 使用相同的子空间划分
+    elif not prefix:
+        prefix = f"OPQ{m},"
+    return f"{prefix}IVF{nlist},PQ{m}", nlist, {"nprobe": default_nprobe(nlist)}, "ivf_pq"
+
+
 class FaissIndexer:
     """
        FaissIndexer 类用于构建、保存、加载和查询 FAISS 索引。
        属性:
            dim (int): 特征维度，例如2048。
-           index_path (str): 索引文件保存路径。
-           use_IVF (bool): 是否启用 IVF 聚类（默认启用）。
+           index_path (str): 逻辑索引路径，实际读写的是清单指向的版本文件。
+           use_IVF (bool): 是否按数据量自动选择索引结构（IVF 等），False 时固定使用 Flat 精确检索。
            index: FAISS 索引对象。
+           mmap (bool): 当前索引是否以只读内存映射方式加载。
+           meta (dict): 索引元数据（索引结构、nlist、nprobe 等），随索引一起保存与加载。
+           feature_store: 当前版本的全精度特征存储，首次重排序时打开，没有时为 None。
     """
     def __init__(self, dim, index_path, use_IVF):
         self.dim = dim
         self.index_path = index_path
         self.use_IVF = use_IVF
         self.index = None
+        self.mmap = False
+        self.index_file = None  # 当前加载/保存的版本文件
+        self.meta = {}
+        self.nlist = None
+        self.nprobe = None
+        self.feature_store = None
+        self._store_writer = None  # 全量构建时写入的新特征存储
+        self._store_added = []     # 增量更新新增的 (ids, features)，保存时与旧特征存储合并
+        self._store_removed = set()
+
+    @property
+    def metric(self):
+        """索引的度量（"L2" / "cosine"），没有记录的旧索引为 L2"""
+        return self.meta.get("metric", "L2")
+
+    def _prepare_vectors(self, vectors):
+        """加入索引或查询前的向量：余弦度量的索引先做 L2 归一化（对已归一化的特征无影响）"""
+        if self.metric == "cosine":
+            return normalize_vectors(vectors)
+        return np.ascontiguousarray(vectors, dtype='float32')
+
+    @property
+    def meta_path(self):
+        """索引元数据文件路径：{版本文件}.meta.json"""
+        return (self.index_file or resolve_index_file(self.index_path)) + ".meta.json"
+    def _create_index(self, num_data: int, num_train: int = None):
+        """
+        根据数据量创建尚未训练的索引。
+        若元数据中有自动调优结果（scripts/index_autotune.py 写入）且数据量与调优时相近，
+        使用调优得到的索引结构与 nprobe，否则由 choose_index_factory 按数据量与内存预算选择。
+        只用采样的训练样本训练时，nlist 不超过 num_train // MIN_POINTS_PER_CENTROID，
+        避免粗量化器训练不足；被限制时原 nlist 记录在元数据 nlist_capped_from 中。
+        参数:
+            num_data (int): 将要加入索引的向量数量。
+            num_train (int): 训练样本数，None 表示用全部向量训练。
+        """
+        metric = index_metric()
+        tuned_record = load_index_meta(self.index_path).get("tuned")
+        tuned = tuned_record if self.use_IVF else None
+        if tuned and tuned.get("metric", "L2") != metric:
+            print(f"[!] 调优结果基于 {tuned.get('metric', 'L2')} 度量，与当前 {metric} 不一致，改用默认参数")
+            tuned = None
+        if tuned and not self._tuned_applicable(tuned, num_data):
+            print(f"[!] 调优结果基于 {tuned.get('num_vectors')} 条向量，与当前 {num_data} 条相差较大，改用默认参数")
+            tuned = None
+        if tuned:
+            factory, nlist, index_type = tuned["factory"], tuned.get("nlist"), "tuned"
+            search_params = {"nprobe": tuned["nprobe"]} if tuned.get("nprobe") else {}
+        elif self.use_IVF:
+            factory, nlist, search_params, index_type = choose_index_factory(num_data, self.dim)
+        else:
+            # 不使用 IVF，使用简单的 Flat 索引
+            factory, nlist, search_params, index_type = "Flat", None, {}, "flat"
+        if nlist and num_data < nlist:
+            # 避免 nx < k 错误
+            factory = factory.replace(f"IVF{nlist}", f"IVF{num_data}")
+            nlist = num_data
+            if "nprobe" in search_params:
+                search_params["nprobe"] = min(nlist, search_params["nprobe"])
+        nlist_capped_from = None
+        max_nlist = max(1, num_train // MIN_POINTS_PER_CENTROID) if num_train is not None else None
+        if nlist and max_nlist is not None and num_train < num_data and nlist > max_nlist:
+            print(f"[!] 训练样本 {num_train} 条不足以训练 {nlist} 个聚类（每个至少 {MIN_POINTS_PER_CENTROID} 条），"
+                  f"nlist 调整为 {max_nlist}")
+            factory = factory.replace(f"IVF{nlist}", f"IVF{max_nlist}")
+            nlist_capped_from, nlist = nlist, max_nlist
+            if "nprobe" in search_params:
+                search_params["nprobe"] = min(nlist, search_params["nprobe"])
+        self.nlist = nlist
+        self.nprobe = search_params.get("nprobe")
+
+        quantizer = f"IDMap,{factory}"
+        self.index = faiss.index_factory(self.dim, quantizer, faiss_metric(metric))
+        self.meta = {"factory": quantizer, "index_type": index_type, "metric": metric, "dim": self.dim,
+                     "reduce": parse_reduction(quantizer), "nlist": nlist, "search_params": search_params}
+        if num_train is not None:
+            self.meta["train_size"] = int(min(num_train, num_data))
+        if nlist_capped_from is not None:
+            self.meta["nlist_capped_from"] = nlist_capped_from
+        if tuned_record:
+            # 调优结果随索引重建保留，供下一次构建使用
+            self.meta["tuned"] = tuned_record
+
+    @staticmethod
+    def _tuned_applicable(tuned, num_data):
+        """调优时的数据量与当前数据量相差不超过 2 倍，且数据量足够训练 nlist 个聚类"""
+        tuned_n = tuned.get("num_vectors") or 0
+        if tuned_n <= 0 or not (0.5 <= num_data / tuned_n <= 2):
+            return False
+        return num_data >= (tuned.get("nlist") or 1)
+
+    def _finish_build(self):
+        """构建完成后的参数设置与日志"""
+        self.meta["num_vectors"] = int(self.index.ntotal)
+        # 训练时的数据规模与聚类均衡度，增量更新时据此判断是否需要重新训练
+        self.meta["trained_vectors"] = self.meta["num_vectors"]
+        self.meta["imbalance"] = self.imbalance_factor()
+        self.apply_search_params(self.meta.get("search_params"))
+        print(f"[√] 使用 {self.meta['factory']} 索引构建完成（{self.meta['index_type']}）: "
+              f"向量数={self.meta['num_vectors']}, 查询参数={self.meta['search_params']}")
+
+    def apply_search_params(self, params):
+        """
+        把查询参数设置为索引的默认值（作用于索引对象本身，影响之后所有查询）。
+        使用 ParameterSpace 设置，可穿透 IDMap 等包装层作用到内部的 IVF 索引。
+        参数:
+            params (dict): 如 {"nprobe": 8}，None 或空时不做修改。
+        """
+        if not params or self.index is None:
+            return
+        ps = faiss.ParameterSpace()
+        for name, value in params.items():
+            try:
+                ps.set_index_parameter(self.index, name, value)
+            except RuntimeError as e:
+                print(f"[!] 索引 {self.index_path} 不支持参数 {name}={value}（{e}），已忽略")
+
+    def _default_search_params(self):
+        """旧版本索引没有元数据文件时，按 IVF 的 nlist 推算默认 nprobe"""
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return {}
+        self.nlist = ivf.nlist
+        return {"nprobe": default_nprobe(ivf.nlist)}
+
+    def _make_search_parameters(self, nprobe=None):
+        """单次查询的参数覆盖：构造 SearchParametersIVF，不修改共享的索引对象，可并发使用"""
+        if not nprobe:
+            return None
+        try:
+            faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return None  # 非 IVF 索引没有 nprobe
+        return faiss.SearchParametersIVF(nprobe=int(nprobe))
+
     def build_index(self, features: np.ndarray, ids: np.ndarray):
         """
         构建压缩索引，并绑定自定义图像ID。
@@ -32,55 +321,328 @@ class FaissIndexer:
             features (np.ndarray): shape=(N, dim) 的图像特征向量。
             ids (np.ndarray): shape=(N,) 的图像编号。
         """
-        num_data = features.shape[0]
+        self._create_index(features.shape[0])
+        features = self._prepare_vectors(features)
+        if not self.index.is_trained:
+            self.index.train(features)
+        self.index.add_with_ids(features, ids)
+        self._start_feature_store(features.shape[0])
+        if self._store_writer is not None:
+            self._store_writer.add(ids, features)
+        self._finish_build()
 
-        if self.use_IVF:
-            # 自动设置 nlist（√N）和 nprobe（5%）
-            nlist = max(1, int(math.sqrt(num_data)))
-            nprobe = max(1, math.ceil(nlist * 0.1))
+    def build_index_from_chunks(self, chunk_source, train_size: int = None):
+        """
+        分块构建索引，峰值内存为训练样本 + 单个数据块 + 索引本身，与原始特征总量无关。
+        第一遍遍历统计总数并用蓄水池采样抽取训练样本，第二遍逐块 add_with_ids。
+        参数:
+            chunk_source (callable): 每次调用返回一个新的 (ids, features) 块迭代器，会被调用两次。
+            train_size (int): 训练样本数上限，默认使用 config.INDEX_TRAIN_SAMPLE_SIZE。
+        返回:
+            int: 加入索引的向量总数，为 0 时不创建索引。
+        """
+        if train_size is None:
+            train_size = getattr(config, "INDEX_TRAIN_SAMPLE_SIZE", 50000)
+        rng = np.random.default_rng(0)
+        sample_parts, sample = [], None  # 样本未满时按块暂存，满后合并为定长数组
+        num_data = 0
+        for _, chunk in chunk_source():
+            chunk = np.asarray(chunk, dtype='float32')
+            n = chunk.shape[0]
+            take = 0
+            if sample is None:
+                take = min(n, train_size - num_data)
+                sample_parts.append(chunk[:take])
+                if num_data + take >= train_size:
+                    sample = np.concatenate(sample_parts, axis=0)
+                    sample_parts = None
+            if take < n:
+                # 蓄水池采样：第 t 个向量以 train_size / (t+1) 的概率替换样本中的随机位置
+                positions = num_data + np.arange(take, n)
+                slots = rng.integers(0, positions + 1)
+                mask = slots < train_size
+                sample[slots[mask]] = chunk[take:][mask]
+            num_data += n
+        if num_data == 0:
+            return 0
 
-            if num_data < nlist:
-                nlist = num_data  # 避免 nx < k 错误
+        if sample is None:
+            sample = np.concatenate(sample_parts, axis=0)
+        self._create_index(num_data, num_train=sample.shape[0])
+        if not self.index.is_trained:
+            self.index.train(self._prepare_vectors(sample))
+        self._start_feature_store(num_data)
+        for ids, chunk in chunk_source():
+            chunk, ids = self._prepare_vectors(chunk), np.asarray(ids, dtype='int64')
+            self.index.add_with_ids(chunk, ids)
+            if self._store_writer is not None:
+                self._store_writer.add(ids, chunk)
+        self._finish_build()
+        return num_data
 
-            quantizer = f"IDMap,IVF{nlist},SQ8"
-            self.index = faiss.index_factory(self.dim, quantizer, faiss.METRIC_L2)
+    def _start_feature_store(self, num_data):
+        """全量构建时按 config.INDEX_STORE_VECTORS 准备特征存储写入器（Flat 索引本身就是精确的，不需要）"""
+        if self._store_writer is not None:
+            self._store_writer.discard()
+        self._store_writer = None
+        self._store_added, self._store_removed = [], set()
+        if getattr(config, "INDEX_STORE_VECTORS", False) and self.meta.get("factory") != "IDMap,Flat":
+            self._store_writer = FeatureStoreWriter(self.index_path, num_data, self.dim)
 
-            if not self.index.is_trained:
-                self.index.train(features)
+    def _track_store_changes(self, added=None, removed=None):
+        """记录增量更新对特征存储的修改（当前版本没有特征存储时无需记录）"""
+        if self._store_writer is not None or self.load_feature_store() is None:
+            return
+        if removed is not None:
+            self._store_removed.update(int(i) for i in removed)
+        if added is not None:
+            ids, features = added
+            self._store_removed.update(int(i) for i in ids)  # 覆盖已有 ID 的旧向量
+            self._store_added.append((np.array(ids, dtype='int64'), np.array(features, dtype='float32')))
 
-            self.index.add_with_ids(features, ids)
-            self.index.probe= nprobe
-            print(f"[√] 使用 IVF 索引构建完成: nlist={nlist}, nprobe={nprobe}")
+    def _prepare_feature_store(self):
+        """
+        准备新版本的特征存储：全量构建时直接使用写入器；
+        增量更新时硬链接旧版本的基础段，只写出增量段（旧增量段中保留的向量 + 本次新增向量）；
+        增量段与失效行累计超过基础段的 config.INDEX_STORE_COMPACT_RATIO 时压缩为一个新的基础段。
+        没有特征存储时返回 None。
+        """
+        if self._store_writer is not None:
+            return self._store_writer
+        base = self.load_feature_store()
+        if base is None:
+            return None
+        num_added = sum(len(ids) for ids, _ in self._store_added)
+        old_delta = base.delta
+        num_delta = num_added + (old_delta.count_live(exclude=self._store_removed) if old_delta is not None else 0)
+        # 所有段的行数减去索引中的向量数即为失效行（已删除或被覆盖）
+        num_stale = len(base) + num_delta - int(self.index.ntotal)
+        compact = num_delta + num_stale > len(base) * getattr(config, "INDEX_STORE_COMPACT_RATIO", 0.25)
+        if compact:
+            live_ids = self.stored_ids()
+            num_kept = base.count_live(exclude=self._store_removed, include=live_ids)
+            writer = FeatureStoreWriter(self.index_path, num_kept + num_added, self.dim)
+            old_chunks = base.iter_chunks(exclude=self._store_removed, include=live_ids)
         else:
-            # 不使用 IVF，使用简单的 Flat 索引
-            self.index = faiss.IndexFlatL2(self.dim)
-            id_index = faiss.IndexIDMap(self.index)
-            id_index.add_with_ids(features, ids)
-            self.index = id_index
-            print("[√] 使用 Flat 索引构建完成（测试用途）")
+            writer = FeatureStoreWriter(self.index_path, num_delta, self.dim, link_base=base.version_file)
+            old_chunks = old_delta.iter_chunks(exclude=self._store_removed) if old_delta is not None else []
+        try:
+            for ids, features in old_chunks:
+                writer.add(ids, features)
+            for ids, features in self._store_added:
+                writer.add(ids, features)
+        except Exception:
+            writer.discard()
+            raise
+        return writer
+
+    def load_feature_store(self):
+        """当前版本的全精度特征存储（首次使用时以只读内存映射打开），没有时返回 None"""
+        if self.feature_store is None and self.index_file:
+            self.feature_store = FeatureStore.open(self.index_file) or False
+        return self.feature_store or None
 
     def save_index(self):
+        """
+        以新版本保存索引及其元数据（和特征存储）：写临时文件、fsync、原子改名后切换清单，正在检索的进程不受影响
+        """
         if self.index:
-            faiss.write_index(self.index, self.index_path)
-    def load_index(self):
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-        else:
+            index = self.index
+            writer = self._prepare_feature_store()
+            self.meta["feature_store"] = writer is not None
+            try:
+                self.index_file = publish_index(self.index_path, lambda path: faiss.write_index(index, path), self.meta,
+                                                write_extras=writer.commit if writer is not None else None)
+            except Exception:
+                if writer is not None:
+                    writer.discard()
+                raise
+            self._store_writer = None
+            self._store_added, self._store_removed = [], set()
+            self.feature_store = None  # 下次使用时打开新版本的特征存储
+
+    def _load_meta(self):
+        """读取索引元数据，文件不存在或损坏时按索引结构推算默认查询参数与度量"""
+        meta = load_index_meta(self.index_file)
+        if not meta.get("search_params"):
+            meta["search_params"] = self._default_search_params()
+        if "metric" not in meta:
+            # 元数据缺失时以索引对象自身的度量为准
+            meta["metric"] = "cosine" if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else "L2"
+        self.meta = meta
+        self.nprobe = meta["search_params"].get("nprobe")
+        if "nlist" in meta:
+            self.nlist = meta["nlist"]
+    def load_index(self, mmap: bool = None):
+        """
+        从磁盘加载索引。
+        参数:
+            mmap (bool): 是否以只读内存映射方式加载，默认使用 config.INDEX_MMAP。
+                多个进程映射同一索引文件时共享页缓存；映射后的索引不能增删向量，
+                需要修改索引的调用方应传入 mmap=False。索引类型不支持映射时回退为普通加载。
+        """
+        # 先解析出当前版本文件，之后的读取都针对该文件，不受并发发布新版本影响
+        self.index_file = resolve_index_file(self.index_path)
+        self.feature_store = None
+        if not os.path.exists(self.index_file):
             raise FileNotFoundError(f"No FAISS index at {self.index_path}")
-    def search(self, query: np.ndarray, k: int = 5):
+        if mmap is None:
+            mmap = getattr(config, "INDEX_MMAP", False)
+        self.mmap = False
+        self.index = None
+        if mmap:
+            try:
+                self.index = faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                # FAISS 只对 IVF 倒排表做映射，Flat / HNSW 等会忽略该标志整体读入私有内存
+                self.mmap = self._invlists_mapped()
+                if not self.mmap:
+                    print(f"[!] 索引 {self.index_file} 没有可映射的 IVF 倒排表，内存映射未生效（按普通加载统计）")
+            except RuntimeError as e:
+                print(f"[!] 索引 {self.index_file} 不支持内存映射加载（{e}），改为普通加载")
+        if self.index is None:
+            self.index = faiss.read_index(self.index_file)
+        self._load_meta()
+        self.apply_search_params(self.meta["search_params"])
+    def _invlists_mapped(self):
+        """当前索引的 IVF 倒排表是否为文件映射（OnDiskInvertedLists），非 IVF 索引返回 False"""
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return False
+        return isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: int = None, rerank_k: int = None):
         """
             对查询向量执行近邻搜索。
                参数:
-                   query (np.ndarray): shape=(1, dim) 的查询向量。
+                   query (np.ndarray): shape=(n, dim) 的查询向量。
                    k (int): 返回最近的 k 个相似项。
+                   nprobe (int): 本次查询探查的聚类数，None 时使用索引元数据中的默认值。
+                   rerank_k (int): 从压缩索引多取的候选数 k'，用全精度特征精确重排序后取前 k 个；
+                       None/0 或没有特征存储时不重排序。
                返回:
                    distances (np.ndarray): 距离值。
                    ids (np.ndarray): 匹配的图像编号。
         """
         if self.index is None:
             raise ValueError("Index not loaded")
+        query = self._prepare_vectors(query)
+        if rerank_k:
+            store = self.load_feature_store()
+            if store is not None:
+                distances, labels = self._search(query, max(k, int(rerank_k)), nprobe)
+                return rerank_exact(query, labels, distances, [store], k, metric=self.metric)
+        return self._search(query, k, nprobe)
+
+    def range_search(self, query: np.ndarray, radius: float):
+        """
+            范围检索：返回每个查询在半径内的全部向量（L2 为平方距离小于 radius，cosine 为内积大于 radius）。
+               参数:
+                   query (np.ndarray): shape=(n, dim) 的查询向量。
+                   radius (float): 半径，可由 similarity_threshold_to_radius 从相似度阈值换算。
+               返回:
+                   lims, distances, ids: 第 i 个查询的结果为 distances/ids[lims[i]:lims[i+1]]（无序）。
+               索引类型不支持范围检索时抛出 RuntimeError。
+        """
+        if self.index is None:
+            raise ValueError("Index not loaded")
+        return self.index.range_search(self._prepare_vectors(query), float(radius))
+
+    def _search(self, query, k, nprobe):
+        """压缩索引上的近似检索"""
+        params = self._make_search_parameters(nprobe)
+        if params is not None:
+            return self.index.search(query, k, params=params)
         return self.index.search(query, k)
 
+    def stored_ids(self):
+        """返回索引中全部向量的图像 ID（IDMap 的 id_map），不读取向量本身"""
+        if self.index is None:
+            raise ValueError("Index not loaded")
+        return faiss.vector_to_array(self.index.id_map).astype('int64')
+
+    def add_vectors(self, features: np.ndarray, ids: np.ndarray):
+        """在已训练的索引上追加向量，不重新训练"""
+        if self.index is None:
+            raise ValueError("Index not loaded")
+        features, ids = self._prepare_vectors(features), np.asarray(ids, dtype='int64')
+        self.index.add_with_ids(features, ids)
+        self._track_store_changes(added=(ids, features))
+        self.meta["num_vectors"] = int(self.index.ntotal)
+
+    def supports_removal(self):
+        """索引是否支持 remove_ids：HNSW 图结构不支持删除，按元数据中的类型与 factory 判断（含 custom / tuned）"""
+        if self.meta.get("index_type") == "hnsw" or "HNSW" in (self.meta.get("factory") or ""):
+            return False
+        if self.index is None:
+            return True
+        index = faiss.downcast_index(self.index)
+        while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+            index = faiss.downcast_index(index.index)
+        return not isinstance(index, faiss.IndexHNSW)
+
+    def remove_vectors(self, ids):
+        """从索引中删除指定 ID 的向量，返回实际删除的数量；索引不支持删除时抛出 ValueError"""
+        if self.index is None:
+            raise ValueError("Index not loaded")
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        if ids.size == 0:
+            return 0
+        if not self.supports_removal():
+            raise ValueError(f"索引 {self.index_path}（{self.meta.get('factory')}）不支持删除向量")
+        removed = self.index.remove_ids(faiss.IDSelectorBatch(ids.size, faiss.swig_ptr(ids)))
+        self._track_store_changes(removed=ids)
+        self.meta["num_vectors"] = int(self.index.ntotal)
+        return int(removed)
+
+    def imbalance_factor(self):
+        """
+        IVF 倒排表的不均衡度：nlist * Σ(size²) / (Σsize)²，完全均衡时为 1，非 IVF 索引返回 None。
+        大量新数据集中落入少数聚类时该值升高，单次查询扫描的向量数随之增大。
+        """
+        try:
+            ivf = faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            return None
+        sizes = np.array([ivf.invlists.list_size(i) for i in range(ivf.nlist)], dtype='float64')
+        total = sizes.sum()
+        if total == 0:
+            return None
+        return float(ivf.nlist * (sizes ** 2).sum() / total ** 2)
+
+    def retrain_reason(self, num_after: int, removing: bool = False):
+        """
+        判断增量更新后是否需要重新训练索引（用于更新前的检查）。
+        参数:
+            num_after (int): 更新后的向量数。
+            removing (bool): 本次更新是否包含删除。
+        返回:
+            str: 需要重新训练的原因，不需要时返回 None。
+        """
+        if removing and not self.supports_removal():
+            return "HNSW 索引不支持删除向量"
+        trained = self.meta.get("trained_vectors") or self.meta.get("num_vectors")
+        if not trained:
+            return "索引元数据缺少训练时的数据规模"
+        if self.metric != index_metric():
+            return f"索引度量 {self.metric} 与配置的 {index_metric()} 不一致"
+        growth = getattr(config, "INDEX_RETRAIN_GROWTH", 2.0)
+        if num_after > trained * growth or num_after * growth < trained:
+            return f"向量数 {trained} -> {num_after} 变化超过 {growth} 倍"
+        index_type = self.meta.get("index_type")
+        if index_type in ("flat", "ivf_sq8", "ivf_pq", "hnsw") and \
+                choose_index_factory(num_after, self.dim)[3] != index_type:
+            return f"数据规模 {num_after} 对应的索引类型已不是 {index_type}"
+        return None
+
+    def imbalance_exceeded(self):
+        """增量加入数据后，聚类不均衡度相对训练时的增幅是否超过 config.INDEX_RETRAIN_IMBALANCE"""
+        baseline = self.meta.get("imbalance")
+        current = self.imbalance_factor()
+        if not baseline or current is None:
+            return False
+        return current > baseline * getattr(config, "INDEX_RETRAIN_IMBALANCE", 1.5)
+
     def update_index(self, new_features: np.ndarray, new_ids: np.ndarray):
         """
         更新索引：对已有 ID 执行删除再添加新向量；对新 ID 执行添加操作。
@@ -91,9 +653,14 @@ class FaissIndexer:
         if self.index is None:
             raise ValueError("Index not loaded")
 
+        if not self.supports_removal():
+            raise ValueError(f"索引 {self.index_path}（{self.meta.get('factory')}）不支持删除向量，无法覆盖已有 ID")
         # 先移除旧的 ID（如果存在）
         id_selector = faiss.IDSelectorBatch(new_ids.size, faiss.swig_ptr(new_ids))
         self.index.remove_ids(id_selector)
 
         # 添加新向量
-        self.index.add_with_ids(new_features, new_ids)
\ No newline at end of file
+        new_features = self._prepare_vectors(new_features)
+        self.index.add_with_ids(new_features, new_ids)
+        self._track_store_changes(added=(new_ids, new_features))
+        self.meta["num_vectors"] = int(self.index.ntotal)
\ No newline at end of file
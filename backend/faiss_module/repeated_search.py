@@ -1,27 +1,256 @@
 import numpy as np
 import os
 import sys
-import faiss
-from typing import List
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from faiss_module.indexer import FaissIndexer
-from faiss_module.faiss_utils.similarity_utils import distance_to_similarity_percent
-from index_manage_module.api import get_dataset_image_features
+from faiss_module.faiss_utils.similarity_utils import similarity_threshold_to_radius, higher_is_better
+from faiss_module.duplicate_store import load_duplicate_result, save_duplicate_result
+from database_module.query import iter_query
 from config import config
 # from indexer import FaissIndexer
 # from faiss_utils.similarity_utils import distance_to_similarity_percent
-# from ..index_manage_module.api import get_dataset_image_features
 
-def repeated_search(index_id, threshold: float = 95.0, deduplicate: bool = False) -> List[List[int]]:
+
+def _iter_feature_chunks(dataset_id, chunk_size, min_id=None):
+    """按 ID 升序分块读取数据集的 (ids, features)，不一次性载入全部特征；min_id 不为 None 时只读取 ID 大于它的图片"""
+    where = {"dataset_id": dataset_id}
+    if min_id is not None:
+        where["id"] = (">", int(min_id))
+    for rows in iter_query(
+        "images",
+        columns="id, feature_vector",
+        where=where,
+        order_by="id ASC",
+        chunk_size=chunk_size
+    ):
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        features = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]).astype('float32')
+        yield ids, features
+
+
+def _dataset_image_ids(dataset_id, chunk_size):
+    """数据集当前全部图片 ID（升序），只读取 ID 列"""
+    parts = [np.array([row[0] for row in rows], dtype='int64') for rows in iter_query(
+        "images", columns="id", where={"dataset_id": dataset_id}, order_by="id ASC", chunk_size=chunk_size)]
+    return np.concatenate(parts) if parts else np.empty(0, dtype='int64')
+
+
+def _knn_within_radius(indexer, features, radius, k):
+    """
+    不支持 range_search 的索引（如部分版本的 HNSW）改用小 k 的 kNN 后按半径过滤，
+    返回与 range_search 相同的 (lims, distances, ids) 格式
+    """
+    distances, neighbors = indexer.search(features, k)
+    if higher_is_better(indexer.metric):
+        mask = (neighbors >= 0) & (distances > radius)
+    else:
+        mask = (neighbors >= 0) & (distances < radius)
+    lims = np.concatenate([[0], np.cumsum(mask.sum(axis=1))]).astype('int64')
+    return lims, distances[mask], neighbors[mask]
+
+
+def find_duplicate_edges(indexer, chunks, threshold, batch_size=None, knn_k=None):
+    """
+    批量收集相似度不低于阈值的重复边。
+    阈值只换算一次为 range_search 半径，每批 batch_size 个查询调用一次 FAISS，
+    每个查询只返回半径内的少量结果，不再对每张图片检索全部 N 个近邻。
+    参数:
+        indexer (FaissIndexer): 已加载的索引
+        chunks: (ids, features) 块迭代器
+        threshold (float): 相似度阈值（百分制）
+        batch_size (int): 每次 range_search 的查询数，默认 config.DEDUP_BATCH_SIZE
+        knn_k (int): 索引不支持 range_search 时 kNN 回退的 k，默认 config.DEDUP_KNN_K
+    返回:
+        (all_ids, src, dst): 按读取顺序（ID 升序）的全部图片 ID，以及去重后的无向边（src < dst）
+    """
+    batch_size = batch_size or getattr(config, "DEDUP_BATCH_SIZE", 1024)
+    knn_k = knn_k or getattr(config, "DEDUP_KNN_K", 64)
+    radius = similarity_threshold_to_radius(threshold, indexer.metric)
+    use_range = True
+    all_ids, src_parts, dst_parts = [], [], []
+    for chunk_ids, chunk_features in chunks:
+        all_ids.append(chunk_ids)
+        for start in range(0, len(chunk_ids), batch_size):
+            ids = chunk_ids[start:start + batch_size]
+            features = chunk_features[start:start + batch_size]
+            if use_range:
+                try:
+                    lims, _, labels = indexer.range_search(features, radius)
+                except RuntimeError as e:
+                    print(f"[!] 索引不支持 range_search（{e}），改用 k={knn_k} 的近邻检索")
+                    use_range = False
+            if not use_range:
+                lims, _, labels = _knn_within_radius(indexer, features, radius, knn_k)
+            src = np.repeat(ids, np.diff(lims))
+            keep = src != labels
+            # 统一为 (小 ID, 大 ID)，A 找到 B 或 B 找到 A 都记为同一条边
+            src_parts.append(np.minimum(src[keep], labels[keep]))
+            dst_parts.append(np.maximum(src[keep], labels[keep]))
+    all_ids = np.concatenate(all_ids) if all_ids else np.empty(0, dtype='int64')
+    if not src_parts:
+        return all_ids, np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+    edges = np.unique(np.stack([np.concatenate(src_parts), np.concatenate(dst_parts)], axis=1), axis=0)
+    return all_ids, edges[:, 0].astype('int64'), edges[:, 1].astype('int64')
+
+
+def connected_components(num_nodes, src, dst):
+    """
+    向量化并查集：对 0..num_nodes-1 的节点按边合并连通分量。
+    每轮把边两端所在树的较大根挂到较小根下（np.minimum.at），再做指针跳跃直到每个节点直接指向根，
+    边两端的根全部相同时结束。根始终是分量内的最小节点编号，结果与边和节点的遍历顺序无关。
+    返回:
+        np.ndarray: 每个节点所在分量的根（最小节点编号）
+    """
+    parent = np.arange(num_nodes, dtype='int64')
+    while src.size:
+        root_src, root_dst = parent[src], parent[dst]
+        differ = root_src != root_dst
+        if not differ.any():
+            break
+        low = np.minimum(root_src[differ], root_dst[differ])
+        high = np.maximum(root_src[differ], root_dst[differ])
+        np.minimum.at(parent, high, low)
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+    return parent
+
+
+def _load_vectors(image_ids):
+    """读取指定图片的原始特征，返回 {图片ID: np.ndarray}"""
+    from database_module.query import query_multi
+    vectors = {}
+    image_ids = sorted(set(int(i) for i in image_ids))
+    # SQLite 单条语句变量数有限，分块查询
+    for i in range(0, len(image_ids), 500):
+        rows = query_multi("images", columns="id, feature_vector", where={"id": ("IN", image_ids[i:i + 500])}) or []
+        for img_id, blob in rows:
+            vectors[img_id] = np.frombuffer(blob, dtype=np.float32)
+    return vectors
+
+
+def split_by_diameter(groups, min_similarity, indexer, max_size=None):
+    """
+    限制组直径：连通分量中相似关系可能经 A~B、B~C 链式传递，使首尾图片并不相似。
+    对这样的组按 ID 升序依次把图片放入第一个与其中所有成员相似度都不低于 min_similarity 的子组，
+    没有时新建子组；结果只取决于组成员本身，只保留至少两张图片的子组。
+    拆分需要组内 n×n 相似度矩阵，超过 max_size 张图片的组不拆分，原样返回并打印警告。
+    参数:
+        groups (List[List[int]]): 按 ID 升序排列成员的重复组
+        min_similarity (float): 组内任意两张图片的最低相似度（百分制）
+        indexer (FaissIndexer): 提供度量与向量预处理
+        max_size (int): 允许拆分的最大组大小，默认 config.DEDUP_SPLIT_MAX_SIZE
+    """
+    from faiss_module.faiss_utils.similarity_utils import score_to_similarity_percent
+    max_size = max_size or getattr(config, "DEDUP_SPLIT_MAX_SIZE", 5000)
+    cosine = higher_is_better(indexer.metric)
+    result = [group for group in groups if len(group) > max_size]
+    for group in result:
+        print(f"[!] 重复组 {group[0]} 含 {len(group)} 张图片，超过直径拆分上限 {max_size}，不做拆分")
+    groups = [group for group in groups if len(group) <= max_size]
+    all_vectors = _load_vectors(img_id for group in groups for img_id in group)
+    for group in groups:
+        # 按索引度量预处理（cosine 归一化）
+        vectors = indexer._prepare_vectors(np.stack([all_vectors[img_id] for img_id in group]))
+        if cosine:
+            scores = vectors @ vectors.T
+        else:
+            norms = (vectors ** 2).sum(axis=1)
+            scores = np.maximum(norms[:, None] + norms[None, :] - 2 * vectors @ vectors.T, 0)
+        similar = score_to_similarity_percent(scores, indexer.metric) >= min_similarity
+        subgroups = []
+        for member in range(len(group)):
+            for subgroup in subgroups:
+                if similar[member, subgroup].all():
+                    subgroup.append(member)
+                    break
+            else:
+                subgroups.append([member])
+        result.extend([group[m] for m in subgroup] for subgroup in subgroups if len(subgroup) > 1)
+    return sorted(result)
+
+
+def _reusable_result(stored, threshold, min_group_similarity, metric):
+    """保存的结果是否与本次参数一致（阈值、直径约束、度量都相同才可增量合并）"""
+    if stored is None:
+        return False
+    same_bound = (stored["min_group_similarity"] is None) == (min_group_similarity is None) and \
+        (min_group_similarity is None or abs(stored["min_group_similarity"] - min_group_similarity) < 1e-9)
+    return abs(stored["threshold"] - threshold) < 1e-9 and same_bound and stored["metric"] == metric
+
+
+def _cluster(id_list, src, dst):
+    """按重复边对 id_list（升序）做连通分量聚类，返回至少两张图片的分量（组内、组间均按 ID 升序）和有效边数"""
+    src_pos, dst_pos = np.searchsorted(id_list, src), np.searchsorted(id_list, dst)
+    # 只保留两端都在数据集中的边（索引中可能残留数据库已删除的图片）
+    in_range = (dst_pos < id_list.size) & (src_pos < id_list.size)
+    src_pos, dst_pos = src_pos[in_range], dst_pos[in_range]
+    valid = (id_list[src_pos] == src[in_range]) & (id_list[dst_pos] == dst[in_range])
+    src_pos, dst_pos = src_pos[valid], dst_pos[valid]
+    roots = connected_components(id_list.size, src_pos, dst_pos)
+    order = np.argsort(roots, kind="stable")
+    boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+    components = [id_list[members].tolist() for members in np.split(order, boundaries) if members.size > 1]
+    return components, int(src_pos.size)
+
+
+def _split_components(components, min_group_similarity, indexer, stored):
+    """
+    对连通分量应用直径约束。与上次保存结果中完全相同的分量直接复用其拆分结果，
+    只对新出现或成员变化的分量重新读取特征计算，增量检测的耗时与变化量相关。
+    """
+    reused, to_split = [], []
+    previous = {}
+    if stored is not None:
+        member_component = {}
+        for component in stored["components"]:
+            previous[tuple(component)] = []
+            member_component.update((m, tuple(component)) for m in component)
+        for group in stored["groups"]:
+            key = member_component.get(group[0])
+            if key is not None:
+                previous[key].append(group)
+    for component in components:
+        key = tuple(component)
+        if key in previous:
+            reused.extend(previous[key])
+        else:
+            to_split.append(component)
+    split = split_by_diameter(to_split, min_group_similarity, indexer) if to_split else []
+    return sorted(reused + split)
+
+
+def repeated_search(index_id, threshold: float = 95.0, deduplicate: bool = False,
+                    min_group_similarity: float = None, return_stats: bool = False, incremental: bool = False):
     """
     寻找指定索引文件中的重复图片集合（基于相似度阈值）。
+    相似度不低于阈值的图片对构成边，按连通分量（传递闭包）分组，分组结果与遍历顺序无关。
+    每次检测的重复边、分组与水位线（已覆盖的最大图片ID）按数据集保存。
     参数:
         index_id: 数据集ID（int）或数据集名称（str）
         threshold (float): 相似度阈值（百分制），大于等于此值即认为是重复
-        deduplicate (bool): 是否执行去重（仅保留每组中索引最小的项）
+        deduplicate (bool): 是否执行去重（仅保留每组中索引最小的项）；HNSW 等不支持删除向量的索引抛出 ValueError
+        min_group_similarity (float): 可选的组直径约束，组内任意两张图片的相似度都不低于该值，
+            链式传递形成的组会被拆分；None 表示不限制
+        return_stats (bool): 是否同时返回统计信息（模式、各阶段耗时、图片数、新增/删除图片数、边数、组数）
+        incremental (bool): 增量模式：只检索水位线之后新增的图片，与保存的重复边合并（去掉已删除图片的边）
+            后重新聚类；没有保存结果或参数与保存时不同时自动改为全量检测
     返回:
-        List[List[int]]: 每组为一组重复图像的ID集合（包括自己）
+        List[List[int]]: 每组为一组重复图像的ID集合（包括自己），组内与组间均按 ID 升序；
+        return_stats 为 True 时返回 (groups, stats)
     """
+    timings = {}
+    stage_start = time.perf_counter()
+
+    def finish_stage(name):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[name] = round((now - stage_start) * 1000.0, 2)
+        stage_start = now
+
     # 如果传入的是字符串（数据集名称），需要转换为数据集ID
     if isinstance(index_id, str):
         from database_module.query import query_one
@@ -31,57 +260,85 @@ def repeated_search(index_id, threshold: float = 95.0, deduplicate: bool = False
         dataset_id = dataset[0]  # ID在第一个字段
     else:
         dataset_id = index_id
-    
+
     # 初始化 indexer
     dim = config.VECTOR_DIM
     index_path = os.path.join(config.INDEX_FOLDER, f"{dataset_id}.index")
     print("index_path:", index_path)
     indexer = FaissIndexer(dim=dim, index_path=index_path, use_IVF=True)
-    indexer.load_index()
+    # 去重时会删除向量并回写索引，需要可修改的普通加载
+    indexer.load_index(mmap=not deduplicate)
+    if deduplicate and not indexer.supports_removal():
+        # 在检索与保存结果之前拒绝，避免留下对应未修改索引的去重结果
+        raise ValueError(f"数据集 {dataset_id} 的索引（{indexer.meta.get('factory')}）不支持删除向量，"
+                         f"无法去重；请关闭 deduplicate 或改用 IVF/Flat 索引重建")
+    threshold = float(threshold)
+    if min_group_similarity is not None:
+        min_group_similarity = float(min_group_similarity)
+    stored = load_duplicate_result(dataset_id) if incremental else None
+    if incremental and not _reusable_result(stored, threshold, min_group_similarity, indexer.metric):
+        if stored is not None:
+            print(f"[!] 数据集 {dataset_id} 保存的重复检测参数与本次不同，改为全量检测")
+        stored = None
+    finish_stage("load_index")
 
+    # 分块读取原始图片特征，批量范围检索收集重复边
+    batch_size = getattr(config, "DEDUP_BATCH_SIZE", 1024)
+    num_new = num_deleted = 0
+    if stored is None:
+        id_list, src, dst = find_duplicate_edges(
+            indexer, _iter_feature_chunks(dataset_id, batch_size), threshold, batch_size=batch_size)
+        num_new = int(id_list.size)
+    else:
+        # 增量：只有水位线之后的新图片作为查询，与已保存的边合并
+        id_list = _dataset_image_ids(dataset_id, batch_size)
+        new_ids, new_src, new_dst = find_duplicate_edges(
+            indexer, _iter_feature_chunks(dataset_id, batch_size, min_id=stored["watermark"]), threshold,
+            batch_size=batch_size)
+        num_new = int(new_ids.size)
+        kept = np.isin(stored["src"], id_list) & np.isin(stored["dst"], id_list)
+        num_deleted = stored["image_count"] + num_new - int(id_list.size)
+        edges = np.stack([np.concatenate([stored["src"][kept], new_src]),
+                          np.concatenate([stored["dst"][kept], new_dst])], axis=1)
+        edges = np.unique(edges, axis=0) if edges.size else edges.reshape(0, 2)
+        src, dst = edges[:, 0], edges[:, 1]
+    if id_list.size == 0:
+        raise ValueError(f"未找到数据集 {index_path} 的图像特征")
+    finish_stage("range_search")
 
-    # 获取原始图片特征（id, vector）
-    id_vector_pairs = get_dataset_image_features(dataset_id)
+    # 连通分量聚类：ID 升序读取，节点编号与 ID 顺序一致，分量的根即组内最小 ID
+    components, num_edges = _cluster(id_list, src, dst)
+    finish_stage("clustering")
 
-    if not id_vector_pairs:
-        raise ValueError(f"未找到数据集 {index_path} 的图像特征")
+    duplicates = components
+    if min_group_similarity is not None and components:
+        duplicates = _split_components(components, min_group_similarity, indexer, stored)
+        finish_stage("diameter_split")
+
+    # 保存本次结果与水位线，供下次增量检测。
+    # 构建时特征先分块写入数据库、最后才更新索引，水位线不超过索引中的最大 ID，
+    # 尚未进入索引的图片下次仍作为新图片检索，它们之间的重复边不会被漏掉
+    stored_ids = indexer.stored_ids()
+    watermark = min(int(id_list.max()), int(stored_ids.max()) if stored_ids.size else 0)
+    save_duplicate_result(dataset_id, threshold, min_group_similarity, indexer.metric, watermark,
+                          int((id_list <= watermark).sum()), src, dst, components, duplicates)
+    finish_stage("persist")
 
-    id_list = [id for id, _ in id_vector_pairs]
-    xb = np.stack([vec for _, vec in id_vector_pairs])
-
-    total_ids = len(id_list)
-    visited = set()
-    duplicates = []
-
-    for i in range(total_ids):
-        current_id = id_list[i]
-        if current_id in visited:
-            continue
-
-        query_vec = xb[i].reshape(1, -1)
-        distances, neighbors = indexer.index.search(query_vec, total_ids)
-
-        group = []
-        for d, neighbor_id in zip(distances[0], neighbors[0]):
-            if neighbor_id < 0 or neighbor_id == current_id:
-                continue
-            sim = distance_to_similarity_percent(d)
-            if sim >= threshold:
-                group.append(neighbor_id)
-                visited.add(neighbor_id)
-
-        if group:
-            group.append(current_id)
-            group = sorted(group)
-            visited.add(current_id)
-            duplicates.append(group)
     # 去重：保留每组中最小ID
     if deduplicate and duplicates:
         to_keep = set(min(group) for group in duplicates)
         to_remove = [id for group in duplicates for id in group if id not in to_keep]
-        id_selector = faiss.IDSelectorBatch(len(to_remove), faiss.swig_ptr(np.array(to_remove, dtype='int64')))
-        indexer.index.remove_ids(id_selector)
+        indexer.remove_vectors(np.array(to_remove, dtype='int64'))
         indexer.save_index()
+        finish_stage("deduplicate")
+
+    stats = {"mode": "full" if stored is None else "incremental", "num_images": int(id_list.size),
+             "num_new": num_new, "num_deleted": max(0, num_deleted), "num_edges": num_edges,
+             "num_groups": len(duplicates), "timings_ms": timings}
+    print(f"[√] 重复检测完成（{stats['mode']}）: 图片 {stats['num_images']}，新增 {stats['num_new']}，"
+          f"重复边 {stats['num_edges']}，重复组 {stats['num_groups']}，各阶段耗时(ms) {timings}")
+    if return_stats:
+        return duplicates, stats
     return duplicates
 
 if __name__ == "__main__":
@@ -92,4 +349,4 @@ if __name__ == "__main__":
 
     print("重复组如下：")
     for group in result:
-        print(group)
\ No newline at end of file
+        print(group)
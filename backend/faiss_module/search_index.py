@@ -6,48 +6,83 @@ import heapq
 # 添加项目根路径，便于导入 config 和模块
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from config import config
-from faiss_module.indexer import FaissIndexer
-from faiss_module.faiss_utils.similarity_utils import distance_to_similarity_percent
+from faiss_module.index_cache import get_index_cache
+from faiss_module.index_store import index_exists
+from faiss_module.faiss_utils.similarity_utils import score_to_similarity_percent, higher_is_better
 
-def search_index(query_feature: np.ndarray, names, top_k=5):
+def search_index(query_feature: np.ndarray, names, top_k=5, nprobe=None, rerank_k=None):
     """
     支持多索引库的查询。
     参数:
         query_feature (np.ndarray): 查询向量
         names (str or List[str]): 单个或多个索引文件名（如 'index1.index' 或 ['a.index', 'b.index']）
         top_k (int): 返回最相似的 top_k 个图像 ID
+        nprobe (int): 本次查询的 IVF 探查聚类数，None 时使用各索引元数据中的默认值
+        rerank_k (int): 精确重排序的候选数 k'，None 时使用 config.SEARCH_RERANK_K，0 表示不重排序
     返回:
-        List[int], List[float]: 匹配的 ID 列表 和 相似度百分比列表
+        List[int], List[float]: 匹配的 ID 列表 和 相似度百分比列表（多个查询向量时只返回第一个的结果，
+        批量查询请使用 search_index_batch）
+    """
+    if query_feature.ndim not in (1, 2):
+        raise ValueError("query_feature 必须是 1 维或 2 维 numpy 数组")
+    return search_index_batch(query_feature.reshape(-1, query_feature.shape[-1])[:1], names, top_k, nprobe, rerank_k)[0]
+
+
+def search_index_batch(query_features: np.ndarray, names, top_k=5, nprobe=None, rerank_k=None):
+    """
+    批量查询：所有查询向量在每个索引（多数据集时为分片组合）上只调用一次 FAISS search。
+    参数:
+        query_features (np.ndarray): shape=(n, dim) 的查询向量
+        names (str or List[str]): 单个或多个索引文件名
+        top_k (int): 每个查询返回最相似的 top_k 个图像 ID
+        nprobe (int): 本次查询的 IVF 探查聚类数，None 时使用各索引元数据中的默认值
+        rerank_k (int): 从压缩索引多取 k' 个候选，按全精度特征的精确 L2 距离重排序后取 top_k，
+            相似度由精确距离计算；None 时使用 config.SEARCH_RERANK_K，0 表示不重排序
+    返回:
+        List[Tuple[List[int], List[float]]]: 与查询向量一一对应的 (ID 列表, 相似度百分比列表)
     """
     if isinstance(names, str):
         names = [names]
     if top_k < 1:
         raise ValueError("top_k 必须大于等于 1")
+    if rerank_k is None:
+        rerank_k = getattr(config, "SEARCH_RERANK_K", 0)
     # 标准化查询向量形状
-    if query_feature.ndim == 1:
-        query_feature = query_feature.reshape(1, -1)
-    elif query_feature.ndim != 2:
-        raise ValueError("query_feature 必须是 1 维或 2 维 numpy 数组")
+    if query_features.ndim == 1:
+        query_features = query_features.reshape(1, -1)
+    elif query_features.ndim != 2:
+        raise ValueError("query_features 必须是 1 维或 2 维 numpy 数组")
 
     dim = config.VECTOR_DIM
-    results = []  # 用于收集所有库的搜索结果
-    query_feature = query_feature.astype('float32')
+    query_features = np.ascontiguousarray(query_features, dtype='float32')
+    index_paths = []
     for name in names:
         index_path = os.path.join(config.INDEX_FOLDER, name)
-        if not os.path.exists(index_path):
+        if not index_exists(index_path):
             print(f"索引文件 {index_path} 不存在，跳过。")
             continue
+        index_paths.append(index_path)
 
-        indexer = FaissIndexer(dim=dim, index_path=index_path, use_IVF=True)
-        indexer.load_index()
-        distances, indices = indexer.search(query_feature.astype('float32'), top_k)
-
-        for d, i in zip(distances[0], indices[0]):
-            results.append((d, i))
+    if not index_paths or query_features.shape[0] == 0:
+        return [([], []) for _ in range(query_features.shape[0])]
 
-    # 保留最小的 top_k 项（按距离排序）
-    top_k_results = heapq.nsmallest(top_k, results, key=lambda x: x[0])
-    final_distances, final_indices = zip(*top_k_results) if top_k_results else ([], [])
+    # 从进程级缓存获取索引，新版本发布后自动热切换；
+    # 多个数据集组合为分片索引，在多个线程中并行检索并按分数合并（度量不同的索引不能组合，抛出 ValueError）
+    cache = get_index_cache()
+    if len(index_paths) == 1:
+        searcher = cache.get(index_paths[0], dim)
+    else:
+        searcher = cache.get_shards(index_paths, dim)
+    distances, indices = searcher.search(query_features, top_k, nprobe=nprobe, rerank_k=rerank_k)
 
-    similarities = distance_to_similarity_percent(np.array(final_distances))
-    return list(final_indices), similarities.tolist()
\ No newline at end of file
+    # 相似度换算方式由索引元数据中的度量决定：L2 距离按 sigma 衰减，cosine 内积直接换算
+    metric = searcher.metric
+    select = heapq.nlargest if higher_is_better(metric) else heapq.nsmallest
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        # 保留最相似的 top_k 项
+        top_k_results = select(top_k, zip(row_distances, row_indices), key=lambda x: x[0])
+        final_distances, final_indices = zip(*top_k_results) if top_k_results else ([], [])
+        similarities = score_to_similarity_percent(np.array(final_distances), metric)
+        results.append((list(final_indices), similarities.tolist()))
+    return results
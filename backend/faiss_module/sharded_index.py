@@ -0,0 +1,73 @@
+"""
+sharded_index.py
+多数据集联合检索：把多个数据集索引组合为一个 faiss.IndexShards，
+一次 search 在多个线程中并行检索各分片（FAISS 检索时释放 GIL），并按距离合并为全局 top-k，
+结果与逐个检索后用 heapq 合并一致，耗时由各分片耗时之和变为最慢分片的耗时。
+各分片必须使用相同的度量（L2 / cosine），否则分数不可比较，组合时直接报错。
+"""
+import heapq
+import faiss
+import numpy as np
+from faiss_module.feature_store import rerank_exact
+from faiss_module.indexer import faiss_metric
+
+
+class ShardedIndex:
+    """
+    多索引并行检索组合
+    属性:
+        indexers (List[FaissIndexer]): 各数据集已加载的索引（只读，不会被修改）
+        shards: faiss.IndexShards，各分片保留自己的图像 ID
+        metric (str): 各分片共同的度量
+    """
+    def __init__(self, indexers, dim):
+        self.indexers = list(indexers)
+        metrics = {indexer.metric for indexer in self.indexers}
+        if len(metrics) > 1:
+            raise ValueError(f"不能联合检索度量不同的索引: {sorted(metrics)}，请按相同的 INDEX_METRIC 重建索引")
+        self.metric = metrics.pop() if metrics else "L2"
+        self.shards = faiss.IndexShards(dim, True, False)  # threaded=True, successive_ids=False
+        self.shards.metric_type = faiss_metric(self.metric)  # 合并结果时按度量决定取最小距离还是最大内积
+        for indexer in self.indexers:
+            self.shards.add_shard(indexer.index)
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = None, rerank_k: int = None):
+        """
+        并行检索全部分片并合并结果，返回格式与 FaissIndexer.search 相同
+        参数:
+            query (np.ndarray): shape=(n, dim) 的查询向量
+            k (int): 返回最近的 k 个结果
+            nprobe (int): 本次查询的 IVF 探查聚类数，None 时使用各索引默认值
+            rerank_k (int): 合并后多取的候选数 k'，用各分片的全精度特征精确重排序，None/0 时不重排序
+        """
+        if self.indexers:
+            query = self.indexers[0]._prepare_vectors(query)  # 余弦度量先归一化查询向量
+        if rerank_k:
+            stores = [indexer.load_feature_store() for indexer in self.indexers]
+            if any(store is not None for store in stores):
+                distances, labels = self._search(query, max(k, int(rerank_k)), nprobe)
+                return rerank_exact(query, labels, distances, stores, k, metric=self.metric)
+        return self._search(query, k, nprobe)
+
+    def _search(self, query, k, nprobe):
+        """各分片的近似检索并按分数合并"""
+        if nprobe:
+            try:
+                return self.shards.search(query, k, params=faiss.SearchParametersIVF(nprobe=int(nprobe)))
+            except RuntimeError:
+                # 分片中有非 IVF 索引或 FAISS 版本不支持分片透传查询参数时逐个检索
+                return self._search_sequential(query, k, nprobe)
+        return self.shards.search(query, k)
+
+    def _search_sequential(self, query, k, nprobe):
+        """逐个分片检索后按分数合并（L2 取最小距离，cosine 取最大内积）"""
+        results = [indexer.search(query, k, nprobe=nprobe) for indexer in self.indexers]
+        select = heapq.nlargest if self.metric == "cosine" else heapq.nsmallest
+        distances = np.empty((query.shape[0], k), dtype='float32')
+        labels = np.empty((query.shape[0], k), dtype='int64')
+        for q in range(query.shape[0]):
+            merged = select(k, ((d, i) for dist, ids in results for d, i in zip(dist[q], ids[q])),
+                            key=lambda x: x[0])
+            distances[q] = [d for d, _ in merged]
+            labels[q] = [i for _, i in merged]
+        return distances, labels
@@ -1,19 +1,81 @@
-from faiss_module.indexer import FaissIndexer
-from config import config
+"""
+update_index.py
+在已训练的索引上做增量更新：新增图片 add_with_ids，已删除图片 remove_ids，不重新训练。
+数据规模变化过大、索引类型需要切换或聚类明显失衡时返回 None，由调用方改为全量重建。
+"""
+import os
+import sys
 import numpy as np
 
-def update_index():
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+from faiss_module.indexer import FaissIndexer
+from faiss_module.index_store import index_exists
+
+
+def sync_index(name: str, valid_ids, fetch_chunks):
+    """
+    将索引中的向量与数据集当前的图片 ID 集合同步。
+    :param name: 索引文件名（如 '1.index'）
+    :param valid_ids: 当前应在索引中的全部图像 ID
+    :param fetch_chunks: fetch_chunks(ids) 返回这些 ID 的 (ids, features) 块迭代器，只读取新增图片的特征
+    :return: 更新后的索引元数据（含 update 统计）；索引不存在或需要重新训练时返回 None
+    """
+    index_path = os.path.join(config.INDEX_FOLDER, name)
+    if not index_exists(index_path):
+        return None
+    indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=index_path, use_IVF=True)
+    # 增删向量需要可修改的普通加载
+    indexer.load_index(mmap=False)
+
+    valid_ids = set(int(i) for i in valid_ids)
+    stored = set(indexer.stored_ids().tolist())
+    to_remove = np.array(sorted(stored - valid_ids), dtype='int64')
+    to_add = sorted(valid_ids - stored)
+    if to_remove.size == 0 and not to_add:
+        print(f"[√] 索引 {name} 已是最新，无需更新")
+        indexer.meta["update"] = {"mode": "incremental", "added": 0, "removed": 0}
+        return indexer.meta
+
+    reason = indexer.retrain_reason(len(valid_ids), removing=to_remove.size > 0)
+    if reason:
+        print(f"[!] 索引 {name} 需要重新训练: {reason}")
+        return None
+
+    removed = indexer.remove_vectors(to_remove)
+    added = 0
+    for ids, features in fetch_chunks(to_add):
+        indexer.add_vectors(features, ids)
+        added += len(ids)
+    if indexer.imbalance_exceeded():
+        print(f"[!] 索引 {name} 增量更新后聚类不均衡度 {indexer.imbalance_factor():.2f} "
+              f"超出阈值（训练时 {indexer.meta.get('imbalance'):.2f}），需要重新训练")
+        return None
+
+    indexer.meta["update"] = {"mode": "incremental", "added": added, "removed": removed}
+    indexer.save_index()
+    print(f"[√] 索引 {name} 增量更新完成: 新增 {added}，删除 {removed}，共 {indexer.meta['num_vectors']} 条向量")
+    return indexer.meta
+
+
+def update_index(name: str):
+    """
+    用 config.NEW_FEATURE_PATH / config.NEW_ID_PATH 中的特征更新索引：已有 ID 覆盖，新 ID 追加。
+    :param name: 索引文件名（如 '1.index'）
+    """
     # 加载新数据特征和 ID
     new_features = np.load(config.NEW_FEATURE_PATH).astype('float32')  # shape=(M, dim)
     new_ids = np.load(config.NEW_ID_PATH).astype('int64')              # shape=(M,)
 
     # 加载已有索引
-    indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=config.INDEX_PATH)
-    indexer.load_index()
+    index_path = os.path.join(config.INDEX_FOLDER, name)
+    indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=index_path, use_IVF=True)
+    indexer.load_index(mmap=False)
 
     # 更新索引
     indexer.update_index(new_features, new_ids)
 
     # 保存新索引
     indexer.save_index()
-    print("索引已更新并保存。")
\ No newline at end of file
+    print("索引已更新并保存。")
@@ -1,15 +1,16 @@
 # 提供给外部的统一 API
 from .factory import build_index
 
-def build_dataset_index(dataset_dir, dataset_name, distributed=False):
+def build_dataset_index(dataset_dir, dataset_name, distributed=False, return_info=False):
     """
     构建指定数据集的索引
     :param dataset_dir: 数据集图片路径
     :param dataset_name: 数据集名称
     :param distributed: 是否分布式
-    :return: True/False
+    :param return_info: 是否同时返回索引元数据（索引结构、向量数、查询参数）
+    :return: True/False；return_info 为 True 时返回 (True/False, 索引元数据)
     """
-    return build_index(dataset_dir, dataset_name, distributed)
+    return build_index(dataset_dir, dataset_name, distributed, return_info=return_info)
 
 def get_dataset_image_features(dataset_id):
     """
@@ -1,15 +1,19 @@
 from .index_builder import IndexBuilder
 
-def build_index(dataset_dir, dataset_name, distributed=False):
+def build_index(dataset_dir, dataset_name, distributed=False, return_info=False):
     """
     构建索引的工厂接口
     :param dataset_dir: 数据集图片路径
     :param dataset_name: 数据集名称
     :param distributed: 是否分布式
-    :return: True/False
+    :param return_info: 是否同时返回索引元数据
+    :return: True/False；return_info 为 True 时返回 (True/False, 索引元数据)
     """
     builder = IndexBuilder(dataset_dir, dataset_name, distributed=distributed)
-    return builder.build()
+    ok = builder.build()
+    if return_info:
+        return ok, builder.index_info
+    return ok
 
 def get_all_image_features(dataset_id):
     """
@@ -1,11 +1,16 @@
 import os
 import base64
+import queue
+import threading
 import numpy as np
 from PIL import Image
-from model_module.feature_extractor import feature_extractor
-from faiss_module.build_index import build_index
+from model_module.feature_extractor import get_feature_extractor
+from model_module.cpu_budget import set_thread_role
+from model_module.embedding_cache import get_embedding_cache
+from faiss_module.build_index import build_index_from_chunks
+from faiss_module.update_index import sync_index
 from database_module.modify import insert_one, insert_multi, update
-from database_module.query import query_one
+from database_module.query import query_one, query_multi, iter_query
 from config import config
 import datetime
 import csv
@@ -29,6 +34,57 @@ def check_distributed_availability():
         logger.error(f"检查分布式可用性时出错: {e}")
         return False
 
+class FeatureChunkWriter:
+    """
+    特征分块写入器：特征先放入缓冲区，累计 chunk_size 条后批量写入数据库（同时回写特征缓存）并清空，
+    特征提取阶段的内存占用与数据集大小无关
+    """
+    def __init__(self, dataset_id, dataset_dir, desc_map, chunk_size, cache_keys=None):
+        self.dataset_id = dataset_id
+        self.dataset_dir = dataset_dir
+        self.desc_map = desc_map or {}
+        self.chunk_size = max(1, chunk_size)
+        self.cache_keys = cache_keys or {}
+        self.buffer = []  # [(fname, feat, from_cache)]
+        self.processed_fnames = set()
+        self.count = 0
+        self.nbytes = 0
+
+    def add(self, fname, feat, from_cache=False):
+        """加入一张图片的特征，缓冲区满时自动写入"""
+        self.buffer.append((fname, np.asarray(feat, dtype='float32'), from_cache))
+        self.processed_fnames.add(fname)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """将缓冲区中的特征写入数据库和特征缓存"""
+        if not self.buffer:
+            return
+        image_records = []
+        for fname, feat, _ in self.buffer:
+            image_records.append({
+                "dataset_id": self.dataset_id,
+                "image_path": os.path.join(self.dataset_dir, fname),
+                "resource_type": "control",
+                "metadata_json": self.desc_map.get(fname),
+                "feature_vector": feat.tobytes(),
+                "external_ids": None
+            })
+            self.nbytes += feat.nbytes
+        insert_multi("images", image_records)
+        self.count += len(image_records)
+
+        cache = get_embedding_cache()
+        if cache is not None:
+            items = [(self.cache_keys[fname], feat) for fname, feat, from_cache in self.buffer
+                     if not from_cache and fname in self.cache_keys]
+            try:
+                cache.put_many(items)
+            except Exception as e:
+                logger.warning(f"写入特征缓存失败: {e}")
+        self.buffer = []
+
 # ========================
 # 索引构建核心类定义
 # ========================
@@ -46,6 +102,7 @@ class IndexBuilder:
         self.ids_path = getattr(config, "ID_PATH", "ids.npy")
         self.index_path = getattr(config, "INDEX_PATH", "index.bin")
         self.id_map = {}
+        self.index_info = None  # 最近一次构建的索引元数据（索引结构、向量数、查询参数）
         
         # 检查分布式计算是否真正可用
         self.distributed_available = False
@@ -70,7 +127,13 @@ class IndexBuilder:
                     f.write(f"特征提取: {percent:3d}%|{progress_bar}| {current}/{total}\n")
             except Exception as e:
                 print(f"写入进度文件时出错: {e}")    # ---------- 索引构建主流程 ----------
-    def build(self, progress_file=None):
+    def build(self, progress_file=None, extract_mode=None):
+        """
+        构建索引主流程
+        :param progress_file: 进度文件路径
+        :param extract_mode: 本地特征提取模式，"batch" 或 "pipeline"，默认使用 config.extract_mode
+        """
+        self.extract_mode = extract_mode or getattr(config, "extract_mode", "batch")
         # --- 1. 读取图片文件和描述信息 ---
         img_files = [f for f in os.listdir(self.dataset_dir) if f.lower().endswith(self.img_exts) and f != 'query.jpg']
         desc_map = {}
@@ -95,10 +158,8 @@ class IndexBuilder:
             print(f"数据集目录 {self.dataset_dir} 下没有可用图片文件")
             raise ValueError(f"数据集目录 {self.dataset_dir} 下没有可用图片文件")
         
-        features = []
-        image_records = []
-        processed_fnames = []
         self.id_map.clear()
+        chunk_size = getattr(config, "BUILD_CHUNK_SIZE", 1024)
 
         # --- 1.5 读取数据库图片路径，处理新增和已删除图片 ---
         from database_module.query import query_one, query_multi
@@ -132,7 +193,6 @@ class IndexBuilder:
                 with open(progress_file, "w", encoding="utf-8") as f:
                     f.write("特征提取: 100%|██████████| 0/0 [00:00<00:00]\n")
                     f.write("索引构建完成\n")
-        processed_fnames = []
         # 删除数据库中已不存在的图片
         deleted_db_ids = [img_id for img_id, path in db_id_path_map.items() if path not in img_paths_set]
         if deleted_db_ids:
@@ -141,6 +201,11 @@ class IndexBuilder:
                 delete("images", {"id": img_id})
             print(f"已从数据库删除 {len(deleted_db_ids)} 条已不存在图片的记录。")        # --- 2. 特征提取（本地或分布式） ---
         if img_files_to_process:
+            # 先确保数据集记录存在，特征按块直接写入数据库
+            dataset_id = self._update_database(len(img_files), 0)
+            writer = FeatureChunkWriter(dataset_id, self.dataset_dir, desc_map, chunk_size)
+            # 先按图片内容哈希查询特征缓存，命中的图片跳过推理
+            img_files_to_process = self._load_cached_features(img_files_to_process, writer, pbar, progress_file)
             if self.distributed and self.distributed_available:
                 logger.info("使用分布式特征提取...")
                 try:
@@ -160,7 +225,7 @@ class IndexBuilder:
                             logger.error(f"提交远程任务失败: {e}")
                             # 如果任务提交失败，回退到本地计算
                             logger.warning("分布式任务提交失败，回退到本地计算")
-                            self._process_images_locally(img_files_to_process, features, processed_fnames, pbar, progress_file, total_imgs)
+                            self._process_images_locally(img_files_to_process, writer, pbar, progress_file, total_imgs)
                             break
                     else:
                         # 处理所有远程任务结果
@@ -169,8 +234,7 @@ class IndexBuilder:
                                 embedding_list = future.get(timeout=120)  # 增加超时时间
                                 embedding = np.array(embedding_list, dtype='float32').reshape(1, -1)
                                 self.id_map[idx] = fname
-                                features.append(embedding.squeeze())
-                                processed_fnames.append(fname)
+                                writer.add(fname, embedding.squeeze())
                                 if pbar: 
                                     pbar.update(1)
                                     self._write_progress_to_file(progress_file, pbar.n, pbar.total)
@@ -184,13 +248,14 @@ class IndexBuilder:
                         
                 except ImportError:
                     logger.warning("无法导入worker模块，回退到本地计算")
-                    self._process_images_locally(img_files_to_process, features, processed_fnames, pbar, progress_file, total_imgs)
+                    self._process_images_locally(img_files_to_process, writer, pbar, progress_file, total_imgs)
                 except Exception as e:
                     logger.error(f"分布式计算过程中出错: {e}，回退到本地计算")
-                    self._process_images_locally(img_files_to_process, features, processed_fnames, pbar, progress_file, total_imgs)
+                    self._process_images_locally(img_files_to_process, writer, pbar, progress_file, total_imgs)
             else:
                 logger.info("使用本地特征提取...")
-                self._process_images_locally(img_files_to_process, features, processed_fnames, pbar, progress_file, total_imgs)
+                self._process_images_locally(img_files_to_process, writer, pbar, progress_file, total_imgs)
+            writer.flush()
             if pbar:
                 pbar.close()
                 # 手动写入最终进度到文件
@@ -200,27 +265,10 @@ class IndexBuilder:
                 # 在进度文件末尾添加完成标记
                 with open(progress_file, "a", encoding="utf-8") as f:
                     f.write("索引构建完成\n")
-            if features:
-                features = np.stack(features).astype('float32')            # --- 3. 写入数据库（仅插入新图片） ---
-            dataset_id = self._update_database(len(img_files), (features.nbytes if len(features) > 0 else 0))
-            # 注意：只写入成功处理的图片
-            for idx, fname in enumerate(processed_fnames):
-                image_path = os.path.join(self.dataset_dir, fname)
-                if idx < len(features):  # 确保特征索引有效
-                    feature_vector = features[idx].tobytes()
-                    metadata_json = desc_map.get(fname) if desc_map else None
-                    image_records.append({
-                        "dataset_id": dataset_id,
-                        "image_path": image_path,
-                        "resource_type": "control",
-                        "metadata_json": metadata_json,
-                        "feature_vector": feature_vector,
-                        "external_ids": None
-                    })
-            if image_records:
-                from database_module.modify import insert_multi
-                insert_multi("images", image_records)
-                print(f"已写入 {len(image_records)} 条新图片特征到数据库。")
+            # --- 3. 特征已在提取过程中分块写入数据库（仅新图片），这里更新数据集大小 ---
+            update("datasets", {"size": str(writer.nbytes)}, where={"id": dataset_id})
+            if writer.count:
+                print(f"已写入 {writer.count} 条新图片特征到数据库。")
             else:
                 print("没有新图片需要写入数据库。")
         else:
@@ -228,23 +276,66 @@ class IndexBuilder:
             if dataset_id is not None:
                 self._update_database(len(img_files), 0)
 
-        # --- 4. 查询数据库所有图片特征，构建索引文件 ---
-        rows = query_multi(
-            "images",
-            columns="id, feature_vector, image_path",
-            where={"dataset_id": dataset_id},
-            order_by="id ASC"
-        )
-        # 只保留数据库中图片路径仍然存在于文件夹中的图片
-        valid_rows = [row for row in rows if row[2] in img_paths_set]
-        if len(valid_rows) > 0:
-            db_ids = np.array([row[0] for row in valid_rows], dtype='int64')
-            features = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in valid_rows]).astype('float32')
-            build_index(features, db_ids, name=f"{dataset_id}.index")
-        else:
-            print("没有有效图片可用于构建索引。")
+        # --- 4. 分块读取数据库图片特征，构建索引文件 ---
+        def index_chunks():
+            for rows in iter_query(
+                "images",
+                columns="id, feature_vector, image_path",
+                where={"dataset_id": dataset_id},
+                order_by="id ASC",
+                chunk_size=chunk_size
+            ):
+                # 只保留数据库中图片路径仍然存在于文件夹中的图片
+                valid_rows = [row for row in rows if row[2] in img_paths_set]
+                if valid_rows:
+                    db_ids = np.array([row[0] for row in valid_rows], dtype='int64')
+                    features = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in valid_rows]).astype('float32')
+                    yield db_ids, features
+        index_name = f"{dataset_id}.index"
+        self.index_info = None
+        if getattr(config, "INDEX_INCREMENTAL", True):
+            # 已有索引时只增删变化的向量，不重新读取全部特征、不重新训练
+            self.index_info = self._update_index_incrementally(dataset_id, index_name, img_paths_set, chunk_size)
+        if self.index_info is None:
+            self.index_info = build_index_from_chunks(index_chunks, name=index_name)
+            if self.index_info:
+                self.index_info["update"] = {"mode": "rebuild"}
         return True
 
+    def _update_index_incrementally(self, dataset_id, index_name, img_paths_set, chunk_size):
+        """
+        增量更新已有索引：只读取索引中尚不存在的图片特征
+        :return: 索引元数据；索引不存在、更新失败或需要重新训练时返回 None
+        """
+        rows = query_multi("images", columns="id, image_path", where={"dataset_id": dataset_id})
+        valid_ids = [row[0] for row in rows if row[1] in img_paths_set]
+        if not valid_ids:
+            return None
+
+        def fetch_chunks(ids):
+            if not ids:
+                return
+            wanted = set(ids)
+            # 新图片的 ID 由自增主键分配，通常都在末尾，按最小 ID 过滤后只读取新增部分
+            for rows in iter_query(
+                "images",
+                columns="id, feature_vector",
+                where={"dataset_id": dataset_id, "id": (">=", min(wanted))},
+                order_by="id ASC",
+                chunk_size=chunk_size
+            ):
+                rows = [row for row in rows if row[0] in wanted]
+                if rows:
+                    db_ids = np.array([row[0] for row in rows], dtype='int64')
+                    features = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]).astype('float32')
+                    yield db_ids, features
+
+        try:
+            return sync_index(index_name, valid_ids, fetch_chunks)
+        except Exception as e:
+            logger.warning(f"增量更新索引失败，改为全量重建: {e}")
+            return None
+
     # ---------- 数据库更新辅助方法 ----------
     def _update_database(self, image_count, feature_bytes):
         now = datetime.datetime.now()
@@ -296,21 +387,142 @@ class IndexBuilder:
             result.append((img_id, feat))
         return result
 
-    def _process_images_locally(self, img_files_to_process, features, processed_fnames, pbar, progress_file, total_imgs):
-        """本地处理图像特征提取"""
-        embedder = feature_extractor()
+    # ---------- 特征缓存 ----------
+    def _load_cached_features(self, img_files_to_process, writer, pbar, progress_file):
+        """
+        计算图片内容哈希并批量查询特征缓存，命中的特征直接交给 writer，
+        缓存键记录在 writer.cache_keys 中，供推理完成后回写缓存。
+        按 writer.chunk_size 分片查询，每片命中的特征交给 writer 后再查询下一片，内存占用与数据集大小无关
+        :return: 未命中、仍需推理的图片文件名列表
+        """
+        cache = get_embedding_cache()
+        if cache is None:
+            return img_files_to_process
+        cache_keys = writer.cache_keys
+        remaining = []
+        for start in range(0, len(img_files_to_process), writer.chunk_size):
+            fnames = img_files_to_process[start:start + writer.chunk_size]
+            for fname in fnames:
+                try:
+                    with open(os.path.join(self.dataset_dir, fname), 'rb') as f:
+                        cache_keys[fname] = cache.make_key(f.read())
+                except OSError as e:
+                    logger.error(f"读取图片 {fname} 失败: {e}")
+            hits = cache.get_many(cache_keys[fname] for fname in fnames if fname in cache_keys)
+            slice_cached = 0
+            for fname in fnames:
+                feat = hits.get(cache_keys.get(fname))
+                if feat is None:
+                    remaining.append(fname)
+                    continue
+                writer.add(fname, feat, from_cache=True)
+                slice_cached += 1
+            if slice_cached and pbar:
+                pbar.update(slice_cached)
+                self._write_progress_to_file(progress_file, pbar.n, pbar.total)
+        cached = len(img_files_to_process) - len(remaining)
+        if cached:
+            logger.info(f"特征缓存命中 {cached} 张图片，跳过推理")
+        return remaining
+
+    def _decode_images_ahead(self, img_files_to_process, embedder, buffer_queue):
+        """后台解码线程：逐张读取并预处理图片，放入有界缓冲队列（队列满时阻塞，限制预读数量）"""
         for idx, fname in enumerate(img_files_to_process):
             path = os.path.join(self.dataset_dir, fname)
             try:
-                img = Image.open(path)
-                feat = embedder.calculate(img)
+                with Image.open(path) as img:
+                    tensor = embedder.preprocess(img)
+                buffer_queue.put((idx, fname, tensor, None))
+            except Exception as e:
+                buffer_queue.put((idx, fname, None, e))
+        buffer_queue.put(None)  # 结束标记
+
+    def _flush_batch(self, embedder, batch, writer):
+        """对缓冲的一批图片执行批量推理；整批失败时逐张重试，隔离出错的图片"""
+        if not batch:
+            return
+        try:
+            batch_feats = embedder.calculate_tensors([tensor for _, _, tensor in batch])
+            results = list(zip(batch, batch_feats))
+        except Exception as e:
+            logger.warning(f"批量推理失败，改为逐张处理: {e}")
+            results = []
+            for item in batch:
+                try:
+                    results.append((item, embedder.calculate_tensors([item[2]])[0]))
+                except Exception as img_e:
+                    logger.error(f"[跳过] 图片 {item[1]} 处理失败: {img_e}")
+        for (idx, fname, _), feat in results:
+            self.id_map[idx] = fname
+            writer.add(fname, feat)
+
+    def _process_images_pipeline(self, img_files_to_process, writer, pbar, progress_file):
+        """
+        流水线方式本地提取特征：DataLoader 多进程并行解码并预取，主进程批量推理
+        """
+        embedder = get_feature_extractor()
+        paths = [os.path.join(self.dataset_dir, fname) for fname in img_files_to_process]
+        for indices, batch_feats, failures in embedder.iter_path_batches(paths):
+            for idx, err in failures:
+                logger.error(f"[跳过] 图片 {img_files_to_process[idx]} 处理失败: {err}")
+            for idx, feat in zip(indices, batch_feats):
+                fname = img_files_to_process[idx]
                 self.id_map[idx] = fname
-                features.append(feat)
-                processed_fnames.append(fname)
+                writer.add(fname, feat)
+            if pbar:
+                pbar.update(len(indices) + len(failures))
+                self._write_progress_to_file(progress_file, pbar.n, pbar.total)
+
+    def _process_images_locally(self, img_files_to_process, writer, pbar, progress_file, total_imgs):
+        """本地处理图像特征提取：按 extract_mode 选择流水线模式或后台线程预解码的批量模式"""
+        # 构建线程使用 build 角色的 CPU 预算，避免挤占在线检索
+        set_thread_role("build")
+        # 分布式中途失败回退时，跳过已经取得特征的图片
+        img_files_to_process = [fname for fname in img_files_to_process if fname not in writer.processed_fnames]
+        if getattr(self, "extract_mode", "batch") == "pipeline":
+            try:
+                self._process_images_pipeline(img_files_to_process, writer, pbar, progress_file)
+                logger.info("本地特征提取完成（pipeline 模式）")
+                return
             except Exception as e:
-                logger.error(f"[跳过] 图片 {fname} 处理失败: {e}")
-                continue
-            if pbar: 
-                pbar.update(1)
+                # 已处理的图片保留结果，剩余图片回退到批量模式
+                logger.error(f"pipeline 模式特征提取出错: {e}，剩余图片回退到 batch 模式")
+                img_files_to_process = [fname for fname in img_files_to_process if fname not in writer.processed_fnames]
+        self._process_images_batched(img_files_to_process, writer, pbar, progress_file)
+
+    def _process_images_batched(self, img_files_to_process, writer, pbar, progress_file):
+        """批量模式：后台线程预解码，主线程按 config.batchsize 批量推理"""
+        embedder = get_feature_extractor()
+        batchsize = max(1, int(getattr(config, "batchsize", 1)))
+        # 预读缓冲上限为两个批次，避免大数据集解码结果占满内存
+        buffer_queue = queue.Queue(maxsize=batchsize * 2)
+        decoder = threading.Thread(
+            target=self._decode_images_ahead,
+            args=(img_files_to_process, embedder, buffer_queue),
+            daemon=True
+        )
+        decoder.start()
+
+        batch = []
+        consumed = 0  # 自上次进度更新以来已取出的图片数（含失败图片）
+        while True:
+            item = buffer_queue.get()
+            if item is not None:
+                idx, fname, tensor, err = item
+                consumed += 1
+                if err is not None:
+                    logger.error(f"[跳过] 图片 {fname} 处理失败: {err}")
+                else:
+                    batch.append((idx, fname, tensor))
+                if len(batch) < batchsize:
+                    continue
+            self._flush_batch(embedder, batch, writer)
+            batch = []
+            if pbar and consumed:
+                pbar.update(consumed)
                 self._write_progress_to_file(progress_file, pbar.n, pbar.total)
+            consumed = 0
+            if item is None:
+                break
+        decoder.join()
         logger.info("本地特征提取完成")
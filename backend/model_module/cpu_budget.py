@@ -0,0 +1,99 @@
+"""
+cpu_budget.py
+按进程角色配置推理使用的 CPU 资源，避免后台索引构建与在线检索同时运行时线程超额订阅。
+角色:
+- app: Flask 进程内的检索请求线程与微批调度线程
+- build: 本地索引构建线程
+- worker: Celery 特征提取进程
+torch 的算子内线程数（OpenMP）与 Linux 下的 sched_setaffinity(0, ...) 都作用于调用线程，
+因此预算在每个线程首次推理前按该线程的角色应用一次；算子间线程数只能在进程内设置一次。
+"""
+import os
+import sys
+import threading
+import torch
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+
+ROLES = ("app", "build", "worker")
+
+_process_role = "app"
+_interop_applied = False
+_interop_lock = threading.Lock()
+_thread_state = threading.local()
+
+
+def get_cpu_budget(role):
+    """
+    外部接口：读取角色的 CPU 预算
+    :return: dict(intra_op_threads, inter_op_threads, cpu_cores)，未配置的项为 None
+    """
+    if role not in ROLES:
+        raise ValueError(f"未知的进程角色 '{role}'，可选: {ROLES}")
+    budget = getattr(config, "CPU_BUDGETS", {}).get(role) or {}
+    return {
+        "intra_op_threads": budget.get("intra_op_threads"),
+        "inter_op_threads": budget.get("inter_op_threads"),
+        "cpu_cores": budget.get("cpu_cores"),
+    }
+
+
+def get_process_role():
+    """外部接口：当前进程的默认角色"""
+    return _process_role
+
+
+def set_thread_role(role):
+    """
+    外部接口：声明当前线程的角色（如索引构建线程声明为 build），下一次推理前生效
+    """
+    get_cpu_budget(role)  # 校验角色
+    _thread_state.role = role
+
+
+def apply_thread_budget(role=None):
+    """
+    外部接口：对当前线程应用角色的 CPU 预算（算子内线程数、CPU 核绑定）
+    同一线程同一角色只应用一次，推理热路径上重复调用开销可忽略
+    :param role: 角色，默认使用 set_thread_role 声明的角色，否则使用进程角色
+    """
+    role = role or getattr(_thread_state, "role", None) or _process_role
+    if getattr(_thread_state, "applied_role", None) == role:
+        return
+    budget = get_cpu_budget(role)
+    _apply_interop_threads(budget["inter_op_threads"])
+    if budget["intra_op_threads"]:
+        torch.set_num_threads(int(budget["intra_op_threads"]))
+    if budget["cpu_cores"] and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, set(budget["cpu_cores"]))
+        except OSError as e:
+            print(f"[!] 绑定 CPU 核 {budget['cpu_cores']} 失败: {e}")
+    _thread_state.applied_role = role
+
+
+def apply_process_budget(role):
+    """
+    外部接口：设置进程角色并对当前线程应用预算，在进程启动时调用
+    """
+    global _process_role
+    get_cpu_budget(role)  # 校验角色
+    _process_role = role
+    apply_thread_budget(role)
+
+
+def _apply_interop_threads(inter_op_threads):
+    """算子间线程数只能在进程内首次并行工作前设置一次，之后的设置会被忽略"""
+    global _interop_applied
+    if not inter_op_threads or _interop_applied:
+        return
+    with _interop_lock:
+        if _interop_applied:
+            return
+        try:
+            torch.set_interop_threads(int(inter_op_threads))
+        except RuntimeError:
+            # 进程内已开始并行工作，保持 torch 当前设置
+            pass
+        _interop_applied = True
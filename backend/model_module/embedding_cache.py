@@ -0,0 +1,194 @@
+"""
+embedding_cache.py
+按图片内容哈希缓存特征向量，跳过相同图片的重复推理。
+缓存键 = sha256(模型/预处理版本 + 图片字节 + 附加参数，如裁剪框)，
+因此重命名、重复上传到其他数据集、检索库中已有的图片都能直接命中；
+模型或预处理配置变化后版本不同，旧缓存自然失效并被 LRU 淘汰。
+缓存存放在独立的 SQLite 文件中，按条目数上限做 LRU 淘汰，并统计命中率。
+"""
+import os
+import sys
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+
+
+def embedding_version():
+    """
+    外部接口：当前模型与预处理配置的版本串，参与缓存键计算
+    """
+    version = {
+        "model_type": config.model_type,
+        "pretrain": config.pretrain,
+        "input_size": config.input_size,
+        "normalize_mean": list(config.normalize_mean),
+        "normalize_std": list(config.normalize_std),
+        "fast_decode": getattr(config, "fast_decode", False),
+        "precision": getattr(config, "inference_precision", "fp32"),
+        "l2_normalize": str(getattr(config, "INDEX_METRIC", "l2")).lower() == "cosine",
+    }
+    return json.dumps(version, sort_keys=True)
+
+
+class EmbeddingCache(object):
+    """
+    持久化特征缓存
+    属性:
+        path (str): SQLite 缓存文件路径
+        max_entries (int): 最大缓存条目数，超出后淘汰最久未访问的条目
+    """
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or config.EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or getattr(config, "EMBEDDING_CACHE_MAX_ENTRIES", 100000)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                feature BLOB NOT NULL,
+                last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+            conn.commit()
+            self._approx_count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """每次操作使用独立连接，WAL 模式允许多个线程/进程并发读写"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def make_key(image_bytes, extra=None, version=None):
+        """
+        外部接口：计算缓存键
+        :param image_bytes: 图片文件原始字节
+        :param extra: 影响特征的附加参数（如裁剪框），None 表示无
+        :param version: 版本串，默认为当前配置的 embedding_version()
+        """
+        h = hashlib.sha256()
+        h.update((version or embedding_version()).encode("utf-8"))
+        h.update(b"\0")
+        h.update(image_bytes)
+        if extra is not None:
+            h.update(b"\0")
+            h.update(json.dumps(extra, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key):
+        """外部接口：查询单个缓存键，未命中返回 None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        外部接口：批量查询缓存，命中的条目刷新访问时间
+        :return: dict{key: np.ndarray}，只包含命中的键
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        if not keys:
+            return found
+        conn = self._connect()
+        try:
+            # SQLite 单条语句变量数有限，分块查询
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, feature FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                 [(now, key) for key in found])
+                conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._stats["hits"] += len(found)
+            self._stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put(self, key, feature):
+        """外部接口：写入单个特征"""
+        self.put_many([(key, feature)])
+
+    def put_many(self, items):
+        """
+        外部接口：批量写入特征，写入后超出上限时按 LRU 淘汰
+        :param items: [(key, np.ndarray)]
+        """
+        items = [(key, np.asarray(feat, dtype=np.float32).tobytes()) for key, feat in items]
+        if not items:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, feature, last_access) VALUES (?, ?, ?)",
+                             [(key, blob, now) for key, blob in items])
+            conn.commit()
+            with self._lock:
+                self._stats["writes"] += len(items)
+                self._approx_count += len(items)
+                need_check = self._approx_count > self.max_entries
+            if need_check:
+                self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        """淘汰最久未访问的条目，直到不超过 max_entries"""
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)", (overflow,)
+            )
+            conn.commit()
+            count -= overflow
+        with self._lock:
+            self._approx_count = count
+            self._stats["evictions"] += max(0, overflow)
+
+    def get_stats(self):
+        """外部接口：返回本进程内的命中率等统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._approx_count
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    外部接口：获取进程内共享的特征缓存，config.EMBEDDING_CACHE_ENABLED 关闭时返回 None
+    """
+    global _cache
+    if not getattr(config, "EMBEDDING_CACHE_ENABLED", False):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -1,32 +1,138 @@
 import os
 import sys
+import itertools
+import threading
+import time
+import numpy as np
 import torch
 from torchvision import transforms, models
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset
 import torch.nn as nn
 from PIL import Image
 from tqdm import tqdm
 # 添加项目根路径，便于导入 config 和模块
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from config import config
+from model_module.cpu_budget import apply_thread_budget
+
+
+def reduce_for_target(image, target_size):
+    """
+    按目标尺寸降分辨率解码，返回 RGB 图片
+    JPEG 在解码前通过 draft 模式以 1/2、1/4、1/8 比例直接缩放解码；
+    之后若仍为目标尺寸的 2 倍以上，再用 Image.reduce 整数倍缩小。两步都保证宽高不小于 target_size
+    """
+    image.draft('RGB', (target_size, target_size))  # 非 JPEG 或已解码的图片调用无副作用
+    image = image.convert('RGB')
+    factor = min(image.size[0] // target_size, image.size[1] // target_size)
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def preprocess_image(image, transform, input_size, fast_decode):
+    """
+    将 PIL 图片转换为模型输入张量，feature_extractor 与 ImagePathDataset 共用
+    """
+    if fast_decode:
+        image = reduce_for_target(image, input_size)
+    else:
+        image = image.convert('RGB')
+    return transform(image)
+
+
+class ImagePathDataset(Dataset):
+    """
+    按文件路径读取图片的数据集，供 DataLoader 在多个工作进程中并行解码和预处理
+    每项返回 (序号, 张量, 错误信息)，解码失败时返回全零张量和非空错误信息，不中断整个批次
+    """
+    def __init__(self, paths, transform, input_size, fast_decode=False):
+        self.paths = list(paths)
+        self.transform = transform
+        self.input_size = input_size
+        self.fast_decode = fast_decode
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        try:
+            with Image.open(self.paths[idx]) as img:
+                tensor = preprocess_image(img, self.transform, self.input_size, self.fast_decode)
+            return idx, tensor, ""
+        except Exception as e:
+            return idx, torch.zeros(3, self.input_size, self.input_size), str(e) or repr(e)
+
+
+# 支持的推理精度模式
+PRECISION_MODES = ("fp32", "int8", "bf16")
+IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# 进程级特征提取器注册表：(model_type, device, input_size, precision) -> 已加载的 feature_extractor
+_extractor_registry = {}
+# 输出维度缓存，避免重复执行 dummy 前向推理
+_output_dim_cache = {}
+_registry_lock = threading.Lock()
+
+
+def get_feature_extractor(model_type=None, device=None, input_size=None, precision=None):
+    """
+    外部接口：获取进程内共享的特征提取器（线程安全）
+    同一 (model_type, device, input_size, precision) 在每个进程中只加载一次模型，
+    未指定的参数使用 config.py 中的配置
+    :return: 已完成加载和预热、可直接推理的 feature_extractor 实例
+    """
+    key = (
+        model_type or config.model_type,
+        device or config.device,
+        input_size or config.input_size,
+        precision or getattr(config, "inference_precision", "fp32"),
+    )
+    extractor = _extractor_registry.get(key)
+    if extractor is not None:
+        return extractor
+    with _registry_lock:
+        # 双重检查，防止多个线程同时加载同一模型
+        extractor = _extractor_registry.get(key)
+        if extractor is None:
+            extractor = feature_extractor(model_type=key[0], device=key[1], input_size=key[2], precision=key[3])
+            _extractor_registry[key] = extractor
+    return extractor
+
+
+def clear_feature_extractors():
+    """
+    外部接口：清空已缓存的特征提取器（修改模型相关配置后调用）
+    """
+    with _registry_lock:
+        _extractor_registry.clear()
+        _output_dim_cache.clear()
 
 
 class feature_extractor(object):
-    def __init__(self):
+    def __init__(self, model_type=None, device=None, input_size=None, precision=None):
         """
-        外部接口：初始化，直接使用 config.py 中的配置变量
+        外部接口：初始化，未指定的参数直接使用 config.py 中的配置变量
+        推荐通过 get_feature_extractor() 获取共享实例，避免重复加载模型
         """
-        self.device = config.device
+        self.device = device or config.device
         self.pretrain = config.pretrain
-        self.model_type = config.model_type
-        self.input_size = config.input_size
+        self.model_type = model_type or config.model_type
+        self.input_size = input_size or config.input_size
         self.normalize_mean = config.normalize_mean
         self.normalize_std = config.normalize_std
         self.batchsize = config.batchsize
-
-        # 动态加载模型
-        self.model = self._load_model(self.model_type, self.pretrain)
-        self.model.fc = nn.Identity()
+        self.fast_decode = getattr(config, "fast_decode", False)
+        self.precision = precision or getattr(config, "inference_precision", "fp32")
+        self.channels_last = getattr(config, "channels_last", False)
+        # 余弦度量的索引在提取时就对特征做 L2 归一化，数据库与特征缓存中保存的都是单位向量
+        self.l2_normalize = str(getattr(config, "INDEX_METRIC", "l2")).lower() == "cosine"
+        if self.precision not in PRECISION_MODES:
+            raise ValueError(f"inference_precision '{self.precision}' 不受支持，可选: {PRECISION_MODES}")
+        if self.precision != "fp32" and not str(self.device).startswith("cpu"):
+            print(f"[!] {self.precision} 推理仅支持 CPU，设备 {self.device} 回退到 fp32")
+            self.precision = "fp32"
 
         # 图像预处理
         self.data_transforms = transforms.Compose([
@@ -34,7 +140,34 @@ class feature_extractor(object):
             transforms.ToTensor(),
             transforms.Normalize(self.normalize_mean, self.normalize_std)
         ])
-        self.dimension = self.get_output_dim()
+
+        # 按当前线程角色限制 torch 线程数 / 绑定 CPU 核，再加载模型
+        apply_thread_budget()
+
+        # 动态加载模型：优先加载已导出的 TorchScript 产物，否则从 torchvision 构建
+        start_time = time.time()
+        use_script = getattr(config, "use_torchscript", False) and self.precision in ("fp32", "int8")
+        self.model = self._load_torchscript() if use_script else None
+        self.scripted = self.model is not None
+        if not self.scripted:
+            self.model = self._load_model(self.model_type, self.pretrain)
+            self.model.fc = nn.Identity()
+            # 模型只在初始化时迁移设备并切换到推理模式，推理时不再重复设置
+            self.model = self.model.to(self.device)
+            self.model.eval()
+            self._apply_precision()
+            if use_script:
+                try:
+                    self.model = self.export_torchscript()
+                    self.scripted = True
+                except Exception as e:
+                    print(f"[!] TorchScript 导出失败（{e}），使用 eager 模型推理")
+        self.load_seconds = time.time() - start_time
+        dim_key = (self.model_type, self.device, self.input_size)
+        self.dimension = _output_dim_cache.get(dim_key)
+        if self.dimension is None:
+            self.dimension = self.get_output_dim()
+            _output_dim_cache[dim_key] = self.dimension
 
     def _load_model(self, model_type, pretrain):
         """
@@ -46,59 +179,243 @@ class feature_extractor(object):
         model = model_fn(pretrained=pretrain)
         return model
 
+    def _apply_precision(self):
+        """
+        内部函数：按推理精度配置转换模型（仅 CPU 支持 int8/bf16）
+        - int8: 卷积骨干网络用 FX 静态训练后量化（需要校准图片），
+                无校准图片或转换失败时回退为 Linear 层动态量化，模型没有 Linear 层时回退 fp32
+        - bf16: 推理时启用 CPU bf16 autocast，不支持时回退 fp32
+        - channels_last: 以 NHWC 内存布局运行卷积
+        """
+        if self.channels_last and self.precision != "int8":
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+        if self.precision == "int8":
+            calibration_tensors = self._load_calibration_tensors()
+            try:
+                if not calibration_tensors:
+                    raise RuntimeError("未找到校准图片")
+                self.model = self._quantize_static(calibration_tensors)
+                print(f"[√] int8 静态量化完成，校准图片 {len(calibration_tensors)} 张")
+            except Exception as e:
+                if any(isinstance(m, nn.Linear) for m in self.model.modules()):
+                    print(f"[!] int8 静态量化不可用（{e}），改用 Linear 层动态量化")
+                    self.model = torch.ao.quantization.quantize_dynamic(self.model, {nn.Linear}, dtype=torch.qint8)
+                else:
+                    # 骨干网络（fc 已替换为 Identity）没有 Linear 层，动态量化不会改变模型
+                    print(f"[!] int8 静态量化不可用（{e}），模型没有可动态量化的 Linear 层，回退到 fp32")
+                    self.precision = "fp32"
+                    if self.channels_last:
+                        self.model = self.model.to(memory_format=torch.channels_last)
+        elif self.precision == "bf16":
+            try:
+                dummy_input = torch.randn(1, 3, self.input_size, self.input_size)
+                self._forward(dummy_input)
+            except Exception as e:
+                print(f"[!] 当前 CPU/torch 不支持 bf16 推理（{e}），回退到 fp32")
+                self.precision = "fp32"
+
+    def torchscript_path(self):
+        """
+        外部接口：当前模型配置对应的 TorchScript 产物路径
+        文件名包含模型、权重、输入尺寸、精度、内存布局、设备和 torch 版本，配置变化时不会误用旧产物
+        """
+        weights = "pretrained" if self.pretrain else "random"
+        layout = "_cl" if self.channels_last and self.precision != "int8" else ""
+        device = str(self.device).replace(":", "-")
+        fname = f"{self.model_type}_{weights}_{self.input_size}_{self.precision}{layout}_{device}_torch{torch.__version__}.pt"
+        cache_dir = getattr(config, "MODEL_CACHE_DIR", os.path.join("data", "models"))
+        return os.path.join(cache_dir, fname)
+
+    def export_torchscript(self, path=None):
+        """
+        外部接口：将当前模型（已替换 fc 并完成精度转换）trace 并 freeze 为 TorchScript，
+        先写入临时文件再原子替换到数据目录，下次启动直接加载
+        :return: freeze 后的 TorchScript 模型（卷积与 BN 已融合）
+        """
+        path = path or self.torchscript_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        example_input = torch.randn(1, 3, self.input_size, self.input_size).to(self.device)
+        if self.channels_last and self.precision != "int8":
+            example_input = example_input.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad():
+            traced = torch.jit.trace(self.model, example_input)
+            frozen = torch.jit.freeze(traced)
+        tmp_path = path + ".tmp"
+        torch.jit.save(frozen, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"[√] TorchScript 模型已导出: {path}")
+        return frozen
+
+    def _load_torchscript(self):
+        """
+        内部函数：加载已导出的 TorchScript 产物，不存在或加载失败时返回 None
+        """
+        path = self.torchscript_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            model = torch.jit.load(path, map_location=self.device)
+            model.eval()
+            return model
+        except Exception as e:
+            print(f"[!] 加载 TorchScript 产物失败（{e}），重新构建模型")
+            return None
+
+    def _load_calibration_tensors(self):
+        """
+        内部函数：从校准目录读取图片并预处理，用于 int8 静态量化
+        """
+        calib_dir = getattr(config, "quantize_calibration_dir", None) or config.DATASET_DIR
+        limit = getattr(config, "quantize_calibration_images", 64)
+        tensors = []
+        if not os.path.isdir(calib_dir):
+            return tensors
+        for root, _, files in os.walk(calib_dir):
+            for fname in sorted(files):
+                if not fname.lower().endswith(IMG_EXTS):
+                    continue
+                try:
+                    with Image.open(os.path.join(root, fname)) as img:
+                        tensors.append(self.preprocess(img))
+                except Exception:
+                    continue
+                if len(tensors) >= limit:
+                    return tensors
+        return tensors
+
+    def _quantize_static(self, calibration_tensors):
+        """
+        内部函数：FX 图模式静态训练后量化（卷积、BN、ReLU 融合后以 int8 运行）
+        """
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        example_inputs = (calibration_tensors[0].unsqueeze(0),)
+        prepared = prepare_fx(self.model, qconfig_mapping, example_inputs)
+        with torch.no_grad():
+            for i in range(0, len(calibration_tensors), self.batchsize):
+                prepared(torch.stack(calibration_tensors[i:i + self.batchsize]))
+        return convert_fx(prepared)
+
+    def _forward(self, image_tensor):
+        """
+        内部函数：按推理精度执行一次前向推理，返回 float32 张量
+        """
+        apply_thread_budget()
+        image_tensor = image_tensor.to(self.device)
+        if self.channels_last and self.precision != "int8":
+            image_tensor = image_tensor.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad():
+            if self.precision == "bf16":
+                with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+                    output = self.model(image_tensor)
+            else:
+                output = self.model(image_tensor)
+        return output.float()
+
+    def _embed(self, image_tensor):
+        """
+        内部函数：前向推理并按度量做后处理，返回 numpy float32 特征矩阵
+        余弦度量时做 L2 归一化，所有提取路径（含流水线模式）都经过此函数
+        """
+        output = self._forward(image_tensor)
+        if self.l2_normalize:
+            output = nn.functional.normalize(output, p=2, dim=1)
+        return output.cpu().numpy().astype('float32')
+
     def get_dimension(self):
         """
         外部接口：获取模型输出特征维度
         """
         return self.dimension
 
-    def calculate(self, image):
+    def preprocess(self, image):
         """
-        外部接口：计算单张图片的特征向量
+        外部接口：将单张 PIL 图片转换为模型输入张量（RGB、缩放、归一化）
+        启用 fast_decode 时，对尚未解码的 JPEG 以不小于输入尺寸的最小比例解码
         """
-        model = self.model.to(self.device)
-        model.eval()
-        image = image.convert('RGB')
-        image = self.data_transforms(image)
-        image_tensor = image.unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            output = model(image_tensor)
-        return output.squeeze(0).cpu().numpy().astype('float32')
+        return preprocess_image(image, self.data_transforms, self.input_size, self.fast_decode)
 
-    def calculate_batch(self, image_list):
+    def calculate_tensors(self, tensor_list):
         """
-        外部接口：批量计算图片特征向量
+        外部接口：对已预处理的图片张量执行一次批量前向推理
+        :param tensor_list: preprocess() 返回的张量列表
+        :return: shape=(N, dim) 的 float32 特征矩阵（余弦度量时为 L2 归一化后的单位向量）
         """
-        model = self.model.to(self.device)
-        model.eval()
-        batchsize = self.batchsize
+        return self._embed(torch.stack(tensor_list))
 
-        all_outputs = []
+    def calculate(self, image):
+        """
+        外部接口：计算单张图片的特征向量
+        """
+        return self.calculate_tensors([self.preprocess(image)])[0]
 
-        for i in tqdm(range(0, len(image_list), batchsize), desc="Processing batches"):
-            batch_img = image_list[i:i + batchsize]
-            processed_images = []
-            for img in batch_img:
-                img = img.convert('RGB')
-                img = self.data_transforms(img)
-                processed_images.append(img)
+    def iter_batches(self, images, ids=None):
+        """
+        外部接口：流式批量计算特征，逐批产出结果而不在内存中累积全部特征
+        :param images: PIL 图片的可迭代对象（可以是生成器）
+        :param ids: 与 images 一一对应的编号可迭代对象，默认为从 0 开始的序号
+        :return: 生成器，每批产出 (编号列表, shape=(n, dim) 的 float32 特征矩阵)
+        """
+        if ids is None:
+            ids = itertools.count()
+        batch_ids, batch_tensors = [], []
+        for img_id, img in zip(ids, images):
+            batch_ids.append(img_id)
+            batch_tensors.append(self.preprocess(img))
+            if len(batch_tensors) >= self.batchsize:
+                yield batch_ids, self.calculate_tensors(batch_tensors)
+                batch_ids, batch_tensors = [], []
+        if batch_tensors:
+            yield batch_ids, self.calculate_tensors(batch_tensors)
 
-            image_tensor = torch.stack(processed_images).to(self.device)
+    def calculate_batch(self, image_list):
+        """
+        外部接口：批量计算图片特征向量（一次性返回全部结果，大数据集请使用 iter_batches）
+        """
+        total = (len(image_list) + self.batchsize - 1) // self.batchsize
+        all_outputs = [feats for _, feats in tqdm(self.iter_batches(image_list), total=total, desc="Processing batches")]
+        return np.concatenate(all_outputs, axis=0).astype('float32')
 
-            with torch.no_grad():
-                output = model(image_tensor)
-                all_outputs.append(output.cpu())
+    def iter_path_batches(self, paths, num_workers=None, prefetch_factor=None):
+        """
+        外部接口：流水线方式按文件路径批量提取特征
+        DataLoader 工作进程并行解码/预处理并预取后续批次，主进程只负责前向推理
+        :param paths: 图片文件路径列表
+        :param num_workers: 解码工作进程数，默认 config.decode_workers
+        :param prefetch_factor: 每个工作进程预取批次数，默认 config.prefetch_factor
+        :return: 生成器，每批产出 (成功的序号列表, shape=(n, dim) 特征矩阵, [(失败序号, 错误信息)])
+        """
+        if num_workers is None:
+            num_workers = getattr(config, "decode_workers", 0)
+        if prefetch_factor is None:
+            prefetch_factor = getattr(config, "prefetch_factor", 2)
+        dataset = ImagePathDataset(paths, self.data_transforms, self.input_size, self.fast_decode)
+        loader_kwargs = {
+            "batch_size": self.batchsize,
+            "shuffle": False,
+            "num_workers": num_workers,
+            "pin_memory": str(self.device).startswith("cuda"),
+        }
+        if num_workers > 0:
+            loader_kwargs["prefetch_factor"] = prefetch_factor
+        loader = DataLoader(dataset, **loader_kwargs)
 
-        return torch.cat(all_outputs, dim=0).cpu().numpy().astype('float32')
+        for indices, tensors, errors in loader:
+            ok_pos = [i for i, err in enumerate(errors) if not err]
+            failures = [(int(indices[i]), errors[i]) for i, err in enumerate(errors) if err]
+            if ok_pos:
+                feats = self._embed(tensors[ok_pos])
+            else:
+                feats = np.empty((0, self.dimension), dtype='float32')
+            yield [int(indices[i]) for i in ok_pos], feats, failures
 
     def get_output_dim(self):
         """
         内部函数：获取模型输出特征维度（供初始化时调用）
         """
-        dummy_input = torch.randn(1, 3, self.input_size, self.input_size).to(self.device)
-        model = self.model.to(self.device)
-        model.eval()
-        with torch.no_grad():
-            output = model(dummy_input)
-            output = output.view(output.size(0), -1)
+        dummy_input = torch.randn(1, 3, self.input_size, self.input_size)
+        output = self._forward(dummy_input)
+        output = output.view(output.size(0), -1)
         return output.shape[1]
@@ -0,0 +1,153 @@
+"""
+inference_scheduler.py
+进程内动态微批推理调度器。
+并发的检索请求在各自线程中完成图片预处理后提交到队列，调度线程把一个短时间窗口内到达的请求
+合并为一个批次，只执行一次前向推理，再把每张图片的特征分别交还给对应调用方的 Future。
+"""
+import os
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import Future
+# 添加项目根路径，便于导入 config 和模块
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from config import config
+from model_module.feature_extractor import get_feature_extractor
+
+
+class InferenceScheduler(object):
+    """
+    动态微批推理调度器
+    属性:
+        extractor: 执行推理的 feature_extractor 实例
+        window (float): 攒批等待窗口（秒），从批次第一个请求到达开始计时
+        max_batch (int): 单批次最大图片数
+    """
+    def __init__(self, extractor, window_ms=None, max_batch=None):
+        self.extractor = extractor
+        if window_ms is None:
+            window_ms = getattr(config, "microbatch_window_ms", 10)
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch or getattr(config, "microbatch_max_size", 32))
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batched_requests": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "max_batch_size": 0,
+            "max_queue_depth": 0,
+            "total_wait_ms": 0.0,
+            "total_infer_ms": 0.0,
+            "batch_size_histogram": {},
+        }
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """
+        外部接口：提交单张 PIL 图片，预处理在调用线程中完成
+        :return: concurrent.futures.Future，结果为 shape=(dim,) 的 float32 特征向量
+        """
+        tensor = self.extractor.preprocess(image)
+        future = Future()
+        self._queue.put((tensor, future, time.monotonic()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], depth)
+        return future
+
+    def calculate(self, image, timeout=None):
+        """
+        外部接口：同步计算单张图片特征，与 feature_extractor.calculate 返回格式一致
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def get_stats(self):
+        """
+        外部接口：返回队列深度与批次大小等统计信息
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(self._stats["batch_size_histogram"])
+        batches = stats["batches"]
+        batched = stats["batched_requests"]
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = batched / batches if batches else 0.0
+        stats["avg_wait_ms"] = stats.pop("total_wait_ms") / batched if batched else 0.0
+        stats["avg_infer_ms"] = stats.pop("total_infer_ms") / batches if batches else 0.0
+        stats["window_ms"] = self.window * 1000.0
+        stats["max_batch"] = self.max_batch
+        return stats
+
+    def _run(self):
+        """调度线程：阻塞等待第一个请求，随后在窗口内继续收集，满批或超时即执行推理"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """执行一次批量推理并把结果分发给各个 Future"""
+        # 跳过已被调用方取消的请求
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        start_time = time.monotonic()
+        wait_ms = sum((start_time - submitted) * 1000.0 for _, _, submitted in batch)
+        try:
+            feats = self.extractor.calculate_tensors([tensor for tensor, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            failed = True
+        else:
+            for (_, future, _), feat in zip(batch, feats):
+                future.set_result(feat)
+            failed = False
+        infer_ms = (time.monotonic() - start_time) * 1000.0
+
+        size = len(batch)
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["batched_requests"] += size
+            self._stats["failed_batches"] += int(failed)
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], size)
+            self._stats["total_wait_ms"] += wait_ms
+            self._stats["total_infer_ms"] += infer_ms
+            histogram = self._stats["batch_size_histogram"]
+            histogram[size] = histogram.get(size, 0) + 1
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_inference_scheduler():
+    """
+    外部接口：获取进程内共享的微批调度器（首次调用时创建并启动调度线程）
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = InferenceScheduler(get_feature_extractor())
+    return _scheduler
+
+
+def get_scheduler_stats():
+    """
+    外部接口：获取调度器统计信息，调度器尚未启动时返回 None（不会触发模型加载）
+    """
+    return _scheduler.get_stats() if _scheduler is not None else None
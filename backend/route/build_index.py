@@ -12,6 +12,13 @@ from index_manage_module.index_builder import IndexBuilder
 progress_dir = "data/progress"
 os.makedirs(progress_dir, exist_ok=True)
 
+def _index_summary(index_info):
+    """构建结果中返回的索引信息：索引结构、类型、向量数、默认查询参数与是否带特征存储"""
+    if not index_info:
+        return None
+    keys = ("factory", "index_type", "metric", "num_vectors", "nlist", "search_params", "feature_store", "update")
+    return {k: index_info.get(k) for k in keys}
+
 @build_index_bp.route('/build_index', methods=['POST'])
 def build_index():
     data = request.get_json()
@@ -105,9 +112,10 @@ def api_build_index():
             results.append({"dataset": dataset_name, "success": False, "msg": f"数据集目录不存在: {dataset_dir}"})
             continue
         try:
-            ok = build_dataset_index(dataset_dir, dataset_name, distributed=distributed)
+            ok, index_info = build_dataset_index(dataset_dir, dataset_name, distributed=distributed, return_info=True)
             if ok:
-                results.append({"dataset": dataset_name, "success": True, "msg": "数据集特征与索引已构建完成，可以进行图片检索。"})
+                results.append({"dataset": dataset_name, "success": True, "msg": "数据集特征与索引已构建完成，可以进行图片检索。",
+                                "index": _index_summary(index_info)})
             else:
                 results.append({"dataset": dataset_name, "success": False, "msg": "构建失败。"})
         except Exception as e:
@@ -137,9 +145,10 @@ def api_build_index_distributed():
             results.append({"dataset": dataset_name, "success": False, "msg": f"数据集目录不存在: {dataset_dir}"})
             continue
         try:
-            ok = build_dataset_index(dataset_dir, dataset_name, distributed=True)
+            ok, index_info = build_dataset_index(dataset_dir, dataset_name, distributed=True, return_info=True)
             if ok:
-                results.append({"dataset": dataset_name, "success": True, "msg": "远程数据集特征与索引已构建完成，可以进行图片检索。"})
+                results.append({"dataset": dataset_name, "success": True, "msg": "远程数据集特征与索引已构建完成，可以进行图片检索。",
+                                "index": _index_summary(index_info)})
             else:
                 results.append({"dataset": dataset_name, "success": False, "msg": "远程构建失败。"})
         except Exception as e:
@@ -110,12 +110,17 @@ def get_duplicate_groups_with_images():
         index_id = data.get('index_id')
         threshold = float(data.get('threshold', 95.0))
         deduplicate = bool(data.get('deduplicate', False))
+        min_group_similarity = data.get('min_group_similarity')
+        incremental = bool(data.get('incremental', False))
         
         if not index_id:
             return jsonify({"error": "缺少 index_id"}), 400
             
         # 执行重复检测
-        groups = repeated_search(index_id, threshold, deduplicate)
+        if min_group_similarity is not None:
+            min_group_similarity = float(min_group_similarity)
+        groups = repeated_search(index_id, threshold, deduplicate, min_group_similarity=min_group_similarity,
+                                 incremental=incremental)
         groups = [[int(i) for i in group] for group in groups]
         
         # 获取所有涉及的图片ID
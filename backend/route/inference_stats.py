@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify
+from model_module.inference_scheduler import get_scheduler_stats
+from model_module.embedding_cache import get_embedding_cache
+from faiss_module.index_cache import get_index_cache
+
+bp = Blueprint('inference_stats', __name__)
+
+@bp.route('/api/inference_stats', methods=['GET'])
+def inference_stats():
+    # 调度器尚未处理过查询时不创建调度器，避免加载模型
+    stats = get_scheduler_stats()
+    if stats is None:
+        stats = {"running": False}
+    else:
+        stats["running"] = True
+    cache = get_embedding_cache()
+    stats["embedding_cache"] = cache.get_stats() if cache is not None else None
+    stats["index_cache"] = get_index_cache().get_stats()
+    return jsonify(stats)
@@ -9,13 +9,23 @@ def repeated_search_api():
     index_id = data.get('index_id')
     threshold = float(data.get('threshold', 95.0))
     deduplicate = bool(data.get('deduplicate', False))
+    # 可选：组内任意两张图片的最低相似度（限制链式传递形成的组直径）
+    min_group_similarity = data.get('min_group_similarity')
+    # 可选：增量模式，只检测上次检测之后新增的图片
+    incremental = bool(data.get('incremental', False))
     if not index_id:
         return jsonify({"error": "缺少 index_id"}), 400
     try:
-        groups = repeated_search(index_id, threshold, deduplicate)
+        if min_group_similarity is not None:
+            min_group_similarity = float(min_group_similarity)
+        groups, stats = repeated_search(index_id, threshold, deduplicate,
+                                        min_group_similarity=min_group_similarity, return_stats=True,
+                                        incremental=incremental)
         # 转为普通int，避免 int64 不能序列化
         groups = [[int(i) for i in group] for group in groups]
-        return jsonify({"groups": groups})
+        return jsonify({"groups": groups, "stats": stats})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error in repeated_search: {e}")
         return jsonify({"error": str(e)}), 500
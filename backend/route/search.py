@@ -1,19 +1,35 @@
 from flask import Blueprint, request, jsonify
-from search_module.search import search_image
+from search_module.search import search_image, search_images_batch
+from config import config
 
 search_bp = Blueprint('search', __name__)
 
-@search_bp.route('/api/search', methods=['POST'])
-def api_search():
-    # 查询个数
-    top_k = int(request.form.get('top_k', 10))
-    
-    # 支持多个数据集名称（dataset_names[]），优先取多个，否则取单个
+def _get_rerank_k():
+    """可选：精确重排序的候选数 k'（多取候选后按全精度特征重排），缺省使用 config.SEARCH_RERANK_K"""
+    return request.form.get('rerank_k', type=int)
+
+def _get_dataset_names():
+    """支持多个数据集名称（dataset_names[]），优先取多个，否则取单个"""
     dataset_names = request.form.getlist('dataset_names[]')
     if not dataset_names:
         dataset_name = request.form.get('dataset_name')
         if dataset_name:
             dataset_names = [dataset_name]
+    return dataset_names
+
+@search_bp.route('/api/search', methods=['POST'])
+def api_search():
+    # 查询个数
+    top_k = int(request.form.get('top_k', 10))
+    # 可选：本次查询的 IVF 探查聚类数（越大召回越高、越慢），缺省使用索引默认值
+    nprobe = request.form.get('nprobe', type=int)
+    if nprobe is not None and nprobe < 1:
+        return jsonify({"msg": "nprobe 必须大于等于 1"}), 400
+    rerank_k = _get_rerank_k()
+    if rerank_k is not None and rerank_k < 0:
+        return jsonify({"msg": "rerank_k 不能为负数"}), 400
+    
+    dataset_names = _get_dataset_names()
     file = request.files.get('query_img')
     try:
         x = int(request.form.get('crop_x', 0))
@@ -31,8 +47,37 @@ def api_search():
         return jsonify({"msg": "未上传图片"}), 400
 
     # 传递所有数据集名称
-    result = search_image(dataset_names, file, (x, y, w, h), top_k)
+    result = search_image(dataset_names, file, (x, y, w, h), top_k, nprobe=nprobe, rerank_k=rerank_k)
     if isinstance(result, dict) and "error" in result:
         print(f"检索失败: {result['error']}")
         return jsonify({"msg": result["error"]}), 400
     return jsonify({"results": result})
+
+@search_bp.route('/api/search_batch', methods=['POST'])
+def api_search_batch():
+    """批量检索：一次上传多张图片（query_imgs[]），特征批量推理，每个索引只检索一次"""
+    top_k = int(request.form.get('top_k', 10))
+    nprobe = request.form.get('nprobe', type=int)
+    if nprobe is not None and nprobe < 1:
+        return jsonify({"msg": "nprobe 必须大于等于 1"}), 400
+    rerank_k = _get_rerank_k()
+    if rerank_k is not None and rerank_k < 0:
+        return jsonify({"msg": "rerank_k 不能为负数"}), 400
+
+    dataset_names = _get_dataset_names()
+    files = [f for f in request.files.getlist('query_imgs[]') if f and f.filename]
+    if not dataset_names or not any(dataset_names):
+        print("缺少数据集名称")
+        return jsonify({"msg": "缺少数据集名称"}), 400
+    if not files:
+        print("未上传图片")
+        return jsonify({"msg": "未上传图片"}), 400
+    max_images = getattr(config, "SEARCH_BATCH_MAX_IMAGES", 64)
+    if len(files) > max_images:
+        return jsonify({"msg": f"单次最多上传 {max_images} 张图片"}), 400
+
+    result = search_images_batch(dataset_names, files, top_k, nprobe=nprobe, rerank_k=rerank_k)
+    if isinstance(result, dict) and "error" in result:
+        print(f"批量检索失败: {result['error']}")
+        return jsonify({"msg": result["error"]}), 400
+    return jsonify({"results": result})
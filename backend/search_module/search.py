@@ -2,10 +2,12 @@ import numpy as np
 import os
 from PIL import Image
 from werkzeug.utils import secure_filename
-from model_module.feature_extractor import feature_extractor
+from model_module.feature_extractor import get_feature_extractor
+from model_module.inference_scheduler import get_inference_scheduler
+from model_module.embedding_cache import get_embedding_cache
 from database_module.query import query_one, query_multi
 from config import config
-from faiss_module.search_index import search_index
+from faiss_module.search_index import search_index_batch
 import json
 
 def get_features_and_ids(dataset_id):
@@ -43,73 +45,58 @@ def get_features_and_ids(dataset_id):
     ids = np.array(ids, dtype='int64')
     return features, ids, image_paths, descriptions
 
-def search_image(dataset_names, file_storage, crop_box, top_k=10):
+def _resolve_dataset_ids(dataset_names):
     """
-    工厂接口：处理图片检索
-    :param dataset_names: 数据集名称列表
-    :param file_storage: werkzeug.datastructures.FileStorage 上传的图片对象
-    :param crop_box: (x, y, w, h) 裁剪参数
-    :return: 检索结果列表
+    数据集名称 -> 数据集ID 列表
+    :return: (dataset_ids, error)，数据集不存在或都没有图片时 error 为错误信息
     """
-    # 查询所有数据集ID
     dataset_ids = []
     for name in dataset_names:
         dataset = query_one("datasets", where={"name": name})
         if not dataset:
-            return {"error": f"数据集不存在: {name}"}
+            return None, f"数据集不存在: {name}"
         dataset_ids.append(dataset[0])
+    if not any(query_one("images", columns="id", where={"dataset_id": dataset_id}) for dataset_id in dataset_ids):
+        return None, "所选数据集没有图片特征"
+    return dataset_ids, None
 
-    # 合并所有数据集的特征和ID
-    all_features, all_ids, all_image_paths, all_descriptions = [], [], [], []
-    for dataset_id in dataset_ids:
-        features, ids, image_paths, descriptions = get_features_and_ids(dataset_id)
-        if features is not None and ids is not None and len(features) > 0:
-            all_features.append(features)
-            all_ids.append(ids)
-            all_image_paths.extend(image_paths)
-            all_descriptions.extend(descriptions)
-    if not all_features or not all_ids:
-        return {"error": "所选数据集没有图片特征"}
-    features = np.concatenate(all_features, axis=0)
-    ids = np.concatenate(all_ids, axis=0)
-    image_paths = all_image_paths
-    descriptions = all_descriptions
-
-    # 保存上传图片
-    filename = secure_filename(file_storage.filename)
-    save_path = os.path.join(config.UPLOAD_FOLDER, filename)
-    file_storage.save(save_path)
 
-    # 裁剪图片
-    x, y, w, h = crop_box
-    img = Image.open(save_path)
-    if w > 0 and h > 0:
-        img = img.crop((x, y, x + w, y + h))
-    embedder = feature_extractor()
-    query_feat = embedder.calculate(img).reshape(1, -1)
+def _load_image_info(dataset_ids, image_ids):
+    """
+    只读取检索命中图片的路径与描述（不加载全部特征）
+    :return: dict{image_id: (image_path, description)}
+    """
+    image_ids = sorted(set(int(i) for i in image_ids if i != -1))
+    info = {}
+    # SQLite 单条语句变量数有限，分块查询
+    for i in range(0, len(image_ids), 500):
+        rows = query_multi(
+            "images",
+            columns="id, dataset_id, image_path, metadata_json",
+            where={"id": ("IN", image_ids[i:i + 500])}
+        ) or []
+        for img_id, dataset_id, img_path, metadata_json in rows:
+            if dataset_id not in dataset_ids:
+                continue
+            try:
+                desc = json.loads(metadata_json) if metadata_json else {}
+            except Exception:
+                desc = {}
+            info[img_id] = (img_path, desc)
+    return info
 
-    # 使用 faiss_module.search_index 查找 top
-    # 索引文件名约定为 {数据集编号}.index
-    index_names = [f"{dataset_id}.index" for dataset_id in dataset_ids]
-    indices, similarities = search_index(query_feat, index_names, top_k)
 
+def _build_results(indices, similarities, image_info):
+    """把一个查询的 (ID 列表, 相似度列表) 组装为接口返回的结果列表"""
     results = []
     for idx, sim in zip(indices, similarities):
-        # idx 可能为 -1（faiss未命中），需判断
-        if idx == -1 or idx not in ids:
+        # idx 可能为 -1（faiss未命中）或图片已被删除
+        if idx == -1 or idx not in image_info:
             continue
-        # 找到对应图片路径
-        id_pos = np.where(ids == idx)[0]
-        if len(id_pos) == 0:
-            continue
-        img_path = image_paths[id_pos[0]]
-        desc = descriptions[id_pos[0]] if descriptions else {}
-        # print(f"检索到图片: {img_path}, 相似度: {sim:.4f}")
+        img_path, desc = image_info[idx]
         # 兼容图片路径为绝对路径或相对路径，取文件名
         fname = os.path.basename(img_path)
-        # 若图片实际存储在 data/数据集名/ 下，前端 show_image 需要传递数据集名
-        # 这里返回数据集名和文件名，前端拼接 show_image/数据集名/文件名
-        # 先尝试从 img_path 提取数据集名
+        # 图片实际存储在 data/数据集名/ 下，返回数据集名和文件名，前端拼接 show_image/数据集名/文件名
         dataset_dir = os.path.basename(os.path.dirname(img_path))
         img_url = f'/show_image/{dataset_dir}/{fname}'
         results.append({
@@ -121,3 +108,111 @@ def search_image(dataset_names, file_storage, crop_box, top_k=10):
             "description": desc
         })
     return results
+
+
+def _save_upload(file_storage, prefix=""):
+    """保存上传图片，返回保存路径（批量上传时加序号前缀，避免同名文件互相覆盖）"""
+    filename = prefix + secure_filename(file_storage.filename)
+    save_path = os.path.join(config.UPLOAD_FOLDER, filename)
+    file_storage.save(save_path)
+    return save_path
+
+
+def _load_query_image(save_path, crop_box):
+    """打开上传图片并按 (x, y, w, h) 裁剪"""
+    x, y, w, h = crop_box
+    img = Image.open(save_path)
+    if w > 0 and h > 0:
+        img = img.crop((x, y, x + w, y + h))
+    return img
+
+
+def _query_features(save_paths, crop_boxes):
+    """
+    计算一组查询图片的特征：先批量查特征缓存（按图片内容+裁剪框），未命中的图片批量推理后写回缓存
+    :return: shape=(n, dim) 的 float32 特征矩阵，行顺序与 save_paths 一致
+    """
+    cache = get_embedding_cache()
+    keys = [None] * len(save_paths)
+    cached = {}
+    if cache is not None:
+        for i, (save_path, (x, y, w, h)) in enumerate(zip(save_paths, crop_boxes)):
+            with open(save_path, 'rb') as f:
+                crop = [x, y, w, h] if w > 0 and h > 0 else None
+                keys[i] = cache.make_key(f.read(), extra=crop)
+        cached = cache.get_many(keys)
+
+    features = [cached.get(key) if key is not None else None for key in keys]
+    missing = [i for i, feat in enumerate(features) if feat is None]
+    if missing:
+        images = (_load_query_image(save_paths[i], crop_boxes[i]) for i in missing)
+        if getattr(config, "microbatch_enabled", False):
+            # 提交到微批调度器，与其他并发查询一起合并为批次推理
+            scheduler = get_inference_scheduler()
+            futures = [(i, scheduler.submit(img)) for i, img in zip(missing, images)]
+            for i, future in futures:
+                features[i] = future.result()
+        else:
+            embedder = get_feature_extractor()
+            for batch_ids, batch_feats in embedder.iter_batches(images, ids=missing):
+                for i, feat in zip(batch_ids, batch_feats):
+                    features[i] = feat
+        if cache is not None:
+            cache.put_many([(keys[i], features[i]) for i in missing])
+    return np.stack(features).astype('float32')
+
+
+def search_image(dataset_names, file_storage, crop_box, top_k=10, nprobe=None, rerank_k=None):
+    """
+    工厂接口：处理图片检索
+    :param dataset_names: 数据集名称列表
+    :param file_storage: werkzeug.datastructures.FileStorage 上传的图片对象
+    :param crop_box: (x, y, w, h) 裁剪参数
+    :param nprobe: 本次查询的 IVF 探查聚类数，None 时使用索引默认值
+    :param rerank_k: 精确重排序的候选数，None 时使用 config.SEARCH_RERANK_K，0 表示不重排序
+    :return: 检索结果列表
+    """
+    results = search_images_batch(dataset_names, [file_storage], top_k, nprobe=nprobe, crop_boxes=[crop_box],
+                                  rerank_k=rerank_k)
+    if isinstance(results, dict):
+        return results
+    return results[0]["results"]
+
+
+def search_images_batch(dataset_names, file_storages, top_k=10, nprobe=None, crop_boxes=None, rerank_k=None):
+    """
+    工厂接口：批量图片检索，特征批量推理，每个索引只调用一次 FAISS search
+    :param dataset_names: 数据集名称列表
+    :param file_storages: 上传的图片对象列表
+    :param top_k: 每张图片返回的结果数
+    :param nprobe: 本次查询的 IVF 探查聚类数，None 时使用索引默认值
+    :param crop_boxes: 与 file_storages 一一对应的 (x, y, w, h) 裁剪参数，默认不裁剪
+    :param rerank_k: 精确重排序的候选数，None 时使用 config.SEARCH_RERANK_K，0 表示不重排序
+    :return: [{"query": 文件名, "results": 检索结果列表}]，与上传顺序一致；出错时返回 {"error": ...}
+    """
+    dataset_ids, error = _resolve_dataset_ids(dataset_names)
+    if error:
+        return {"error": error}
+    if crop_boxes is None:
+        crop_boxes = [(0, 0, 0, 0)] * len(file_storages)
+
+    if len(file_storages) == 1:
+        save_paths = [_save_upload(file_storages[0])]
+    else:
+        save_paths = [_save_upload(f, prefix=f"batch{i}_") for i, f in enumerate(file_storages)]
+    query_feats = _query_features(save_paths, crop_boxes)
+
+    # 使用 faiss_module.search_index_batch 查找 top
+    # 索引文件名约定为 {数据集编号}.index
+    index_names = [f"{dataset_id}.index" for dataset_id in dataset_ids]
+    try:
+        batch_results = search_index_batch(query_feats, index_names, top_k, nprobe=nprobe, rerank_k=rerank_k)
+    except ValueError as e:
+        # 如所选数据集的索引度量不一致
+        return {"error": str(e)}
+
+    image_info = _load_image_info(dataset_ids, [idx for indices, _ in batch_results for idx in indices])
+    return [
+        {"query": file_storage.filename, "results": _build_results(indices, similarities, image_info)}
+        for file_storage, (indices, similarities) in zip(file_storages, batch_results)
+    ]
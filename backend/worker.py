@@ -2,7 +2,9 @@ import base64
 from io import BytesIO
 from PIL import Image
 from celery import Celery
-from model_module.feature_extractor import feature_extractor
+from celery.signals import worker_init
+from model_module.feature_extractor import get_feature_extractor
+from model_module.embedding_cache import get_embedding_cache
 import redis
 import logging
 import sys
@@ -52,6 +54,12 @@ celery_app.conf.update(
     worker_task_log_format='[%(asctime)s: %(levelname)s/%(processName)s][%(task_name)s(%(task_id)s)] %(message)s',
 )
 
+@worker_init.connect
+def init_worker_cpu_budget(**kwargs):
+    """Worker 启动时应用 worker 角色的 CPU 预算"""
+    from model_module.cpu_budget import apply_process_budget
+    apply_process_budget("worker")
+
 def check_redis_connection():
     """检查Redis连接是否可用"""
     try:
@@ -87,11 +95,22 @@ def generate_embeddings_task(self, img_data_b64):
         
         # 解码图像数据
         img_bytes = base64.b64decode(img_data_b64)
+
+        # 相同内容的图片直接返回缓存特征
+        cache = get_embedding_cache()
+        cache_key = cache.make_key(img_bytes) if cache is not None else None
+        feat = cache.get(cache_key) if cache is not None else None
+        if feat is not None:
+            logger.info(f"特征缓存命中: {self.request.id}")
+            return feat.tolist()
+
         img = Image.open(BytesIO(img_bytes))
         
-        # 创建特征提取器并计算特征
-        embedder = feature_extractor()
+        # 获取进程内共享的特征提取器并计算特征
+        embedder = get_feature_extractor()
         feat = embedder.calculate(img)
+        if cache is not None:
+            cache.put(cache_key, feat)
         
         logger.info(f"特征提取任务完成: {self.request.id}")
         return feat.tolist()
@@ -5,6 +5,21 @@ pretrain = True  # 是否加载预训练模型
 model_type = "resnet50"  # torchvision.models 里的模型名
 input_size = 224  # 输入图像的大小
 batchsize = 128
+extract_mode = "batch"  # 本地特征提取模式："batch"（后台线程解码）或 "pipeline"（DataLoader 多进程并行解码+预取）
+decode_workers = 4  # pipeline 模式下并行解码/预处理的工作进程数
+prefetch_factor = 2  # pipeline 模式下每个工作进程预取的批次数
+# 是否按输入尺寸降分辨率解码（JPEG draft 模式 / Image.reduce），减少大图解码耗时。
+# 降分辨率解码会使特征略有变化：先用 scripts/decode_benchmark.py 评估偏差，开启后需全量重建已有数据集的特征与索引，
+# 否则同一索引中会混用两种预处理得到的特征
+fast_decode = False
+inference_precision = "fp32"  # 推理精度："fp32"、"int8"（CPU 训练后量化）、"bf16"（CPU bf16 autocast，不支持时回退 fp32）
+channels_last = False  # 是否以 channels_last (NHWC) 内存布局运行卷积，CPU 上通常更快
+quantize_calibration_dir = None  # int8 静态量化的校准图片目录，None 表示使用 DATASET_DIR
+quantize_calibration_images = 64  # int8 静态量化使用的最大校准图片数
+use_torchscript = True  # 是否导出/加载 trace+freeze 后的 TorchScript 模型（fp32/int8），加快冷启动
+microbatch_enabled = True  # 检索查询是否经过动态微批调度器合并推理
+microbatch_window_ms = 10  # 微批攒批等待窗口（毫秒），建议 5~20
+microbatch_max_size = 32  # 微批单批次最大图片数
 normalize_mean = [0.485, 0.456, 0.406]  # 图像预处理的均值
 normalize_std = [0.229, 0.224, 0.225]   # 图像预处理的标准差
 
@@ -23,13 +38,89 @@ INDEX_FOLDER = os.path.join(BASE_DIR, "data", "indexes")
 VECTOR_DIM = 2048
 # IVF 索引中的聚类数量（影响召回速度与精度）
 N_LIST = 5
+# 索引结构："auto" 按数据量与内存预算自动选择，也可直接指定 factory 字符串（如 "IVF4096,PQ64"，不含 IDMap）
+INDEX_TYPE = "auto"
+# 数据量不超过该值时使用 Flat 精确检索（2048 维 float32 每万条约 80MB）
+INDEX_FLAT_MAX_VECTORS = 10000
+# 单个索引的内存预算（MB）：SQ8 编码超出预算时改用 PQ 压缩
+INDEX_MEMORY_BUDGET_MB = 4096
+# 数据量达到该值视为大规模索引，使用 INDEX_LARGE_TYPE
+INDEX_LARGE_MIN_VECTORS = 1000000
+# 大规模索引类型："ivfpq"（OPQ+IVF+PQ，内存最省）或 "hnsw"（HNSW+SQ8，延迟最低，不支持删除向量）
+INDEX_LARGE_TYPE = "ivfpq"
+INDEX_HNSW_M = 32
+INDEX_HNSW_EF_SEARCH = 64
+# 索引前的降维阶段：None 不降维，"pca" 或 "opq"（带降维的 OPQ 旋转），随索引训练，查询时自动应用
+INDEX_REDUCE = None
+# 降维后的维度
+INDEX_REDUCED_DIM = 256
+# IVF 索引查询时探查的聚类数，None 表示按 nlist 的 10% 自动设置；构建时写入索引元数据文件
+INDEX_NPROBE = None
+# 索引自动调优（scripts/index_autotune.py）：目标 recall@k、评估的 k、抽样查询数、候选向量编码
+AUTOTUNE_TARGET_RECALL = 0.95
+AUTOTUNE_K = 10
+AUTOTUNE_QUERIES = 200
+AUTOTUNE_ENCODINGS = ["SQ8", "SQ4", "Flat"]
+# 索引度量："l2"（原始特征的欧氏距离，相似度按 SIMILARITY_SIGMA 换算）或
+# "cosine"（提取特征时 L2 归一化，索引使用内积，余弦值直接换算为百分比，无需调 SIMILARITY_SIGMA）。
+# 度量记录在索引元数据中，修改后已有索引在下次构建时全量重建；度量不同的数据集不能联合检索
+INDEX_METRIC = "l2"
+# 是否在每个索引版本旁保存全精度特征存储（{版本文件}.vectors.npy），供检索时精确重排序。
+# 会额外占用一份 float32 特征的磁盘空间，只在启用重排序（SEARCH_RERANK_K 或请求中的 rerank_k）时开启
+INDEX_STORE_VECTORS = False
+# 增量更新时新版本硬链接旧特征存储、只写增量段；增量段与失效行超过基础段的该比例时整体压缩重写
+INDEX_STORE_COMPACT_RATIO = 0.25
+# 默认重排序候选数 k'：从压缩索引多取 k' 个候选，按全精度特征的精确 L2 距离重排后返回 top_k；0 表示不重排序
+SEARCH_RERANK_K = 0
+# 重复图片检测：每次批量 range_search 的查询数；索引不支持 range_search 时改用 kNN 回退的 k
+DEDUP_BATCH_SIZE = 1024
+DEDUP_KNN_K = 64
+# 直径约束拆分时单个连通分量的最大图片数：拆分需要 n×n 相似度矩阵，超过该值的分量不拆分、原样作为一组返回
+DEDUP_SPLIT_MAX_SIZE = 5000
+# 是否以只读内存映射方式加载索引（多个 Flask/Celery 进程共享同一索引文件的页缓存）
+INDEX_MMAP = True
+# 每个索引保留的历史版本数（版本化文件 + 清单原子切换，旧版本供仍在使用的进程继续读取）
+INDEX_KEEP_VERSIONS = 2
+# 发现索引新版本时在后台加载并热切换，加载期间继续用旧版本服务查询
+INDEX_HOT_SWAP = True
+# 进程内已加载索引的缓存上限（MB，按索引文件大小估算），超出按 LRU 淘汰
+INDEX_CACHE_MAX_MB = 1024
+# 分块构建索引时训练样本数上限（蓄水池采样）
+INDEX_TRAIN_SAMPLE_SIZE = 50000
+# 已有索引时增量更新（新增向量 add_with_ids、已删除图片 remove_ids），不重新训练
+INDEX_INCREMENTAL = True
+# 增量更新后向量数与训练时之比超过该倍数（或低于其倒数）时改为重新训练
+INDEX_RETRAIN_GROWTH = 2.0
+# 增量更新后 IVF 聚类不均衡度超过训练时的该倍数时改为重新训练
+INDEX_RETRAIN_IMBALANCE = 1.5
+# 构建索引时特征写入数据库 / 从数据库读取的分块大小
+BUILD_CHUNK_SIZE = 1024
+
+# 各进程角色的 CPU 预算（app: Flask 检索, build: 本地索引构建线程, worker: Celery 进程）
+# intra_op_threads: torch 算子内线程数; inter_op_threads: 算子间线程数（每进程只生效一次）
+# cpu_cores: 绑定的 CPU 核编号列表（仅 Linux），None 表示不绑定
+_CPU_COUNT = os.cpu_count() or 1
+CPU_BUDGETS = {
+    "app": {"intra_op_threads": max(1, _CPU_COUNT // 2), "inter_op_threads": 1, "cpu_cores": None},
+    "build": {"intra_op_threads": max(1, _CPU_COUNT - _CPU_COUNT // 2), "inter_op_threads": 1, "cpu_cores": None},
+    "worker": {"intra_op_threads": max(1, _CPU_COUNT // 2), "inter_op_threads": 1, "cpu_cores": None},
+}
 
 #用于增加新图片的特征文件路径
 NEW_FEATURE_PATH = os.path.join(BASE_DIR, "data", "new_features.npy")
 NEW_ID_PATH = os.path.join(BASE_DIR, "data", "new_ids.npy")
 
+# TorchScript 模型产物目录
+MODEL_CACHE_DIR = os.path.join(BASE_DIR, "data", "models")
+
+# 特征缓存（按图片内容哈希复用已计算的特征向量）
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, "data", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = 100000  # 最大缓存条目数（2048 维约 8KB/条），超出按 LRU 淘汰
+
 # 上传图片的位置
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'data', 'uploads')
+SEARCH_BATCH_MAX_IMAGES = 64  # 批量检索接口单次请求最多上传的图片数
 
 # 数据集目录
 DATASET_DIR = os.path.join(BASE_DIR, 'datasets')
@@ -48,7 +139,7 @@ REDIS_BACKEND_DB = 1
 CELERY_TASK_TIME_LIMIT = 300  # 5分钟超时
 CELERY_TASK_SOFT_TIME_LIMIT = 240  # 4分钟软超时
 CELERY_MAX_RETRIES = 3  # 最大重试次数
-# 相似度转换SIGMA超参数，越大缓冲性越强
+# 相似度转换SIGMA超参数，越大缓冲性越强（仅 L2 度量的索引使用）
 SIMILARITY_SIGMA=10.0
 
 # -----------数据库相关-----------
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 配置参数优化器
-用于自动寻找最佳的配置参数组合，以获得最佳性能
+用于自动寻找最佳的特征提取配置参数组合，以获得最佳性能
+索引参数（nlist / nprobe / 向量编码）的调优见 scripts/index_autotune.py
 """
 
 import sys
@@ -107,7 +108,6 @@ class ConfigOptimizer:
         param_grid = {
             'device': ['cpu'],  # 如果有GPU可以添加 'cuda'
             'batchsize': [1, 4, 8, 16, 32, 64],
-            'N_LIST': [1, 5, 10, 20],
         }
         
         # 如果支持GPU，添加GPU选项
@@ -217,25 +217,6 @@ class ConfigOptimizer:
                     print(f"    ❌ 无改进")
                     break
         
-        # 优化簇大小
-        print("\n优化簇大小...")
-        n_list = current_config['N_LIST']
-        
-        for new_n_list in [n_list * 2, n_list // 2, n_list + 5, max(1, n_list - 5)]:
-            if new_n_list <= 0 or new_n_list > 100:
-                continue
-                
-            test_config = current_config.copy()
-            test_config['N_LIST'] = new_n_list
-            
-            print(f"  测试簇大小: {new_n_list}")
-            result = self.evaluate_config(test_config)
-            
-            if result['success'] and result['throughput'] > current_throughput:
-                current_config = test_config
-                current_throughput = result['throughput']
-                print(f"    ✅ 改进! 新吞吐量: {current_throughput:.2f}")
-        
         self.optimization_results['adaptive'] = {
             'final_config': current_config,
             'final_throughput': current_throughput
@@ -331,11 +312,11 @@ class ConfigOptimizer:
                 top_configs = sorted(successful_results, key=lambda x: x['throughput'], reverse=True)[:10]
                 
                 f.write("### Top 10 配置\n\n")
-                f.write("| 排名 | 设备 | 批处理大小 | 簇大小 | 吞吐量(图像/s) |\n")
-                f.write("|------|------|------------|--------|-----------------|\n")
+                f.write("| 排名 | 设备 | 批处理大小 | 吞吐量(图像/s) |\n")
+                f.write("|------|------|------------|-----------------|\n")
                 for i, result in enumerate(top_configs, 1):
                     config_info = result['config']
-                    f.write(f"| {i} | {config_info['device']} | {config_info['batchsize']} | {config_info['N_LIST']} | {result['throughput']:.2f} |\n")
+                    f.write(f"| {i} | {config_info['device']} | {config_info['batchsize']} | {result['throughput']:.2f} |\n")
                 f.write("\n")
             
             # 自适应优化结果
@@ -443,6 +424,7 @@ def main():
             print(f"\n💡 建议将以下配置写入config.py:")
             for key, value in optimized_config.items():
                 print(f"{key} = {repr(value)}")
+            print("💡 索引参数请使用 scripts/index_autotune.py --dataset <数据集> 按目标召回率调优")
     
     elif args.mode == 'grid':
         optimizer.generate_test_images()
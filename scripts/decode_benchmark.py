@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+降分辨率解码基准测试
+对比完整解码（Image.open 后直接 Resize）与降分辨率解码（JPEG draft 模式 / Image.reduce）
+在生成的大尺寸图片数据集上的解码+预处理耗时，以及两种方式得到的特征向量偏差
+"""
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import statistics
+import numpy as np
+from PIL import Image, ImageDraw
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+from backend.model_module.feature_extractor import feature_extractor
+
+
+def generate_dataset(out_dir, count=20, size=(4000, 3000)):
+    """生成带渐变和随机图形的大尺寸 JPEG 图片，模拟相机拍摄的数据集照片"""
+    print(f"生成 {count} 张 {size[0]}x{size[1]} 测试图像...")
+    rng = np.random.default_rng(0)
+    paths = []
+    w, h = size
+    for i in range(count):
+        # 水平/垂直渐变底色 + 随机噪声，避免纯色图被 JPEG 过度压缩
+        xs = np.linspace(0, 255, w, dtype=np.float32)
+        ys = np.linspace(0, 255, h, dtype=np.float32)
+        base = np.empty((h, w, 3), dtype=np.float32)
+        base[..., 0] = xs[None, :]
+        base[..., 1] = ys[:, None]
+        base[..., 2] = (i * 37) % 256
+        base += rng.normal(0, 12, size=(h, w, 3))
+        img = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), 'RGB')
+        draw = ImageDraw.Draw(img)
+        for _ in range(8):
+            x1, y1 = int(rng.integers(0, w - 400)), int(rng.integers(0, h - 400))
+            x2, y2 = x1 + int(rng.integers(100, 400)), y1 + int(rng.integers(100, 400))
+            color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+            if i % 2 == 0:
+                draw.ellipse([x1, y1, x2, y2], fill=color)
+            else:
+                draw.rectangle([x1, y1, x2, y2], fill=color)
+        path = os.path.join(out_dir, f"bench_{i + 1}.jpg")
+        img.save(path, quality=90)
+        paths.append(path)
+    print(f"✅ 已生成 {len(paths)} 张测试图像")
+    return paths
+
+
+def time_preprocess(extractor, paths, fast_decode, repeat=3):
+    """测量解码+预处理耗时，返回每张图片的平均秒数"""
+    extractor.fast_decode = fast_decode
+    times = []
+    for _ in range(repeat):
+        start_time = time.time()
+        for path in paths:
+            with Image.open(path) as img:
+                extractor.preprocess(img)
+        times.append((time.time() - start_time) / len(paths))
+    return statistics.mean(times)
+
+
+def extract_features(extractor, paths, fast_decode):
+    """按指定解码方式提取全部图片特征"""
+    extractor.fast_decode = fast_decode
+    tensors = []
+    for path in paths:
+        with Image.open(path) as img:
+            tensors.append(extractor.preprocess(img))
+    feats = []
+    for i in range(0, len(tensors), extractor.batchsize):
+        feats.append(extractor.calculate_tensors(tensors[i:i + extractor.batchsize]))
+    return np.concatenate(feats, axis=0)
+
+
+def embedding_drift(full_feats, fast_feats):
+    """计算两组特征的余弦相似度和相对 L2 偏差"""
+    full_norm = np.linalg.norm(full_feats, axis=1)
+    fast_norm = np.linalg.norm(fast_feats, axis=1)
+    cosine = np.sum(full_feats * fast_feats, axis=1) / np.maximum(full_norm * fast_norm, 1e-12)
+    rel_l2 = np.linalg.norm(full_feats - fast_feats, axis=1) / np.maximum(full_norm, 1e-12)
+    return cosine, rel_l2
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='降分辨率解码基准测试')
+    parser.add_argument('--images', type=int, default=20,
+                        help='测试图像数量 (默认: 20)')
+    parser.add_argument('--width', type=int, default=4000,
+                        help='测试图像宽度 (默认: 4000)')
+    parser.add_argument('--height', type=int, default=3000,
+                        help='测试图像高度 (默认: 3000)')
+    parser.add_argument('--keep', action='store_true',
+                        help='保留生成的测试图像目录')
+    args = parser.parse_args()
+
+    print("🔧 当前配置信息:")
+    print(f"  设备: {config.device}")
+    print(f"  模型: {config.model_type}")
+    print(f"  输入尺寸: {config.input_size}")
+    print()
+
+    out_dir = tempfile.mkdtemp(prefix="decode_bench_")
+    try:
+        paths = generate_dataset(out_dir, args.images, (args.width, args.height))
+        extractor = feature_extractor()
+
+        print("\n⚡ 测试解码+预处理耗时...")
+        full_time = time_preprocess(extractor, paths, fast_decode=False)
+        fast_time = time_preprocess(extractor, paths, fast_decode=True)
+        print(f"  完整解码:     {full_time * 1000:.1f} ms/图像")
+        print(f"  降分辨率解码: {fast_time * 1000:.1f} ms/图像")
+        print(f"  加速比:       {full_time / fast_time:.2f}x" if fast_time > 0 else "  加速比: N/A")
+
+        print("\n📐 测试特征偏差...")
+        full_feats = extract_features(extractor, paths, fast_decode=False)
+        fast_feats = extract_features(extractor, paths, fast_decode=True)
+        cosine, rel_l2 = embedding_drift(full_feats, fast_feats)
+        print(f"  余弦相似度: 平均 {cosine.mean():.5f}, 最小 {cosine.min():.5f}")
+        print(f"  相对 L2 偏差: 平均 {rel_l2.mean():.4f}, 最大 {rel_l2.max():.4f}")
+    finally:
+        if args.keep:
+            print(f"\n测试图像保留在: {out_dir}")
+        else:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+索引参数自动调优工具
+对指定数据集的索引，以 Flat 暴力检索结果为真实近邻，遍历 nlist / nprobe / 向量编码，
+选出满足目标 recall@k 的最快配置并写入索引元数据：
+- 当前索引结构与调优结果一致时，新的 nprobe 立即对检索生效
+- 否则在下一次构建索引时使用调优结果（可加 --rebuild 立即按调优结果重建）
+"""
+
+import sys
+import os
+from tabulate import tabulate
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+from backend.database_module.query import query_one
+
+
+def resolve_dataset_id(dataset):
+    """数据集名称或 ID 转换为 ID"""
+    if str(dataset).isdigit():
+        row = query_one("datasets", where={"id": int(dataset)})
+    else:
+        row = query_one("datasets", where={"name": dataset})
+    if row is None:
+        raise ValueError(f"数据集 {dataset} 不存在")
+    return row[0]
+
+
+def rebuild_index(dataset_id):
+    """按数据库中的特征重建索引，FaissIndexer 会读取元数据中的调优结果"""
+    import numpy as np
+    from backend.faiss_module.build_index import build_index
+    from backend.index_manage_module.api import get_dataset_image_features
+    id_vector_pairs = get_dataset_image_features(dataset_id)
+    ids = np.array([i for i, _ in id_vector_pairs], dtype='int64')
+    features = np.stack([vec for _, vec in id_vector_pairs]).astype('float32')
+    build_index(features, ids, name=f"{dataset_id}.index")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='索引参数自动调优工具')
+    parser.add_argument('--dataset', required=True,
+                        help='数据集名称或 ID')
+    parser.add_argument('--target-recall', type=float, default=getattr(config, "AUTOTUNE_TARGET_RECALL", 0.95),
+                        help='目标 recall@k (默认: config.AUTOTUNE_TARGET_RECALL)')
+    parser.add_argument('--k', type=int, default=getattr(config, "AUTOTUNE_K", 10),
+                        help='recall@k 的 k (默认: config.AUTOTUNE_K)')
+    parser.add_argument('--queries', type=int, default=getattr(config, "AUTOTUNE_QUERIES", 200),
+                        help='抽样查询数 (默认: config.AUTOTUNE_QUERIES)')
+    parser.add_argument('--encodings', default=",".join(getattr(config, "AUTOTUNE_ENCODINGS", ["SQ8", "SQ4", "Flat"])),
+                        help='候选向量编码，逗号分隔 (默认: config.AUTOTUNE_ENCODINGS)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只输出调优结果，不写入索引元数据')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='写入元数据后立即按调优结果重建索引')
+    args = parser.parse_args()
+
+    from backend.faiss_module.autotune import tune_dataset_index
+
+    dataset_id = resolve_dataset_id(args.dataset)
+    print(f"🚀 调优数据集 {args.dataset}（ID: {dataset_id}），目标 recall@{args.k} >= {args.target_recall}")
+    result = tune_dataset_index(
+        dataset_id,
+        apply=not args.dry_run,
+        target_recall=args.target_recall,
+        k=args.k,
+        num_queries=args.queries,
+        encodings=[e.strip() for e in args.encodings.split(",") if e.strip()],
+    )
+
+    best = result["best"]
+    trials = sorted(result["trials"], key=lambda t: t["latency_ms"])
+    headers = ['索引结构', 'nlist', 'nprobe', f"recall@{best['k']}", '延迟(ms/查询)', '达标']
+    table_data = [[t["factory"], t["nlist"] or "-", t["nprobe"] or "-", f"{t['recall']:.4f}",
+                   f"{t['latency_ms']:.3f}", "✅" if t["recall"] >= best["target_recall"] else ""] for t in trials]
+    print("\n📊 调优结果（按延迟排序）")
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+    if best["met_target"]:
+        print(f"\n🏆 最快达标配置: {best['factory']} nprobe={best['nprobe']} "
+              f"recall={best['recall']:.4f} 延迟={best['latency_ms']:.3f} ms")
+    else:
+        print(f"\n⚠️  没有配置达到目标召回率，召回率最高的配置: {best['factory']} nprobe={best['nprobe']} "
+              f"recall={best['recall']:.4f}")
+
+    if args.dry_run:
+        return
+    if result["applied"]:
+        print("✅ 已写入索引元数据，当前索引的查询参数立即生效")
+    elif args.rebuild:
+        print("⚡ 按调优结果重建索引...")
+        rebuild_index(dataset_id)
+        print("✅ 索引已重建")
+    else:
+        print("✅ 已写入索引元数据，下一次构建索引时生效（或使用 --rebuild 立即重建）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+索引内存占用报告
+启动多个子进程（模拟多个 Flask / Celery 进程），每个进程加载全部数据集索引，
+分别在普通加载与内存映射加载两种模式下统计每个进程的常驻内存（RSS）、
+按共享比例分摊后的内存（PSS）以及共享页大小。PSS 需要 Linux 的 /proc/self/smaps_rollup。
+内存映射只有被访问的页才会进入内存，因此每个进程加载后先用同一组查询（按索引元数据中的 nprobe）检索，
+再统计内存，两种模式在相同的访问模式下对比。
+"""
+
+import sys
+import os
+import multiprocessing as mp
+import numpy as np
+from tabulate import tabulate
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+
+
+def read_memory_kb():
+    """读取当前进程内存（KB）：Rss、Pss、共享页；非 Linux 环境只返回峰值 RSS"""
+    result = {"rss": None, "pss": None, "shared": None}
+    try:
+        with open("/proc/self/smaps_rollup", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    result[key.lower()] = int(value.split()[0])
+                elif key in ("Shared_Clean", "Shared_Dirty"):
+                    result["shared"] = (result["shared"] or 0) + int(value.split()[0])
+    except OSError:
+        import resource
+        result["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def load_queries(num_queries):
+    """从数据库随机抽取图片特征作为查询集，数据库为空时使用固定种子的随机向量"""
+    from backend.database_module.query import query_multi
+    rows = query_multi("images", columns="feature_vector", order_by="RANDOM()", limit=num_queries) or []
+    vectors = [np.frombuffer(row[0], dtype=np.float32) for row in rows if row[0]]
+    vectors = [v for v in vectors if v.shape[0] == config.VECTOR_DIM]
+    if vectors:
+        return np.stack(vectors).astype('float32')
+    print("⚠️  数据库中没有可用特征，使用随机向量作为查询")
+    return np.random.default_rng(0).standard_normal((num_queries, config.VECTOR_DIM)).astype('float32')
+
+
+def child(index_paths, mmap, queries, k, barrier, results):
+    """子进程：记录加载前内存，加载全部索引并执行查询，待所有进程完成后再记录内存"""
+    from backend.faiss_module.indexer import FaissIndexer
+    before = read_memory_kb()
+    indexers = []
+    mapped = 0
+    for path in index_paths:
+        indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=path, use_IVF=True)
+        indexer.load_index(mmap=mmap)
+        mapped += int(indexer.mmap)
+        indexers.append(indexer)
+    # 执行代表性查询，使内存映射模式下查询会访问的倒排表页真正进入内存
+    for indexer in indexers:
+        indexer.search(queries, k)
+    # 所有进程都完成查询后再统计，保证共享页已被各进程映射
+    barrier.wait()
+    after = read_memory_kb()
+    results.put((os.getpid(), before, after, mapped))
+    barrier.wait()
+
+
+def run_mode(index_paths, mmap, processes, queries, k):
+    """在指定加载模式下启动多个子进程，返回各进程的内存统计"""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=child, args=(index_paths, mmap, queries, k, barrier, results)) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    stats = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    return stats
+
+
+def fmt_mb(kb):
+    return f"{kb / 1024:.1f}" if kb is not None else "N/A"
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='索引内存占用报告')
+    parser.add_argument('--processes', type=int, default=3,
+                        help='模拟的进程数 (默认: 3)')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='统计内存前每个进程执行的查询数 (默认: 200)')
+    parser.add_argument('--k', type=int, default=10,
+                        help='每个查询返回的结果数 (默认: 10)')
+    args = parser.parse_args()
+
+    from backend.faiss_module.index_store import list_indexes, resolve_index_file
+    index_paths = list_indexes(config.INDEX_FOLDER)
+    if not index_paths:
+        print(f"❌ {config.INDEX_FOLDER} 下没有索引文件")
+        return
+    total_mb = sum(os.path.getsize(resolve_index_file(p)) for p in index_paths) / 1024 / 1024
+    queries = load_queries(args.queries)
+    print(f"索引文件 {len(index_paths)} 个，共 {total_mb:.1f} MB，进程数 {args.processes}，"
+          f"每进程查询 {queries.shape[0]} 条 (k={args.k})")
+
+    headers = ['模式', '进程', '映射索引数', '加载前RSS(MB)', '查询后RSS(MB)', '查询后PSS(MB)', '共享页(MB)']
+    table_data = []
+    totals = {}
+    for mmap in (False, True):
+        mode = "mmap" if mmap else "普通加载"
+        print(f"\n⚡ 测试模式: {mode}")
+        stats = run_mode(index_paths, mmap, args.processes, queries, args.k)
+        totals[mode] = sum((after["pss"] or after["rss"] or 0) for _, _, after, _ in stats)
+        for pid, before, after, mapped in stats:
+            table_data.append([mode, pid, f"{mapped}/{len(index_paths)}", fmt_mb(before["rss"]),
+                               fmt_mb(after["rss"]), fmt_mb(after["pss"]), fmt_mb(after["shared"])])
+
+    print("\n📊 每进程内存占用")
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+    for mode, total in totals.items():
+        print(f"  {mode}: 全部进程合计 {fmt_mb(total)} MB（PSS，不可用时为 RSS）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+推理精度模式验证工具
+在已有数据集上对比 fp32 与 int8 / bf16 推理模式：
+1. 特征提取吞吐量及相对 fp32 的加速比
+2. 以各模式提取的查询特征检索已有索引文件时，相对 fp32 查询的 recall@k
+3. 全部用该模式重新提取特征（库+查询）时，相对 fp32 精确近邻的 recall@k
+"""
+
+import sys
+import os
+import time
+import numpy as np
+from PIL import Image
+from tabulate import tabulate
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+from backend.model_module.feature_extractor import feature_extractor, PRECISION_MODES
+from backend.database_module.query import query_one, query_multi
+from backend.faiss_module.indexer import FaissIndexer
+from backend.faiss_module.index_store import index_exists
+
+
+def load_dataset_images(dataset, limit):
+    """读取数据集 ID 和前 limit 张仍存在的图片路径"""
+    if str(dataset).isdigit():
+        row = query_one("datasets", where={"id": int(dataset)})
+    else:
+        row = query_one("datasets", where={"name": dataset})
+    if row is None:
+        raise ValueError(f"数据集 {dataset} 不存在")
+    dataset_id = row[0]
+    rows = query_multi("images", columns="image_path", where={"dataset_id": dataset_id}, order_by="id ASC")
+    paths = [r[0] for r in rows if os.path.exists(r[0])][:limit]
+    if not paths:
+        raise ValueError(f"数据集 {dataset} 没有可读取的图片")
+    return dataset_id, paths
+
+
+def extract(extractor, paths):
+    """提取全部图片特征，返回 (特征矩阵, 吞吐量 图像/秒)"""
+    tensors = []
+    for path in paths:
+        with Image.open(path) as img:
+            tensors.append(extractor.preprocess(img))
+    # 预热一次，避免首批次的内存分配计入耗时
+    extractor.calculate_tensors(tensors[:1])
+    start_time = time.time()
+    feats = []
+    for i in range(0, len(tensors), extractor.batchsize):
+        feats.append(extractor.calculate_tensors(tensors[i:i + extractor.batchsize]))
+    elapsed = time.time() - start_time
+    return np.concatenate(feats, axis=0), len(tensors) / elapsed if elapsed > 0 else 0.0
+
+
+def exact_knn(queries, base, k):
+    """暴力计算 L2 精确近邻，返回近邻下标矩阵"""
+    dists = (np.sum(queries ** 2, axis=1, keepdims=True)
+             + np.sum(base ** 2, axis=1)[None, :]
+             - 2 * queries @ base.T)
+    return np.argsort(dists, axis=1)[:, :k]
+
+
+def recall_at_k(truth, result):
+    """逐行计算两组近邻结果的重合比例后取平均"""
+    hits = [len(set(t) & set(r)) / len(t) for t, r in zip(truth, result) if len(t) > 0]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def search_existing_index(dataset_id, queries, k):
+    """用查询特征检索数据集已有索引（按清单解析当前版本），返回每个查询的 ID 列表"""
+    index_path = os.path.join(config.INDEX_FOLDER, f"{dataset_id}.index")
+    if not index_exists(index_path):
+        raise FileNotFoundError(f"数据集 {dataset_id} 没有已发布的索引")
+    indexer = FaissIndexer(dim=config.VECTOR_DIM, index_path=index_path, use_IVF=True)
+    indexer.load_index()
+    _, ids = indexer.search(queries.astype('float32'), k)
+    return [[i for i in row if i >= 0] for row in ids]
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='推理精度模式验证工具')
+    parser.add_argument('--dataset', required=True,
+                        help='数据集名称或 ID')
+    parser.add_argument('--modes', default='int8,bf16',
+                        help=f'待验证的精度模式，逗号分隔，可选: {",".join(PRECISION_MODES)}')
+    parser.add_argument('--limit', type=int, default=500,
+                        help='参与验证的最大图片数 (默认: 500)')
+    parser.add_argument('--queries', type=int, default=50,
+                        help='查询图片数 (默认: 50)')
+    parser.add_argument('--k', type=int, default=10,
+                        help='recall@k 的 k (默认: 10)')
+    args = parser.parse_args()
+
+    dataset_id, paths = load_dataset_images(args.dataset, args.limit)
+    k = min(args.k, len(paths))
+    n_queries = min(args.queries, len(paths))
+    print(f"数据集 ID: {dataset_id}, 图片数: {len(paths)}, 查询数: {n_queries}, k={k}")
+
+    print("\n⚡ 提取 fp32 基准特征...")
+    fp32_feats, fp32_throughput = extract(feature_extractor(precision="fp32"), paths)
+    fp32_truth = exact_knn(fp32_feats[:n_queries], fp32_feats, k)
+    try:
+        fp32_index_result = search_existing_index(dataset_id, fp32_feats[:n_queries], k)
+    except FileNotFoundError as e:
+        print(f"⚠️  {e}，跳过已有索引检索对比")
+        fp32_index_result = None
+
+    table_data = [["fp32", f"{fp32_throughput:.2f}", "1.00x", "1.0000", "1.0000"]]
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode == "fp32":
+            continue
+        print(f"\n⚡ 提取 {mode} 特征...")
+        extractor = feature_extractor(precision=mode)
+        if extractor.precision != mode:
+            print(f"⚠️  {mode} 不可用，已回退到 {extractor.precision}")
+        feats, throughput = extract(extractor, paths)
+        rebuild_recall = recall_at_k(fp32_truth, exact_knn(feats[:n_queries], feats, k))
+        if fp32_index_result is not None:
+            index_result = search_existing_index(dataset_id, feats[:n_queries], k)
+            index_recall = f"{recall_at_k(fp32_index_result, index_result):.4f}"
+        else:
+            index_recall = "N/A"
+        speedup = throughput / fp32_throughput if fp32_throughput > 0 else 0.0
+        table_data.append([extractor.precision if extractor.precision != mode else mode,
+                           f"{throughput:.2f}", f"{speedup:.2f}x", index_recall, f"{rebuild_recall:.4f}"])
+
+    print("\n📊 推理精度模式对比")
+    headers = ['模式', '吞吐量(图像/s)', '加速比', f'已有索引 recall@{k}', f'重建 recall@{k}']
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
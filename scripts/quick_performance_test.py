@@ -53,6 +53,8 @@ def test_current_config():
     # 实例化特征提取器
     from backend.model_module.feature_extractor import feature_extractor
     extractor = feature_extractor()
+    source = "TorchScript 产物" if extractor.scripted else "torchvision 构建"
+    print(f"  模型加载耗时: {extractor.load_seconds:.2f}s ({source})")
     
     # 单图像测试
     print("  单图像处理:")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+降维阶段基准测试
+在已有数据集的特征上，对比不降维、PCA 降维、OPQ 降维（不同目标维度）时：
+1. 相对原始维度 Flat 精确检索的 recall@k
+2. 平均单查询延迟
+3. 构建耗时与序列化后的索引大小
+索引主体结构与线上一致（IVF√N,SQ8，nprobe 为默认值，度量为 config.INDEX_METRIC），
+只改变 config.INDEX_REDUCE / INDEX_REDUCED_DIM。
+"""
+
+import sys
+import os
+import math
+import numpy as np
+from tabulate import tabulate
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+from backend.database_module.query import query_one
+
+
+def load_features(dataset):
+    """读取数据集的全部特征"""
+    from backend.index_manage_module.api import get_dataset_image_features
+    if str(dataset).isdigit():
+        row = query_one("datasets", where={"id": int(dataset)})
+    else:
+        row = query_one("datasets", where={"name": dataset})
+    if row is None:
+        raise ValueError(f"数据集 {dataset} 不存在")
+    pairs = get_dataset_image_features(row[0])
+    if not pairs:
+        raise ValueError(f"数据集 {dataset} 没有图片特征")
+    return np.stack([vec for _, vec in pairs]).astype('float32')
+
+
+def main():
+    """主函数"""
+    import argparse
+    import faiss
+    from backend.faiss_module.indexer import reduction_prefix, default_nprobe, index_metric, normalize_vectors
+    from backend.faiss_module.autotune import exact_ground_truth, train_index, evaluate_search
+
+    parser = argparse.ArgumentParser(description='降维阶段基准测试')
+    parser.add_argument('--dataset', required=True,
+                        help='数据集名称或 ID')
+    parser.add_argument('--dims', default='512,256,128',
+                        help='降维后的维度，逗号分隔 (默认: 512,256,128)')
+    parser.add_argument('--methods', default='pca,opq',
+                        help='降维方式，逗号分隔 (默认: pca,opq)')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='抽样查询数 (默认: 200)')
+    parser.add_argument('--k', type=int, default=10,
+                        help='recall@k 的 k (默认: 10)')
+    args = parser.parse_args()
+
+    metric = index_metric()
+    features = load_features(args.dataset)
+    if metric == "cosine":
+        features = normalize_vectors(features)
+    num_data, dim = features.shape
+    k = min(args.k, num_data)
+    rng = np.random.default_rng(0)
+    queries = features[rng.choice(num_data, size=min(args.queries, num_data), replace=False)]
+    train = features[rng.choice(num_data, size=min(config.INDEX_TRAIN_SAMPLE_SIZE, num_data), replace=False)]
+    nlist = max(1, int(math.sqrt(num_data)))
+    nprobe = default_nprobe(nlist)
+    print(f"特征数: {num_data}, 维度: {dim}, 查询数: {queries.shape[0]}, k={k}, IVF{nlist},SQ8 nprobe={nprobe}, 度量={metric}")
+
+    gt_ids, flat_ms = exact_ground_truth(features, queries, k, metric)
+    headers = ['降维', '维度', '索引结构', f'recall@{k}', '延迟(ms/查询)', '构建(s)', '索引大小(MB)']
+    table_data = [["精确检索", dim, "Flat", "1.0000", f"{flat_ms:.3f}", "-", f"{features.nbytes / 1024 / 1024:.1f}"]]
+
+    original = (getattr(config, "INDEX_REDUCE", None), getattr(config, "INDEX_REDUCED_DIM", 256))
+    settings = [(None, dim)]
+    for method in [m.strip() for m in args.methods.split(",") if m.strip()]:
+        for d in [int(x) for x in args.dims.split(",") if x.strip()]:
+            settings.append((method, d))
+    try:
+        for method, d in settings:
+            config.INDEX_REDUCE, config.INDEX_REDUCED_DIM = method, d
+            prefix, reduced_dim = reduction_prefix(dim, num_data)
+            if method and not prefix:
+                continue
+            factory = f"{prefix}IVF{nlist},SQ8"
+            print(f"\n⚡ 测试 {factory}")
+            index, build_seconds = train_index(factory, train, features, metric)
+            recall, avg_ms = evaluate_search(index, queries, gt_ids, k, nprobe=nprobe)
+            size_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+            table_data.append([method or "无", reduced_dim, factory, f"{recall:.4f}", f"{avg_ms:.3f}",
+                               f"{build_seconds:.2f}", f"{size_mb:.1f}"])
+            del index
+    finally:
+        config.INDEX_REDUCE, config.INDEX_REDUCED_DIM = original
+
+    print("\n📊 降维效果对比")
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+    print("💡 在 config.py 中设置 INDEX_REDUCE 与 INDEX_REDUCED_DIM 后重建索引即可启用降维")
+
+
+if __name__ == "__main__":
+    main()
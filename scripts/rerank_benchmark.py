@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+精确重排序基准测试
+在已有数据集的特征上（度量为 config.INDEX_METRIC），对比压缩索引（默认 IVF√N,SQ8）直接返回结果与
+多取 k' 个候选后用全精度特征精确重排序时：
+1. 相对 Flat 精确检索的 recall@k
+2. 返回的相似度百分比与精确相似度的平均/最大误差
+3. 平均单查询延迟（含重排序）
+"""
+
+import sys
+import os
+import math
+import time
+import numpy as np
+from tabulate import tabulate
+
+# 添加路径
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend")))
+
+from config import config
+from reduction_benchmark import load_features
+
+
+def similarity_error(queries, features, labels, distances, metric):
+    """返回结果的相似度与按全精度特征计算的精确相似度之差（百分点），返回 (平均, 最大)"""
+    from backend.faiss_module.faiss_utils.similarity_utils import score_to_similarity_percent
+    valid = labels >= 0
+    vectors = features[labels[valid]]
+    repeated = np.repeat(queries, labels.shape[1], axis=0)[valid.reshape(-1)]
+    if metric == "cosine":
+        exact = np.einsum("ij,ij->i", vectors, repeated)
+    else:
+        diff = vectors - repeated
+        exact = np.einsum("ij,ij->i", diff, diff)
+    error = np.abs(score_to_similarity_percent(distances[valid], metric) - score_to_similarity_percent(exact, metric))
+    return float(error.mean()), float(error.max())
+
+
+def time_search(search, queries):
+    """逐条查询（与在线检索一致），返回 (distances, labels, avg_ms)"""
+    results = []
+    start_time = time.perf_counter()
+    for i in range(queries.shape[0]):
+        results.append(search(queries[i:i + 1]))
+    avg_ms = (time.perf_counter() - start_time) * 1000.0 / queries.shape[0]
+    distances = np.concatenate([d for d, _ in results], axis=0)
+    labels = np.concatenate([l for _, l in results], axis=0)
+    return distances, labels, avg_ms
+
+
+def main():
+    """主函数"""
+    import argparse
+    import faiss
+    from backend.faiss_module.indexer import reduction_prefix, default_nprobe, index_metric, normalize_vectors
+    from backend.faiss_module.autotune import exact_ground_truth, train_index, _recall_at_k
+    from backend.faiss_module.feature_store import FeatureStore, rerank_exact
+
+    parser = argparse.ArgumentParser(description='精确重排序基准测试')
+    parser.add_argument('--dataset', required=True,
+                        help='数据集名称或 ID')
+    parser.add_argument('--encoding', default='SQ8',
+                        help='IVF 向量编码 (默认: SQ8)')
+    parser.add_argument('--factors', default='2,4,8',
+                        help="候选数 k' 相对 k 的倍数，逗号分隔 (默认: 2,4,8)")
+    parser.add_argument('--queries', type=int, default=200,
+                        help='抽样查询数 (默认: 200)')
+    parser.add_argument('--k', type=int, default=10,
+                        help='recall@k 的 k (默认: 10)')
+    args = parser.parse_args()
+
+    metric = index_metric()
+    features = load_features(args.dataset)
+    if metric == "cosine":
+        features = normalize_vectors(features)
+    num_data, dim = features.shape
+    k = min(args.k, num_data)
+    rng = np.random.default_rng(0)
+    queries = features[rng.choice(num_data, size=min(args.queries, num_data), replace=False)]
+    train = features[rng.choice(num_data, size=min(config.INDEX_TRAIN_SAMPLE_SIZE, num_data), replace=False)]
+    nlist = max(1, int(math.sqrt(num_data)))
+    nprobe = default_nprobe(nlist)
+    prefix, _ = reduction_prefix(dim, num_data)
+    factory = f"{prefix}IVF{nlist},{args.encoding}"
+    print(f"特征数: {num_data}, 维度: {dim}, 查询数: {queries.shape[0]}, k={k}, {factory} nprobe={nprobe}, 度量={metric}")
+
+    gt_ids, flat_ms = exact_ground_truth(features, queries, k, metric)
+    index, _ = train_index(factory, train, features, metric)
+    params = faiss.SearchParametersIVF(nprobe=nprobe)
+    # 标签为行号，特征存储直接使用内存中的特征矩阵
+    store = FeatureStore(np.arange(num_data, dtype='int64'), features)
+
+    headers = ['模式', "候选数 k'", f'recall@{k}', '相似度平均误差', '相似度最大误差', '延迟(ms/查询)']
+    table_data = [["Flat 精确检索", k, "1.0000", "0.000", "0.000", f"{flat_ms:.3f}"]]
+
+    distances, labels, avg_ms = time_search(lambda q: index.search(q, k, params=params), queries)
+    mean_err, max_err = similarity_error(queries, features, labels, distances, metric)
+    table_data.append([f"{factory} 直接返回", k, f"{_recall_at_k(labels, gt_ids, k):.4f}",
+                       f"{mean_err:.3f}", f"{max_err:.3f}", f"{avg_ms:.3f}"])
+
+    for factor in [int(x) for x in args.factors.split(",") if x.strip()]:
+        k_prime = min(num_data, k * factor)
+        print(f"\n⚡ 测试重排序 k'={k_prime}")
+
+        def search(q):
+            d, l = index.search(q, k_prime, params=params)
+            return rerank_exact(q, l, d, [store], k, metric=metric)
+
+        distances, labels, avg_ms = time_search(search, queries)
+        mean_err, max_err = similarity_error(queries, features, labels, distances, metric)
+        table_data.append([f"{factory} + 精确重排序", k_prime, f"{_recall_at_k(labels, gt_ids, k):.4f}",
+                           f"{mean_err:.3f}", f"{max_err:.3f}", f"{avg_ms:.3f}"])
+
+    print("\n📊 精确重排序效果对比")
+    print(tabulate(table_data, headers=headers, tablefmt='grid'))
+    print("💡 在 config.py 中开启 INDEX_STORE_VECTORS 并重建索引，再设置 SEARCH_RERANK_K 或在检索请求中传入 rerank_k 即可启用重排序")
+
+
+if __name__ == "__main__":
+    main()
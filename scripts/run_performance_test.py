@@ -28,12 +28,14 @@ def run_script(script_name, args=None):
 
 def main():
     parser = argparse.ArgumentParser(description='性能测试启动器')
-    parser.add_argument('command', choices=['quick', 'full', 'optimize', 'verify', 'examples'],
+    parser.add_argument('command', choices=['quick', 'full', 'optimize', 'verify', 'examples', 'decode', 'reduce', 'rerank'],
                       help='要运行的测试类型')
     parser.add_argument('--images', type=int, default=20,
                       help='测试图像数量')
     parser.add_argument('--mode', choices=['full', 'grid', 'adaptive'], default='full',
                       help='优化模式')
+    parser.add_argument('--dataset',
+                      help='数据集名称或 ID（reduce / rerank 测试使用）')
     
     args = parser.parse_args()
     
@@ -59,6 +61,24 @@ def main():
     elif args.command == 'examples':
         print("开始运行示例...")
         success = run_script("performance_examples.py")
+
+    elif args.command == 'decode':
+        print("开始降分辨率解码基准测试...")
+        success = run_script("decode_benchmark.py", ["--images", str(args.images)])
+
+    elif args.command == 'reduce':
+        if not args.dataset:
+            print("❌ reduce 测试需要 --dataset 参数")
+            sys.exit(1)
+        print("开始降维阶段基准测试...")
+        success = run_script("reduction_benchmark.py", ["--dataset", str(args.dataset)])
+
+    elif args.command == 'rerank':
+        if not args.dataset:
+            print("❌ rerank 测试需要 --dataset 参数")
+            sys.exit(1)
+        print("开始精确重排序基准测试...")
+        success = run_script("rerank_benchmark.py", ["--dataset", str(args.dataset)])
     
     if success:
         print("\n✅ 测试完成!")